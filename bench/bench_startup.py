@@ -0,0 +1,106 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+# Cold start benchmark of the MCP server.
+#
+# Clients such as Cline or an ADK agent spawn `vedit_mcp.py` over stdio and wait for the `tools/list` answer before
+# the first tool can be used, so this is the latency the user sees when a session starts. Three numbers are measured
+# in fresh interpreters, `runs` times each:
+#
+# - import_engine: `import vedit`, the engine without the MCP server (library mode).
+# - import_server: `import vedit.server`, the engine plus FastMCP and the tool registrations.
+# - ready: from spawning `vedit_mcp.py` until the answer of `tools/list` arrives.
+#
+#   python bench/bench_startup.py --target_ms 1000
+#
+# The exit code is 1 when the median of `ready` misses the target, so it can guard against regressions in CI.
+
+PROJECT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Measure the cold start of the vedit-mcp server')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='Fresh interpreters per measurement, default is 5')
+    parser.add_argument('--target_ms', type=float, default=1000,
+                        help='Target for the median time until tools/list is answered, default is 1000')
+    parser.add_argument('--output', default=None,
+                        help='Result file in JSON, default is None (only print)')
+    return parser.parse_args()
+
+
+def time_import(module: str) -> float:
+    started_at = time.perf_counter()
+    subprocess.run([sys.executable, '-c', f'import {module}'], cwd=PROJECT_PATH, check=True)
+    return time.perf_counter() - started_at
+
+
+def _request(process: subprocess.Popen, message: dict):
+    process.stdin.write(json.dumps(message) + "\n")
+    process.stdin.flush()
+
+
+def _response(process: subprocess.Popen, request_id: int) -> dict:
+    while True:
+        line = process.stdout.readline()
+        if not line:
+            raise RuntimeError("the server exited before answering")
+        message = json.loads(line)
+        if message.get("id") == request_id:
+            return message
+
+
+def time_ready(kb_dir: str) -> tuple[float, int]:
+    started_at = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(PROJECT_PATH, 'vedit_mcp.py'), '--kb_dir', kb_dir],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    try:
+        _request(process, {
+            "jsonrpc": "2.0", "id": 1, "method": "initialize",
+            "params": {
+                "protocolVersion": "2024-11-05",
+                "capabilities": {},
+                "clientInfo": {"name": "bench_startup", "version": "0"},
+            },
+        })
+        _response(process, 1)
+        _request(process, {"jsonrpc": "2.0", "method": "notifications/initialized"})
+        _request(process, {"jsonrpc": "2.0", "id": 2, "method": "tools/list"})
+        tools = _response(process, 2)["result"]["tools"]
+        return time.perf_counter() - started_at, len(tools)
+    finally:
+        process.kill()
+        process.wait()
+
+
+def main():
+    bench_args = parse_args()
+    kb_dir = tempfile.mkdtemp(prefix='vedit_startup_')
+    results = {"import_engine": [], "import_server": [], "ready": []}
+    tool_count = 0
+    for _ in range(bench_args.runs):
+        results["import_engine"].append(time_import('vedit'))
+        results["import_server"].append(time_import('vedit.server'))
+        ready, tool_count = time_ready(kb_dir)
+        results["ready"].append(ready)
+
+    medians = {name: statistics.median(values) * 1000 for name, values in results.items()}
+    for name, value in medians.items():
+        print(f"{name:<14} median={value:.0f}ms min={min(results[name]) * 1000:.0f}ms")
+    passed = medians["ready"] <= bench_args.target_ms
+    print(f"{tool_count} tools, target {bench_args.target_ms:.0f}ms: {'ok' if passed else 'MISSED'}")
+
+    if bench_args.output:
+        with open(bench_args.output, 'w', encoding='utf-8') as f:
+            json.dump({"runs": results, "median_ms": medians, "target_ms": bench_args.target_ms}, f, indent=2)
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import asyncio
+# Benchmark of the vedit-mcp tools on synthetic media.
+#
+# The test media is generated locally with the lavfi `testsrc2`/`sine` sources, so the benchmark runs offline on any
+# CPU-only box and every run uses the same input. Each scenario calls a tool `concurrency` times at once, `repeat`
+# times in a row, and the latencies and the throughput are written to a JSON file that can be compared with the
+# result of another commit:
+#
+#   python bench/bench_vedit.py --output before.json
+#   git checkout <other commit>
+#   python bench/bench_vedit.py --output after.json --compare before.json
+#
+# The render cache is disabled, so every call really runs ffmpeg.
+
+PROJECT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (name, duration in seconds, resolution, video encoder)
+MEDIA = [
+    ("short_360p_h264", 10, "640x360", "libx264"),
+    ("long_720p_h264", 60, "1280x720", "libx264"),
+    ("short_360p_mpeg4", 10, "640x360", "mpeg4"),
+]
+QUICK_MEDIA = [
+    ("short_360p_h264", 10, "640x360", "libx264"),
+    ("short_360p_mpeg4", 10, "640x360", "mpeg4"),
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the vedit-mcp tools on synthetic media')
+    parser.add_argument('--work_dir', default=None,
+                        help='Folder for the generated media and outputs, default is a temporary folder')
+    parser.add_argument('--concurrency', default='1,2,4',
+                        help='Comma separated concurrency levels, default is 1,2,4')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Rounds per scenario and concurrency level, default is 3')
+    parser.add_argument('--quick', action='store_true',
+                        help='Only use the short media')
+    parser.add_argument('--output', default=None,
+                        help='Result file, default is bench_<commit>.json in the current folder')
+    parser.add_argument('--compare', default=None,
+                        help='A previous result file to compare with')
+    return parser.parse_args()
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_PATH, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def ffmpeg_version() -> str:
+    return subprocess.check_output(['ffmpeg', '-version']).decode().splitlines()[0]
+
+
+def available_encoders() -> set[str]:
+    output = subprocess.check_output(['ffmpeg', '-hide_banner', '-encoders']).decode()
+    return {line.split()[1] for line in output.splitlines() if len(line.split()) > 1}
+
+
+def generate_media(kb_dir: str, media: list[tuple]) -> list[tuple]:
+    # Bit-exact flags and a fixed GOP make the files identical from run to run.
+    raw_dir = os.path.join(kb_dir, "raw")
+    os.makedirs(raw_dir, exist_ok=True)
+    encoders = available_encoders()
+    generated = []
+    for name, duration, size, encoder in media:
+        if encoder not in encoders:
+            print(f"skip {name}: encoder {encoder} is not available")
+            continue
+        path = os.path.join(raw_dir, f"{name}.mp4")
+        if not os.path.exists(path):
+            subprocess.run([
+                'ffmpeg', '-v', 'error', '-y',
+                '-f', 'lavfi', '-i', f"testsrc2=size={size}:rate=25:duration={duration}",
+                '-f', 'lavfi', '-i', f"sine=frequency=440:sample_rate=48000:duration={duration}",
+                '-c:v', encoder, '-g', '50', '-pix_fmt', 'yuv420p',
+                '-c:a', 'aac', '-ac', '2',
+                '-fflags', '+bitexact', '-flags:v', '+bitexact', '-flags:a', '+bitexact',
+                path
+            ], check=True)
+        generated.append((name, duration, path))
+
+    bgm_path = os.path.join(raw_dir, "bgm.wav")
+    if not os.path.exists(bgm_path):
+        subprocess.run([
+            'ffmpeg', '-v', 'error', '-y',
+            '-f', 'lavfi', '-i', "sine=frequency=220:sample_rate=44100:duration=120",
+            '-fflags', '+bitexact', bgm_path
+        ], check=True)
+    return generated
+
+
+def scenarios(server, kb_dir: str, media: list[tuple]) -> list[tuple]:
+    """
+    :return: (scenario name, media name, factory) tuples, the factory takes a unique call id and returns the coroutine.
+    """
+    result = []
+    for name, duration, path in media:
+        relative = os.path.relpath(path, kb_dir)
+        start, stop = duration * 0.2, duration * 0.6
+        result.append(("clip_keyframe", name, lambda i, r=relative, a=start, b=stop:
+                       server.clip_video_tool(r, "bench", a, b, f"clip_keyframe_{i}")))
+        result.append(("clip_smart", name, lambda i, r=relative, a=start, b=stop:
+                       server.clip_video_tool(r, "bench", a, b, f"clip_smart_{i}", "smart")))
+        result.append(("merge_copy", name, lambda i, r=relative:
+                       server.merge_videos_tool([r, r], f"bench_{i}")))
+        result.append(("add_bgm", name, lambda i, r=relative:
+                       server.add_bgm_tool(r, "raw/bgm.wav")))
+    if len(media) > 1:
+        paths = [os.path.relpath(path, kb_dir) for _, _, path in media]
+        result.append(("merge_mixed", "+".join(name for name, _, _ in media), lambda i, p=paths:
+                       server.merge_videos_tool(p, f"bench_{i}")))
+    return result
+
+
+async def run_round(factory, concurrency: int, offset: int) -> tuple[list[float], int, float]:
+    async def timed(i):
+        started_at = time.perf_counter()
+        result = await factory(i)
+        ok = result.get("success", False) if isinstance(result, dict) else False
+        return time.perf_counter() - started_at, ok
+
+    started_at = time.perf_counter()
+    results = await asyncio.gather(*[timed(offset + i) for i in range(concurrency)])
+    wall = time.perf_counter() - started_at
+    return [latency for latency, _ in results], sum(1 for _, ok in results if not ok), wall
+
+
+async def run_benchmarks(server, kb_dir: str, media: list[tuple], levels: list[int], repeat: int) -> list[dict]:
+    results = []
+    call_id = 0
+    for scenario, media_name, factory in scenarios(server, kb_dir, media):
+        # One untimed call warms up the metadata cache, like on a server that has seen the file before.
+        await factory(call_id)
+        call_id += 1
+        for concurrency in levels:
+            latencies, errors, wall = [], 0, 0.0
+            for _ in range(repeat):
+                round_latencies, round_errors, round_wall = await run_round(factory, concurrency, call_id)
+                call_id += concurrency
+                latencies += round_latencies
+                errors += round_errors
+                wall += round_wall
+            latencies.sort()
+            entry = {
+                "scenario": scenario,
+                "media": media_name,
+                "concurrency": concurrency,
+                "calls": len(latencies),
+                "errors": errors,
+                "latency_mean": statistics.mean(latencies),
+                "latency_p50": latencies[len(latencies) // 2],
+                "latency_p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                "throughput": len(latencies) / wall,
+            }
+            results.append(entry)
+            print(f"{scenario:<14} {media_name:<40} c={concurrency:<3} p50={entry['latency_p50']:.3f}s "
+                  f"p95={entry['latency_p95']:.3f}s {entry['throughput']:.2f} calls/s errors={errors}")
+    return results
+
+
+def compare(results: list[dict], previous_path: str):
+    with open(previous_path, 'r', encoding='utf-8') as f:
+        previous = json.load(f)
+    index = {(x["scenario"], x["media"], x["concurrency"]): x for x in previous["results"]}
+    print(f"\ncompared with {previous['meta']['commit']} ({previous_path}):")
+    for entry in results:
+        old = index.get((entry["scenario"], entry["media"], entry["concurrency"]))
+        if old is None:
+            continue
+        change = (entry["latency_p50"] - old["latency_p50"]) / old["latency_p50"] * 100 if old["latency_p50"] else 0.0
+        print(f"{entry['scenario']:<14} {entry['media']:<40} c={entry['concurrency']:<3} "
+              f"p50 {old['latency_p50']:.3f}s -> {entry['latency_p50']:.3f}s ({change:+.1f}%)")
+
+
+def main():
+    bench_args = parse_args()
+    levels = [int(x) for x in bench_args.concurrency.split(',')]
+    work_dir = bench_args.work_dir or tempfile.mkdtemp(prefix='vedit_bench_')
+    kb_dir = os.path.join(work_dir, "kb")
+    os.makedirs(kb_dir, exist_ok=True)
+    media = generate_media(kb_dir, QUICK_MEDIA if bench_args.quick else MEDIA)
+
+    sys.path.insert(0, PROJECT_PATH)
+    import vedit
+    from vedit import server
+
+    vedit.configure(vedit.VeditConfig(kb_dir=kb_dir, render_cache_mb=0))
+    results = asyncio.run(run_benchmarks(server, kb_dir, media, levels, bench_args.repeat))
+    commit = git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "ffmpeg": ffmpeg_version(),
+            "repeat": bench_args.repeat,
+        },
+        "results": results,
+    }
+    output = bench_args.output or f"bench_{commit}.json"
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nresults written to {output}")
+    if bench_args.compare:
+        compare(results, bench_args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+import json
+import pytest
+import vedit
+from vedit import probe
+
+
+@pytest.fixture
+def kb_dir(tmp_path):
+    # A fresh `kb_dir` per test, the lazy singletons are rebuilt from it.
+    vedit.configure(vedit.VeditConfig(kb_dir=str(tmp_path)))
+    return str(tmp_path)
+
+
+FFPROBE_OUTPUT = {
+    "format": {"duration": "12.5", "bit_rate": "800000", "format_name": "mov,mp4,m4a,3gp,3g2,mj2"},
+    "streams": [
+        {"index": 0, "codec_type": "video", "codec_name": "h264", "width": 1280, "height": 720,
+         "avg_frame_rate": "30000/1001", "time_base": "1/30000"},
+        {"index": 1, "codec_type": "audio", "codec_name": "aac", "sample_rate": "48000", "channels": 2},
+    ],
+}
+
+
+@pytest.fixture
+def commands(kb_dir, monkeypatch):
+    # The commands `probe` would run, answered without ffprobe.
+    commands = []
+
+    async def run_command(command, **kwargs):
+        commands.append(command)
+        if '-show_entries' in command and command[command.index('-show_entries') + 1].startswith('packet'):
+            return b"0.000000,K__\n1.000000,___\n2.000000,K__\n"
+        return json.dumps(FFPROBE_OUTPUT).encode()
+
+    monkeypatch.setattr(probe, "run_command", run_command)
+    return commands
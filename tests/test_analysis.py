@@ -0,0 +1,42 @@
+import math
+from vedit.analysis import _ChunkReport, _join_spans
+
+REPORT = """\
+[Parsed_metadata_4 @ 0x55a1] frame:12 pts:12 pts_time:3
+[Parsed_metadata_4 @ 0x55a1] lavfi.scene_score=0.812
+[blackdetect @ 0x55a2] black_start:4 black_end:5.5 black_duration:1.5
+[silencedetect @ 0x55a3] silence_start: 1.2
+[silencedetect @ 0x55a3] silence_end: 2.7 | silence_duration: 1.5
+[Parsed_ametadata_5 @ 0x55a4] frame:0 pts:0 pts_time:0
+[Parsed_ametadata_5 @ 0x55a4] lavfi.astats.Overall.RMS_level=-inf
+[Parsed_ametadata_5 @ 0x55a4] frame:1 pts:40000 pts_time:5
+[Parsed_ametadata_5 @ 0x55a4] lavfi.astats.Overall.RMS_level=-20.5
+[silencedetect @ 0x55a3] silence_start: 8
+frame=  40 fps=0.0 q=-0.0 Lsize=N/A time=00:00:10.00
+"""
+
+
+def test_chunk_report_in_the_time_of_the_file():
+    report = _ChunkReport(60, 10)
+    for line in REPORT.splitlines():
+        report.add(line)
+    events = report.finish()
+    assert ("scene", 63, 63, 0.812) in events
+    assert ("black", 64, 65.5, None) in events
+    assert ("silence", 61.2, 62.7, None) in events
+    assert ("level", 60, 65, None) in events
+    assert ("level", 65, 70, -20.5) in events
+    # The open silence runs to the end of the chunk.
+    assert ("silence", 68, 70, None) in events
+    assert len(events) == 6
+
+
+def test_chunk_report_of_the_last_chunk():
+    report = _ChunkReport(0, math.inf)
+    report.add("[silencedetect @ 0x1] silence_start: -0.01")
+    assert report.finish() == [("silence", 0.0, math.inf, None)]
+
+
+def test_join_spans_across_chunk_boundaries():
+    events = [("silence", 50, 60, None), ("silence", 60, 65, None), ("scene", 55, 55, 0.5), ("black", 10, 11, None)]
+    assert _join_spans(events) == [("black", 10, 11, None), ("silence", 50, 65, None), ("scene", 55, 55, 0.5)]
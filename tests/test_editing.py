@@ -0,0 +1,81 @@
+import os
+import asyncio
+from vedit import editing
+from vedit.editing import check_timeline, render_timeline, clip_segments
+
+
+def test_check_timeline_accepts_a_well_formed_edit_list():
+    clips = [{"source": "a.mp4", "start": 0, "stop": 2.5}, {"source": "b.mp4", "start": 1.5, "stop": 4}]
+    assert check_timeline(clips, None) is None
+    assert check_timeline(clips, {"audio_path": "bgm.mp3", "volume": 0.3, "offset": 1}) is None
+
+
+def test_check_timeline_names_the_bad_clip():
+    good = {"source": "a.mp4", "start": 0, "stop": 2}
+    assert "Clip 1 needs the keys" in check_timeline([good, {"source": "b.mp4", "start": 0, "end": 2}], None)
+    assert "Clip 0 needs the keys" in check_timeline(["a.mp4"], None)
+    assert "Clip 2 needs a path" in check_timeline([good, good, {"source": "c.mp4", "start": "0", "stop": 2}], None)
+    assert "Clip 0 needs a path" in check_timeline([{"source": None, "start": 0, "stop": 2}], None)
+    assert "clip 1 must be greater" in check_timeline([good, {"source": "b.mp4", "start": 3, "stop": 3}], None)
+    assert "must be a list" in check_timeline({"source": "a.mp4"}, None)
+
+
+def test_check_timeline_background_music():
+    clips = [{"source": "a.mp4", "start": 0, "stop": 2}]
+    assert "audio_path" in check_timeline(clips, {"path": "bgm.mp3"})
+    assert "audio_path" in check_timeline(clips, "bgm.mp3")
+    assert "`volume`" in check_timeline(clips, {"audio_path": "bgm.mp3", "volume": "loud"})
+
+
+def test_render_timeline_reports_bad_clips(kb_dir):
+    success, output_path, message = asyncio.run(render_timeline(
+        [{"source": "a.mp4", "start": 0, "stop": 2}, {"source": "b.mp4", "begin": 0}], None, kb_dir + "/t.mp4"))
+    assert not success
+    assert output_path == ""
+    assert message.startswith("Error: Clip 1")
+
+
+def run_clip_segments(kb_dir, monkeypatch, segments):
+    # The ffmpeg commands are recorded, and their outputs written, instead of run.
+    commands = []
+
+    async def run_command(command, **kwargs):
+        commands.append(command)
+        for output_path in [arg for arg in command if arg.startswith(os.path.join(kb_dir, "clip"))]:
+            with open(output_path, 'wb') as f:
+                f.write(b'clip')
+        return b''
+
+    monkeypatch.setattr(editing, "run_command", run_command)
+    source = os.path.join(kb_dir, "a.mp4")
+    with open(source, 'wb') as f:
+        f.write(b'video')
+    return asyncio.run(clip_segments(source, os.path.join(kb_dir, "clip", "t"), segments)), commands
+
+
+def test_clip_segments_reports_bad_times_per_segment(kb_dir, monkeypatch):
+    results, commands = run_clip_segments(kb_dir, monkeypatch, [
+        {"start": 0, "stop": 2, "title": "a"},
+        {"start": "1", "stop": "10", "title": "b"},
+        {"start": None, "stop": 2, "title": "c"},
+        {"start": True, "stop": 2, "title": "d"},
+        {"start": 3, "stop": 3, "title": "e"},
+    ])
+    assert results[0] == (True, os.path.join(kb_dir, "clip", "t", "a.mp4"),
+                          "The video has been successfully cut and is being saved. ")
+    for success, output_path, message in results[1:4]:
+        assert not success and output_path == "" and "needs numbers" in message
+    assert "must be greater" in results[4][2]
+    assert len(commands) == 1 and commands[0].count('-i') == 1
+
+
+def test_clip_segments_rejects_duplicate_titles(kb_dir, monkeypatch):
+    results, commands = run_clip_segments(kb_dir, monkeypatch, [
+        {"start": 0, "stop": 2, "title": "a"},
+        {"start": 2, "stop": 4, "title": "b"},
+        {"start": 4, "stop": 6, "title": "a"},
+    ])
+    assert [success for success, _, _ in results] == [True, True, False]
+    assert results[2][2].startswith("Error: Segment 0 has the same title `a`")
+    output_paths = [arg for arg in commands[0] if arg.startswith(os.path.join(kb_dir, "clip"))]
+    assert output_paths == [os.path.join(kb_dir, "clip", "t", "a.mp4"), os.path.join(kb_dir, "clip", "t", "b.mp4")]
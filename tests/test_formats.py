@@ -0,0 +1,75 @@
+import os
+from vedit.formats import (
+    HLS_PLAYLIST, check_output_format, output_path_for, temp_output_for, output_args, replace_output, discard_output,
+    is_temporary,
+)
+
+
+def test_check_output_format():
+    assert check_output_format("mp4", "a.mkv") is None
+    assert check_output_format("faststart", "a.MP4") is None
+    assert check_output_format("hls", "a.mkv") is None
+    assert "Unknown output format" in check_output_format("webm", "a.mp4")
+    assert "needs an MP4 or MOV output" in check_output_format("fmp4", "a.mkv")
+
+
+def test_output_args():
+    assert output_args("mp4", "a.mp4") == []
+    assert output_args("faststart", "a.mp4") == ['-movflags', '+faststart']
+    assert '+frag_keyframe' in output_args("fmp4", "a.mp4")[1]
+    args = output_args("hls", os.path.join("out", HLS_PLAYLIST))
+    assert args[:2] == ['-f', 'hls']
+    assert args[args.index('-hls_segment_filename') + 1] == os.path.join("out", "segment_%05d.m4s")
+    assert args[args.index('-hls_segment_type') + 1] == 'fmp4'
+
+
+def test_file_output_is_renamed_into_place(tmp_path):
+    output_path = str(tmp_path / "result.mp4")
+    temp_path = temp_output_for(output_path, "faststart")
+    assert os.path.dirname(temp_path) == str(tmp_path)
+    assert is_temporary(os.path.basename(temp_path))
+    assert temp_path.endswith(".mp4")
+    with open(temp_path, 'wb') as f:
+        f.write(b'new')
+    replace_output(temp_path, output_path, "faststart")
+    discard_output(temp_path, "faststart")
+    assert os.listdir(tmp_path) == ["result.mp4"]
+
+
+def test_hls_folder_is_swapped_as_a_whole(tmp_path):
+    output_path = output_path_for(str(tmp_path / "result.mp4"), "hls")
+    assert output_path == str(tmp_path / "result" / HLS_PLAYLIST)
+    os.makedirs(os.path.dirname(output_path))
+    (tmp_path / "result" / "segment_00009.m4s").write_bytes(b'old')
+
+    temp_path = temp_output_for(output_path, "hls")
+    temp_folder = os.path.dirname(temp_path)
+    # A hidden, temporary sibling of the final folder.
+    assert os.path.dirname(temp_folder) == str(tmp_path)
+    assert os.path.basename(temp_folder).startswith(".result.")
+    assert is_temporary(os.path.basename(temp_folder))
+    for name in (HLS_PLAYLIST, "init.mp4", "segment_00000.m4s"):
+        with open(os.path.join(temp_folder, name), 'wb') as f:
+            f.write(b'new')
+    replace_output(temp_path, output_path, "hls")
+    discard_output(temp_path, "hls")
+    assert sorted(os.listdir(tmp_path)) == ["result"]
+    assert sorted(os.listdir(tmp_path / "result")) == [HLS_PLAYLIST, "init.mp4", "segment_00000.m4s"]
+
+
+def test_discard_hls_output(tmp_path):
+    temp_path = temp_output_for(str(tmp_path / "result" / HLS_PLAYLIST), "hls")
+    discard_output(temp_path, "hls")
+    assert os.listdir(tmp_path) == []
+
+
+def test_is_temporary_matches_only_the_generated_names(tmp_path):
+    output_path = str(tmp_path / "result.mp4")
+    assert is_temporary(os.path.basename(temp_output_for(output_path, "mp4")))
+    assert is_temporary(".result.1234abcd.tmp")
+    assert is_temporary(".result.1234abcd.old.tmp")
+    # Titles a user chose.
+    assert not is_temporary("my.tmpl_intro.mp4")
+    assert not is_temporary("notes.tmp")
+    assert not is_temporary("draft.tmp.mp4")
+    assert not is_temporary("result.mp4")
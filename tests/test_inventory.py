@@ -0,0 +1,60 @@
+import os
+import asyncio
+from vedit.inventory import MediaIndexer, COMPACT_KEYS
+
+
+def make_media(kb_dir: str, *names: str) -> list[str]:
+    paths = []
+    for name in names:
+        path = os.path.join(kb_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'\0' * 100)
+        paths.append(path)
+    return paths
+
+
+def test_list_files_skips_caches_and_temporary_files(kb_dir):
+    make_media(kb_dir, "raw/a.mp4", "raw/b.MOV", "raw/notes.txt", "cache/render/x.mp4", "clip/t/c.1234abcd.tmp.mp4",
+               "clip/t/my.tmpl_intro.mp4")
+    indexer = MediaIndexer(kb_dir, 2)
+    assert [os.path.relpath(path, kb_dir) for path in indexer.list_files()] == [
+        "clip/t/my.tmpl_intro.mp4", "raw/a.mp4", "raw/b.MOV"]
+    assert [os.path.relpath(path, kb_dir) for path in indexer.list_files("raw/*.txt")] == ["raw/notes.txt"]
+
+
+def test_inventory_probes_only_the_headers_once(kb_dir, commands):
+    paths = make_media(kb_dir, "raw/a.mp4", "raw/b.mp4")
+    indexer = MediaIndexer(kb_dir, 2)
+
+    async def inventory():
+        return await indexer.inventory(paths)
+
+    entries, pending = asyncio.run(inventory())
+    assert pending == []
+    assert set(entries) == set(paths)
+    assert all(set(entry) == set(COMPACT_KEYS) for entry in entries.values())
+    # One header probe per file, no packet scan.
+    assert len(commands) == 2
+    assert not any(arg.startswith('packet') for command in commands for arg in command)
+
+    entries, _ = asyncio.run(inventory())
+    assert len(commands) == 2
+    assert entries[paths[0]]["duration"] == 12.5
+
+
+def test_inventory_without_waiting_leaves_new_files_pending(kb_dir, commands):
+    paths = make_media(kb_dir, "raw/a.mp4")
+    indexer = MediaIndexer(kb_dir, 2)
+    entries, pending = asyncio.run(indexer.inventory(paths, wait=False))
+    assert entries == {}
+    assert pending == paths
+    assert commands == []
+
+
+def test_temporary_outputs_are_not_indexed(kb_dir):
+    make_media(kb_dir, "merge/t/.result_1.abcd1234.tmp/init.mp4", "merge/t/result_2/init.mp4")
+    indexer = MediaIndexer(kb_dir, 2)
+    assert [os.path.relpath(path, kb_dir) for path in indexer.list_files()] == ["merge/t/result_2/init.mp4"]
+    assert [os.path.relpath(path, kb_dir) for path in indexer.list_files("merge/**/*.mp4")] == \
+        ["merge/t/result_2/init.mp4"]
@@ -0,0 +1,83 @@
+import os
+import sqlite3
+import asyncio
+from vedit.jobs import JobManager
+
+
+async def wait_for(manager: JobManager, job_id: str, statuses=("succeeded", "failed", "cancelled")) -> dict:
+    for _ in range(200):
+        job = manager.get(job_id)
+        if job["status"] in statuses:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"job {job_id} is still {job['status']}")
+
+
+def test_jobs_run_by_priority_and_survive_a_restart(tmp_path):
+    order = []
+
+    async def record(name: str) -> dict:
+        order.append(name)
+        return {"success": True, "name": name}
+
+    async def main():
+        manager = JobManager(str(tmp_path), 1, {"record": record})
+        # Submitted before the worker gets to run, so the priorities decide the order.
+        low = manager.submit("record", {"name": "low"})
+        high = manager.submit("record", {"name": "high"}, priority=5)
+        await wait_for(manager, low["job_id"])
+        await wait_for(manager, high["job_id"])
+        return low["job_id"]
+
+    job_id = asyncio.run(main())
+    assert order == ["high", "low"]
+    job = JobManager(str(tmp_path), 1, {"record": record}).get(job_id)
+    assert job["status"] == "succeeded"
+    assert job["result"] == {"success": True, "name": "low"}
+
+
+def test_failed_result_and_cancel(tmp_path):
+    async def fail() -> dict:
+        return {"success": False, "message": "Error: nope"}
+
+    async def sleep() -> dict:
+        await asyncio.sleep(10)
+        return {"success": True}
+
+    async def main():
+        manager = JobManager(str(tmp_path), 2, {"fail": fail, "sleep": sleep})
+        failed = await wait_for(manager, manager.submit("fail", {})["job_id"])
+        job_id = manager.submit("sleep", {})["job_id"]
+        await wait_for(manager, job_id, ("running",))
+        manager.cancel(job_id)
+        await asyncio.sleep(0.05)
+        return failed, manager.get(job_id), manager.active()
+
+    failed, cancelled, active = asyncio.run(main())
+    assert failed["status"] == "failed"
+    assert failed["error"] == "Error: nope"
+    assert cancelled["status"] == "cancelled"
+    assert active == []
+
+
+def test_a_locked_queue_does_not_block_the_event_loop(tmp_path):
+    async def record() -> dict:
+        return {"success": True}
+
+    async def main():
+        manager = JobManager(str(tmp_path), 1, {"record": record})
+        job_id = manager.submit("record", {})["job_id"]
+        # Another server process holds the write lock of the queue for a while.
+        other = sqlite3.connect(os.path.join(str(tmp_path), "jobs.sqlite"), isolation_level=None)
+        other.execute("BEGIN IMMEDIATE")
+        ticks = 0
+        for _ in range(20):
+            await asyncio.sleep(0.01)
+            ticks += 1
+        assert manager.get(job_id)["status"] == "queued"
+        other.execute("COMMIT")
+        return ticks, await wait_for(manager, job_id)
+
+    ticks, job = asyncio.run(main())
+    assert ticks == 20
+    assert job["status"] == "succeeded"
@@ -0,0 +1,54 @@
+import asyncio
+import pytest
+from vedit import probe
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / "a.mp4"
+    path.write_bytes(b'\0' * 100)
+    return str(path)
+
+
+def test_probe_video_reads_only_the_headers(commands, video):
+    info = asyncio.run(probe.probe_video(video))
+    assert len(commands) == 1
+    assert not any(arg.startswith('packet') for arg in commands[0])
+    assert info["duration"] == 12.5
+    assert info["video_codec"] == "h264"
+    assert info["has_audio"]
+    assert info["fps"] == pytest.approx(29.97, abs=0.01)
+    assert "keyframe_count" not in info
+
+
+def test_probe_video_is_cached_by_identity(commands, video):
+    asyncio.run(probe.probe_video(video))
+    asyncio.run(probe.probe_video(video))
+    assert len(commands) == 1
+    with open(video, 'ab') as f:
+        f.write(b'\0')
+    asyncio.run(probe.probe_video(video))
+    assert len(commands) == 2
+
+
+def test_keyframe_index_is_computed_on_demand(commands, video):
+    assert asyncio.run(probe.get_keyframe_index(video, compute=False)) is None
+    assert commands == []
+    keyframe_index = asyncio.run(probe.get_keyframe_index(video))
+    assert keyframe_index == {"times": [0.0, 2.0], "packets": [0, 2]}
+    assert asyncio.run(probe.get_keyframe_index(video, compute=False)) == keyframe_index
+    assert len(commands) == 1
+
+
+def test_split_at_keyframes_snaps_to_the_closest_keyframe():
+    keyframes = [0.0, 9.5, 19.0, 31.0, 40.5, 50.0]
+    assert probe.split_at_keyframes(60, keyframes, 3, 10) == [0.0, 19.0, 40.5]
+    # Without keyframes, e.g. for audio, the split is even.
+    assert probe.split_at_keyframes(60, [], 4, 10) == [0.0, 15.0, 30.0, 45.0]
+
+
+def test_split_at_keyframes_keeps_chunks_long_enough():
+    # Chunks shorter than half of `min_seconds` are merged into the previous one.
+    assert probe.split_at_keyframes(60, [0.0, 2.0, 58.0], 3, 30) == [0.0]
+    assert probe.split_at_keyframes(100, [0.0, 10.0, 50.0, 95.0], 4, 20) == [0.0, 10.0, 50.0]
+    assert probe.split_at_keyframes(10, [], 1, 60) == [0.0]
@@ -0,0 +1,112 @@
+import asyncio
+from collections import deque
+from vedit.process import (
+    STDERR_LINES, _split_arguments, _with_threads, _output_bytes, _read_stderr, _expected_seconds, summarize_stderr,
+)
+
+PREVIEW_CHUNK = [
+    'ffmpeg', '-y', '-ss', '60', '-t', '30', '-i', 'in.mp4',
+    '-filter_complex', '[0:v:0]split=2[p][t]',
+    '-map', '[t]', '-q:v', '5', 'thumbs/%08d.jpg',
+    '-map', '[p]', '-an', '-c:v', 'libx264', 'segment.mp4',
+]
+
+
+def test_split_arguments():
+    inputs, outputs = _split_arguments(PREVIEW_CHUNK)
+    assert inputs == [('in.mp4', {'-y': None, '-ss': '60', '-t': '30'})]
+    assert [path for path, _ in outputs] == ['thumbs/%08d.jpg', 'segment.mp4']
+    assert outputs[1][1] == {'-map': '[p]', '-an': None, '-c:v': 'libx264'}
+
+
+def test_split_arguments_null_output():
+    inputs, outputs = _split_arguments(['ffmpeg', '-i', 'a.mp4', '-i', 'b.mp3', '-af', 'loudnorm', '-f', 'null', '-'])
+    assert [path for path, _ in inputs] == ['a.mp4', 'b.mp3']
+    assert outputs == [('-', {'-af': 'loudnorm', '-f': 'null'})]
+
+
+def test_with_threads_before_every_input_and_output():
+    command = _with_threads(PREVIEW_CHUNK, 3)
+    assert command[:5] == ['ffmpeg', '-filter_threads', '3', '-filter_complex_threads', '3']
+    for path in ('in.mp4', 'thumbs/%08d.jpg', 'segment.mp4'):
+        i = command.index(path)
+        before = command[i - 3:i - 1] if path == 'in.mp4' else command[i - 2:i]
+        assert before == ['-threads', '3'], path
+    # The options of each output stay with it.
+    inputs, outputs = _split_arguments(command)
+    assert [path for path, _ in outputs] == ['thumbs/%08d.jpg', 'segment.mp4']
+    assert all(options['-threads'] == '3' for _, options in inputs + outputs)
+
+
+def test_output_bytes_counts_every_output(tmp_path):
+    (tmp_path / "a.mp4").write_bytes(b'\0' * 100)
+    (tmp_path / "b.mp4").write_bytes(b'\0' * 50)
+    hls = tmp_path / "hls"
+    hls.mkdir()
+    for name, size in (("index.m3u8", 10), ("init.mp4", 20), ("segment_00000.m4s", 300)):
+        (hls / name).write_bytes(b'\0' * size)
+    _, outputs = _split_arguments([
+        'ffmpeg', '-i', 'in.mp4', '-map', '0', str(tmp_path / "a.mp4"), '-map', '0', str(tmp_path / "b.mp4"),
+        '-f', 'hls', '-hls_time', '6', str(hls / "index.m3u8"), '-f', 'null', '-',
+    ])
+    assert _output_bytes(outputs) == 100 + 50 + 330
+
+
+def test_summarize_stderr_picks_the_error_lines():
+    lines = [
+        "Input #0, mov,mp4,m4a,3gp,3g2,mj2, from 'a.mp4':",
+        "  Duration: 00:00:10.00, start: 0.000000, bitrate: 800 kb/s",
+        "[Parsed_scale_0 @ 0x55d0c0a1b2c0] Invalid size 'foo'",
+        "[Parsed_scale_0 @ 0x55d0c0a1b2c0] Invalid size 'foo'",
+        "Error reinitializing filters!",
+    ]
+    assert summarize_stderr(lines) == "Invalid size 'foo'; Error reinitializing filters!"
+
+
+def test_summarize_stderr_falls_back_to_the_last_lines():
+    assert summarize_stderr(["frame=1", "", "frame=2"]) == "frame=1; frame=2"
+    assert summarize_stderr(["x" * 1000]).startswith("...")
+
+
+class _Stream:
+    # The standard error of a process, in blocks that end in the middle of a line.
+    def __init__(self, data: bytes, size: int = 1000):
+        self.blocks = [data[i:i + size] for i in range(0, len(data), size)]
+
+    async def read(self, n: int) -> bytes:
+        return self.blocks.pop(0) if self.blocks else b''
+
+
+def test_read_stderr_keeps_a_bounded_tail_and_passes_every_line_on():
+    data = b"".join(b"[Parsed_metadata_1 @ 0x1] frame:%d pts_time:%d\n" % (i, i) for i in range(10000))
+    tail = deque(maxlen=STDERR_LINES)
+    lines = []
+    asyncio.run(_read_stderr(_Stream(data + b"frame= 10 fps=5.0\r"), tail, None, lines.append))
+    assert len(lines) == 10001
+    assert lines[0] == "[Parsed_metadata_1 @ 0x1] frame:0 pts_time:0"
+    assert len(tail) == STDERR_LINES
+    assert tail[-1] == "frame= 10 fps=5.0"
+
+
+def expected_seconds(command: list[str]):
+    return asyncio.run(_expected_seconds(*_split_arguments(command)))
+
+
+def test_expected_seconds_from_the_options():
+    assert expected_seconds(['ffmpeg', '-i', 'a.mp4', '-t', '00:01:30', 'out.mp4']) == 90
+    assert expected_seconds(['ffmpeg', '-ss', '5', '-t', '7.5', '-i', 'a.mp4', 'out.mp4']) == 7.5
+    assert expected_seconds(['ffmpeg', '-ss', '5', '-to', '20', '-i', 'a.mp4', 'out.mp4']) == 15
+    # A lavfi source has no duration of its own, nor has a missing file.
+    assert expected_seconds(['ffmpeg', '-f', 'lavfi', '-i', 'anullsrc', 'out.mp4']) is None
+    assert expected_seconds(['ffmpeg', '-i', 'missing.mp4', 'out.mp4']) is None
+
+
+def test_expected_seconds_from_the_inputs(commands, tmp_path):
+    video = tmp_path / "a.mp4"
+    video.write_bytes(b'\0' * 100)
+    # The longest input, after its seek. The fake ffprobe reports 12.5s.
+    assert expected_seconds(['ffmpeg', '-ss', '2.5', '-i', str(video), '-ss', '0', '-t', '3', '-i', str(video),
+                             'out.mp4']) == 10
+    concat = tmp_path / "list.txt"
+    concat.write_text(f"file '{video}'\ninpoint 2\noutpoint 4.5\nfile '{video}'\ninpoint 10\n")
+    assert expected_seconds(['ffmpeg', '-f', 'concat', '-safe', '0', '-i', str(concat), 'out.mp4']) == 5
@@ -0,0 +1,53 @@
+import asyncio
+from vedit.progress import Progress
+
+
+def test_progress_sums_the_processes_and_never_goes_down():
+    reports = []
+
+    async def report(done, total, message):
+        reports.append((done, total, message))
+
+    async def main():
+        progress = Progress(report)
+        progress.INTERVAL = 0
+        first = progress.start(10)
+        await progress.update(first, 4, speed="2x")
+        second = progress.start(20)
+        await progress.update(second, 5, fps="30")
+        # An earlier position of the same process is ignored.
+        await progress.update(first, 3)
+        await progress.update(first, 8, last=True)
+        progress.finish(first)
+        await progress.update(second, 25, last=True)
+
+    asyncio.run(main())
+    assert reports == [(4, 10, "speed 2x"), (9, 30, "30 fps"), (13, 30, ""), (30, 30, "")]
+
+
+def test_progress_is_throttled_except_for_the_last_report():
+    reports = []
+
+    async def report(done, total, message):
+        reports.append(done)
+
+    async def main():
+        progress = Progress(report)
+        key = progress.start(None)
+        for seconds in range(1, 6):
+            await progress.update(key, seconds)
+        await progress.update(key, 6, last=True)
+
+    asyncio.run(main())
+    assert reports == [1, 6]
+
+
+def test_a_failing_report_does_not_fail_the_render():
+    async def report(done, total, message):
+        raise ConnectionError("the client went away")
+
+    async def main():
+        progress = Progress(report)
+        await progress.update(progress.start(1), 1, last=True)
+
+    asyncio.run(main())
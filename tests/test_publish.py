@@ -0,0 +1,64 @@
+import os
+import pytest
+from vedit import publish
+from vedit.publish import publish_file, publish_folder
+
+
+def failing(source_file: str, temp_file: str):
+    # A strategy the file system does not support, after it started writing.
+    with open(temp_file, 'wb') as f:
+        f.write(b'partial')
+    raise OSError("not supported")
+
+
+@pytest.fixture
+def source(kb_dir, tmp_path):
+    path = tmp_path / "source.mp4"
+    path.write_bytes(os.urandom(100_000))
+    return str(path)
+
+
+def test_publish_file(source, tmp_path):
+    target = str(tmp_path / "result" / "final.mp4")
+    os.makedirs(os.path.dirname(target))
+    assert publish_file(source, target) in ("reflink", "hardlink", "kernel_copy", "copy")
+    with open(source, 'rb') as a, open(target, 'rb') as b:
+        assert a.read() == b.read()
+    assert os.listdir(os.path.dirname(target)) == ["final.mp4"]
+
+
+def test_publish_file_falls_back_in_order(source, tmp_path, monkeypatch):
+    monkeypatch.setattr(publish, "STRATEGIES", (
+        ("reflink", failing), ("hardlink", failing), ("kernel_copy", publish._kernel_copy), ("copy", failing)))
+    monkeypatch.setattr(publish, "CHUNK_BYTES", 4096)
+    target = tmp_path / "final.mp4"
+    target.write_bytes(b'old')
+    assert publish_file(source, str(target)) == "kernel_copy"
+    with open(source, 'rb') as f:
+        assert target.read_bytes() == f.read()
+    assert os.stat(target).st_ino != os.stat(source).st_ino
+    assert sorted(os.listdir(tmp_path)) == ["final.mp4", "source.mp4"]
+
+
+def test_publish_file_leaves_the_target_alone_when_every_strategy_fails(source, tmp_path, monkeypatch):
+    monkeypatch.setattr(publish, "STRATEGIES", (("reflink", failing), ("copy", failing)))
+    target = tmp_path / "final.mp4"
+    target.write_bytes(b'old')
+    with pytest.raises(OSError):
+        publish_file(source, str(target))
+    assert target.read_bytes() == b'old'
+    assert sorted(os.listdir(tmp_path)) == ["final.mp4", "source.mp4"]
+
+
+def test_publish_folder_replaces_the_whole_folder(tmp_path, kb_dir):
+    source = tmp_path / "hls"
+    source.mkdir()
+    for name in ("index.m3u8", "init.mp4", "segment_00000.m4s"):
+        (source / name).write_bytes(name.encode())
+    target = tmp_path / "result" / "final"
+    target.mkdir(parents=True)
+    (target / "segment_00009.m4s").write_bytes(b'old')
+    assert len(publish_folder(str(source), str(target))) == 3
+    assert sorted(os.listdir(target)) == ["index.m3u8", "init.mp4", "segment_00000.m4s"]
+    assert (target / "init.mp4").read_bytes() == b"init.mp4"
+    assert os.listdir(target.parent) == ["final"]
@@ -0,0 +1,95 @@
+import asyncio
+import pytest
+from vedit.scheduler import FFmpegScheduler, HostBudget, is_reencode
+
+
+async def run_in_order(scheduler: FFmpegScheduler, waiters: list[tuple[str, str, int, int]]) -> list[str]:
+    # Everything queues behind one running process, then the grants are released one by one.
+    order = []
+    first = await scheduler.acquire(1, "running")
+
+    async def wait(name: str, task_id: str, priority: int, threads: int):
+        granted = await scheduler.acquire(threads, task_id, priority)
+        order.append(name)
+        await asyncio.sleep(0)
+        scheduler.release(granted)
+
+    tasks = []
+    for waiter in waiters:
+        tasks.append(asyncio.create_task(wait(*waiter)))
+        await asyncio.sleep(0)
+    scheduler.release(first)
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_tasks_take_turns():
+    order = asyncio.run(run_in_order(FFmpegScheduler(4, 1), [
+        ("a1", "a", 0, 1), ("a2", "a", 0, 1), ("a3", "a", 0, 1), ("b1", "b", 0, 1), ("c1", "c", 0, 1),
+    ]))
+    assert order == ["a1", "b1", "c1", "a2", "a3"]
+
+
+def test_higher_priority_goes_first():
+    order = asyncio.run(run_in_order(FFmpegScheduler(4, 1), [
+        ("low", "a", 0, 1), ("background", "b", -10, 1), ("high", "c", 5, 1),
+    ]))
+    assert order == ["high", "low", "background"]
+
+
+def test_the_head_is_not_overtaken():
+    async def main():
+        scheduler = FFmpegScheduler(4, 4)
+        held = await scheduler.acquire(3, "a")
+        big = asyncio.create_task(scheduler.acquire(4, "b"))
+        await asyncio.sleep(0)
+        small = asyncio.create_task(scheduler.acquire(1, "c"))
+        await asyncio.sleep(0)
+        # One thread is free, but the small grant would delay the big one.
+        assert not big.done() and not small.done()
+        assert scheduler.status()["queued"] == 2
+        scheduler.release(held)
+        assert await big == 4
+        assert not small.done()
+        scheduler.release(4)
+        assert await small == 1
+
+    asyncio.run(main())
+
+
+def test_a_cancelled_waiter_leaves_the_queue():
+    async def main():
+        scheduler = FFmpegScheduler(1, 1)
+        held = await scheduler.acquire(1, "a")
+        waiter = asyncio.create_task(scheduler.acquire(1, "b"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler.status()["queued"] == 0
+        scheduler.release(held)
+        assert scheduler.status()["running"] == 0
+
+    asyncio.run(main())
+
+
+def test_host_budget_is_shared_by_the_processes(tmp_path):
+    async def main():
+        # Two servers on the same `kb_dir`.
+        first, second = HostBudget(str(tmp_path), 2, 2), HostBudget(str(tmp_path), 2, 2)
+        tokens = await first.acquire(2)
+        waiting = asyncio.create_task(second.acquire(1))
+        await asyncio.sleep(0.2)
+        assert not waiting.done()
+        first.release(tokens)
+        second.release(await asyncio.wait_for(waiting, 1))
+
+    asyncio.run(main())
+
+
+def test_is_reencode():
+    assert not is_reencode(['ffprobe', '-i', 'a.mp4'])
+    assert not is_reencode(['ffmpeg', '-i', 'a.mp4', '-c', 'copy', 'b.mp4'])
+    assert is_reencode(['ffmpeg', '-i', 'a.mp4', 'b.mp4'])
+    assert is_reencode(['ffmpeg', '-i', 'a.mp4', '-c:v', 'copy', '-c:a', 'aac', 'b.mp4'])
+    assert is_reencode(['ffmpeg', '-i', 'a.mp4', '-c', 'copy', '-af', 'volume=2', 'b.mp4'])
@@ -0,0 +1,152 @@
+import os
+import time
+import asyncio
+import subprocess
+from collections import namedtuple
+from vedit import storage
+from vedit.render_cache import RenderCache
+from vedit.storage import StorageManager
+
+OLD = time.time() - 2 * StorageManager.GRACE_SECONDS
+
+
+def make_file(path: str, size: int, last_use: float = OLD) -> str:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'\0' * size)
+    os.utime(path, (last_use, last_use))
+    return path
+
+
+def make_manager(kb_dir: str, render_cache=None, **limits) -> StorageManager:
+    return StorageManager(
+        kb_dir, os.path.join(kb_dir, "cache", "meta.db"),
+        limits.get("quota_bytes", 0), limits.get("ttl_seconds", 0), limits.get("min_free_bytes", 0),
+        active_jobs=lambda: [], render_cache=render_cache)
+
+
+def test_quota_evicts_least_recently_used(kb_dir):
+    old = make_file(os.path.join(kb_dir, "clip", "t", "old.mp4"), 1000, OLD - 100)
+    new = make_file(os.path.join(kb_dir, "clip", "t", "new.mp4"), 1000)
+    manager = make_manager(kb_dir, quota_bytes=1500)
+    asyncio.run(manager.cleanup())
+    assert not os.path.exists(old)
+    assert os.path.exists(new)
+    assert manager.evicted_bytes == 1000
+
+
+def test_quota_drops_the_render_cache_artifact(kb_dir):
+    cache = RenderCache(os.path.join(kb_dir, "cache", "render"), os.path.join(kb_dir, "cache", "meta.db"), 10 ** 9)
+    output = make_file(os.path.join(kb_dir, "merge", "t", "result.mp4"), 1000)
+    cache.store("key", output)
+    assert os.stat(output).st_nlink == 2
+    manager = make_manager(kb_dir, render_cache=cache, quota_bytes=500)
+    asyncio.run(manager.cleanup())
+    assert not os.path.exists(output)
+    assert cache.artifacts() == {}
+    assert manager.evicted_bytes == 1000
+
+
+def test_quota_ignores_files_held_elsewhere(kb_dir):
+    # A published result keeps the inode alive, removing the intermediate frees nothing.
+    held = make_file(os.path.join(kb_dir, "add", "t", "held.mp4"), 1000, OLD - 100)
+    os.makedirs(os.path.join(kb_dir, "result", "t"))
+    os.link(held, os.path.join(kb_dir, "result", "t", "held.mp4"))
+    plain = make_file(os.path.join(kb_dir, "add", "t", "plain.mp4"), 1000)
+    manager = make_manager(kb_dir, quota_bytes=1500)
+    asyncio.run(manager.cleanup())
+    assert os.path.exists(held)
+    assert os.path.exists(plain)
+    assert manager.evicted_files == 0
+
+
+def test_ttl_evicts_linked_files_without_counting_them(kb_dir):
+    held = make_file(os.path.join(kb_dir, "clip", "t", "held.mp4"), 1000)
+    os.link(held, os.path.join(kb_dir, "held_elsewhere.mp4"))
+    manager = make_manager(kb_dir, ttl_seconds=60)
+    asyncio.run(manager.cleanup())
+    assert not os.path.exists(held)
+    assert manager.evicted_files == 1
+    assert manager.evicted_bytes == 0
+
+
+def test_disk_pass_stops_when_the_disk_does_not_gain_space(kb_dir, monkeypatch):
+    paths = [make_file(os.path.join(kb_dir, "clip", "t", f"{i}.mp4"), 1000, OLD - i) for i in range(3)]
+    usage = namedtuple("usage", "total used free")
+    monkeypatch.setattr(storage.shutil, "disk_usage", lambda path: usage(10 ** 9, 10 ** 9 - 10, 10))
+    manager = make_manager(kb_dir, min_free_bytes=10 ** 6)
+    asyncio.run(manager.cleanup())
+    assert manager.evicted_files == 1
+    assert sum(os.path.exists(path) for path in paths) == 2
+
+
+def test_grace_period_and_pins(kb_dir):
+    recent = make_file(os.path.join(kb_dir, "clip", "t", "recent.mp4"), 1000, time.time())
+    pinned = make_file(os.path.join(kb_dir, "clip", "t", "pinned.mp4"), 1000)
+    manager = make_manager(kb_dir, ttl_seconds=1)
+    manager.pin(pinned, "test")
+    asyncio.run(manager.cleanup())
+    assert os.path.exists(recent)
+    assert os.path.exists(pinned)
+
+
+def test_stale_temporaries_are_removed(kb_dir):
+    stale_folder = os.path.join(kb_dir, "merge", "t", ".result_1.abcd1234.tmp")
+    make_file(os.path.join(stale_folder, "init.mp4"), 100)
+    os.utime(stale_folder, (OLD, OLD))
+    stale_file = make_file(os.path.join(kb_dir, "add", "t", "x.abcd1234.tmp.mp4"), 100)
+    running = make_file(os.path.join(kb_dir, "merge", "t", ".result_2.abcd1234.tmp", "segment_00000.m4s"), 100,
+                        time.time())
+    manager = make_manager(kb_dir, quota_bytes=10)
+    asyncio.run(manager.cleanup())
+    assert not os.path.exists(stale_folder)
+    assert not os.path.exists(stale_file)
+    # A render still writing is neither removed nor evicted.
+    assert os.path.exists(running)
+
+
+def test_titles_containing_tmp_are_not_temporary(kb_dir):
+    # Regression: a user title with ".tmp" in it was removed as a stale temporary, even when pinned.
+    pinned = make_file(os.path.join(kb_dir, "clip", "t", "my.tmpl_intro.mp4"), 100, OLD - 3600)
+    plain = make_file(os.path.join(kb_dir, "clip", "t", "draft.tmp.mp4"), 100, OLD - 3600)
+    manager = make_manager(kb_dir, quota_bytes=10 ** 9)
+    manager.pin(pinned, "task_endding t")
+    asyncio.run(manager.cleanup())
+    assert os.path.exists(pinned)
+    assert os.path.exists(plain)
+
+
+def test_pinned_temporaries_are_kept(kb_dir):
+    stale = make_file(os.path.join(kb_dir, "add", "t", "x.abcd1234.tmp.mp4"), 100)
+    manager = make_manager(kb_dir, quota_bytes=10 ** 9)
+    manager.pin(stale, "test")
+    asyncio.run(manager.cleanup())
+    assert os.path.exists(stale)
+
+
+def test_holds_protect_running_tool_calls(kb_dir):
+    source = make_file(os.path.join(kb_dir, "clip", "a", "source.mp4"), 1000, OLD - 100)
+    normalized = make_file(os.path.join(kb_dir, "merge", "t", "merge_abc", "input_1.mp4"), 1000, OLD - 100)
+    other = make_file(os.path.join(kb_dir, "clip", "b", "other.mp4"), 1000)
+    manager = make_manager(kb_dir, quota_bytes=500)
+    # The cleanup may run in another server process on the same `kb_dir`.
+    cleaner = make_manager(kb_dir, quota_bytes=500)
+    with manager.hold([source, os.path.join(kb_dir, "merge", "t")]):
+        asyncio.run(cleaner.cleanup())
+        assert os.path.exists(source)
+        assert os.path.exists(normalized)
+        assert not os.path.exists(other)
+    asyncio.run(cleaner.cleanup())
+    assert not os.path.exists(source)
+    assert not os.path.exists(normalized)
+
+
+def test_holds_of_dead_processes_are_dropped(kb_dir):
+    source = make_file(os.path.join(kb_dir, "clip", "a", "source.mp4"), 1000)
+    process = subprocess.Popen(['true'])
+    process.wait()
+    manager = make_manager(kb_dir, quota_bytes=500)
+    manager._conn.execute("INSERT INTO storage_holds (hold_id, path, owner) VALUES ('x', ?, ?)", (source, process.pid))
+    asyncio.run(manager.cleanup())
+    assert not os.path.exists(source)
+    assert manager._conn.execute("SELECT COUNT(*) FROM storage_holds").fetchone()[0] == 0
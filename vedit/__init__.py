@@ -0,0 +1,32 @@
+# vedit: the video editing engine behind VideoEditorMCP.
+# It can be used without the MCP server:
+#
+#     import vedit
+#     vedit.configure(vedit.VeditConfig(kb_dir="/path/to/kb"))
+#     success, output_path, message = await vedit.clip_video("/path/to/kb/a.mp4", "/path/to/kb/clip", 0, 10, "a")
+#
+# The MCP server lives in `vedit.server` and is only imported by the entry point.
+from .config import (
+    VeditConfig, build_parser, config_from_args, config_from_namespace, configure, get_config,
+    KB_CLIP, KB_MERGE, KB_RESULT, KB_ADD, KB_TIMELINE, KB_JOBS, KB_CACHE,
+)
+from .scheduler import FFmpegScheduler, get_scheduler, current_task_id, current_priority
+from .metrics import Metrics, get_metrics
+from .progress import Progress, current_progress
+from .process import FFmpegError, run_command
+from .probe import (
+    file_identity, probe_video, get_keyframes, get_keyframe_index, get_metadata_cache, measure_loudness,
+    split_at_keyframes,
+)
+from .render_cache import RenderCache, get_render_cache
+from .assets import AudioAssetCache, get_audio_assets
+from .preview import PreviewCache, get_preview_cache
+from .inventory import MediaIndexer, get_media_indexer
+from .publish import publish_file, publish_folder
+from .formats import OUTPUT_FORMATS, check_output_format, output_path_for
+from .editing import (
+    smart_cut, clip_video, clip_segments, merge_videos, render_timeline, add_audio_to_video, copy_file,
+)
+from .analysis import AnalysisIndex, analyze_video, get_analysis_index
+from .jobs import JobManager
+from .storage import StorageManager
@@ -0,0 +1,306 @@
+import os
+import re
+import json
+import math
+import time
+import sqlite3
+import asyncio
+from typing import Optional
+from loguru import logger
+from .config import lazy, get_config
+from .locks import lock, unlock
+from .process import run_command
+from .probe import file_identity, probe_video, get_keyframes, split_at_keyframes
+
+
+# analyze_video:
+# To cut highlights out of an hours-long recording, the agent needs to know where something happens. One pass over
+# the file finds the scene cuts, the black frames, the silences and the audio level of every few seconds. The pass is
+# kept cheap: the decoder skips the frames no other frame refers to and the loop filter, only `ANALYSIS_FPS` frames
+# per second are looked at, scaled down to `ANALYSIS_WIDTH`, and the audio is analysed as 8 kHz mono. The file is
+# split at keyframes into chunks that run in parallel, each chunk with a single thread, so a long recording is spread
+# over all the cores the scheduler grants. Spans that were cut by a chunk boundary are joined again afterwards.
+#
+# The result is an event table in `$KB_DIR/cache/meta.sqlite`, keyed by the file identity. Events are stored with
+# low internal thresholds, so the thresholds of a query (scene score, minimum durations) are applied when reading and
+# never need a new pass. Only the silence threshold in dB changes what is detected, it is part of the key.
+ANALYSIS_VERSION = 1
+ANALYSIS_FPS = 4
+ANALYSIS_WIDTH = 160
+SCENE_FLOOR = 0.1           # scene scores below this are not stored
+BLACK_PIXEL_THRESHOLD = 0.1
+SILENCE_FLOOR = 0.2         # seconds, shorter silences are not stored
+LEVEL_WINDOW = 5            # seconds of audio per "level" event
+LEVEL_SAMPLE_RATE = 8000
+MIN_CHUNK_SECONDS = 60
+MERGE_GAP = 1.0 / ANALYSIS_FPS + 0.05
+KINDS = ("scene", "black", "silence", "level")
+
+
+class AnalysisIndex:
+    def __init__(self, db_path: str):
+        folder = os.path.dirname(db_path)
+        if not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+        self.lock_dir = os.path.join(folder, "analysis")
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS analyses ("
+            "analysis_id INTEGER PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, "
+            "params TEXT NOT NULL, duration REAL, created_at REAL NOT NULL, UNIQUE (path, params))")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS analysis_events ("
+            "analysis_id INTEGER NOT NULL, kind TEXT NOT NULL, start REAL NOT NULL, end REAL NOT NULL, value REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS analysis_events_time ON analysis_events (analysis_id, start)")
+        self._conn.commit()
+
+    def find(self, identity: tuple[str, int, int], params: str) -> Optional[tuple[int, Optional[float]]]:
+        """
+        :return: The analysis id and the analysed duration, or None if the file was not analysed with these params.
+        """
+        path, size, mtime_ns = identity
+        row = self._conn.execute(
+            "SELECT analysis_id, duration FROM analyses WHERE path = ? AND size = ? AND mtime_ns = ? AND params = ?",
+            (path, size, mtime_ns, params)).fetchone()
+        return (row[0], row[1]) if row is not None else None
+
+    def put(self, identity: tuple[str, int, int], params: str, duration: Optional[float], events: list[tuple]):
+        path, size, mtime_ns = identity
+        with self._conn:
+            # The analysis of an older version of the file is replaced.
+            old = self._conn.execute(
+                "SELECT analysis_id FROM analyses WHERE path = ? AND params = ?", (path, params)).fetchone()
+            if old is not None:
+                self._conn.execute("DELETE FROM analysis_events WHERE analysis_id = ?", old)
+                self._conn.execute("DELETE FROM analyses WHERE analysis_id = ?", old)
+            analysis_id = self._conn.execute(
+                "INSERT INTO analyses (path, size, mtime_ns, params, duration, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (path, size, mtime_ns, params, duration, time.time())).lastrowid
+            self._conn.executemany(
+                "INSERT INTO analysis_events (analysis_id, kind, start, end, value) VALUES (?, ?, ?, ?, ?)",
+                [(analysis_id, *event) for event in events])
+
+    def query(self, analysis_id: int, start_time: float, end_time: float, kinds: list[str]) -> list[dict]:
+        # Every event that overlaps [start_time, end_time], a scene cut is a point.
+        rows = self._conn.execute(
+            f"SELECT kind, start, end, value FROM analysis_events WHERE analysis_id = ? AND start <= ? AND end >= ? "
+            f"AND kind IN ({', '.join('?' * len(kinds))}) ORDER BY start, kind",
+            (analysis_id, end_time, start_time, *kinds)).fetchall()
+        return [{"kind": kind, "start": start, "end": end, "value": value} for kind, start, end, value in rows]
+
+
+def get_analysis_index() -> AnalysisIndex:
+    return lazy("analysis_index", lambda config: AnalysisIndex(config.meta_db_path))
+
+
+_LINE = re.compile(r"^\[(\S+) @ 0x[0-9a-f]+\] (.*)$")
+_FRAME_TIME = re.compile(r"pts_time:(\S+)")
+_BLACK = re.compile(r"black_start:(\S+) black_end:(\S+)")
+
+
+class _ChunkReport:
+    """
+    The events (kind, start, end, value) of one chunk, in the time of the whole file,
+    parsed from the standard error of ffmpeg line by line while it runs.
+    """
+    def __init__(self, offset: float, length: float):
+        self.offset = offset
+        self.length = length
+        self.events = []
+        self._frame_times = {}      # the metadata filters print the time of a frame, then its values
+        self._silence_start = None
+
+    def add(self, line: str):
+        match = _LINE.match(line)
+        if match is None:
+            return
+        source, message = match.groups()
+        offset, frame_times = self.offset, self._frame_times
+        frame_time = _FRAME_TIME.search(message)
+        if frame_time:
+            frame_times[source] = float(frame_time.group(1))
+        elif message.startswith("lavfi.scene_score=") and source in frame_times:
+            at = offset + frame_times[source]
+            self.events.append(("scene", at, at, float(message.partition("=")[2])))
+        elif message.startswith("lavfi.astats.Overall.RMS_level=") and source in frame_times:
+            start = frame_times[source]
+            level = float(message.partition("=")[2])
+            # Digital silence is -inf dB, which JSON can not carry.
+            self.events.append(("level", offset + start, offset + min(start + LEVEL_WINDOW, self.length),
+                                level if math.isfinite(level) else None))
+        elif message.startswith("silence_start:"):
+            self._silence_start = float(message.split()[1])
+        elif message.startswith("silence_end:") and self._silence_start is not None:
+            silence_end = float(message.split()[1])
+            self.events.append(("silence", offset + max(self._silence_start, 0.0), offset + silence_end, None))
+            self._silence_start = None
+        elif _BLACK.match(message):
+            black_start, black_end = (float(x) for x in _BLACK.match(message).groups())
+            self.events.append(("black", offset + black_start, offset + black_end, None))
+
+    def finish(self) -> list[tuple]:
+        # A silence that lasts until the end of the chunk has no end line.
+        if self._silence_start is not None:
+            self.events.append(("silence", self.offset + max(self._silence_start, 0.0), self.offset + self.length,
+                                None))
+            self._silence_start = None
+        return self.events
+
+
+def _join_spans(events: list[tuple]) -> list[tuple]:
+    # A silence or a black span that crosses a chunk boundary was reported by both chunks.
+    result = []
+    open_spans = {}
+    for event in sorted(events, key=lambda x: (x[1], x[2])):
+        kind, start, end, value = event
+        if kind in ("silence", "black"):
+            previous = open_spans.get(kind)
+            if previous is not None and start - result[previous][2] <= MERGE_GAP:
+                result[previous] = (kind, result[previous][1], max(end, result[previous][2]), None)
+                continue
+            open_spans[kind] = len(result)
+        result.append(event)
+    return result
+
+
+async def _analyze_chunk(video_path: str, seek: float, start: float, end: Optional[float],
+                         has_video: bool, has_audio: bool, silence_threshold_db: float) -> list[tuple]:
+    # The decoding starts at the keyframe `seek` before the chunk, so a scene cut right at `start` has a frame to be
+    # compared with. The audio before `start` belongs to the previous chunk and is trimmed.
+    command = ['ffmpeg', '-hide_banner', '-nostats']
+    if has_video:
+        command += ['-skip_frame', 'noref', '-skip_loop_filter', 'all']
+    if seek > 0:
+        command += ['-ss', str(seek)]
+    if end is not None:
+        command += ['-t', str(end - seek)]
+    command += ['-i', video_path]
+    if has_video:
+        command += [
+            '-map', '0:v:0',
+            '-vf', f"fps={ANALYSIS_FPS},scale={ANALYSIS_WIDTH}:-2,"
+                   f"blackdetect=d=0:pix_th={BLACK_PIXEL_THRESHOLD},"
+                   f"select='gt(scene,{SCENE_FLOOR})',metadata=print:key=lavfi.scene_score",
+        ]
+    if has_audio:
+        command += [
+            '-map', '0:a:0',
+            '-af', f"atrim=start={start - seek},"
+                   f"aformat=sample_fmts=flt:sample_rates={LEVEL_SAMPLE_RATE}:channel_layouts=mono,"
+                   f"silencedetect=n={silence_threshold_db}dB:d={SILENCE_FLOOR},"
+                   f"asetnsamples=n={LEVEL_SAMPLE_RATE * LEVEL_WINDOW}:p=0,"
+                   f"astats=metadata=1:reset=1,ametadata=print:key=lavfi.astats.Overall.RMS_level",
+        ]
+    command += ['-f', 'null', '-']
+    # One thread per chunk: the chunks themselves are the parallelism.
+    report = _ChunkReport(seek, end - seek if end is not None else math.inf)
+    await run_command(command, stderr_lines=report.add, threads=1)
+    events = report.finish()
+    # The cuts before `start` were found by the previous chunk.
+    return [event for event in events if event[0] != "scene" or event[1] >= start - 0.001]
+
+
+async def _analyze(video_path: str, info: dict, silence_threshold_db: float) -> list[tuple]:
+    duration = info["duration"] or 0.0
+    has_video = info["video_codec"] is not None
+    keyframes = await get_keyframes(video_path) if has_video else []
+    count = max(1, min(int(duration // MIN_CHUNK_SECONDS), get_config().cpu_budget * 2))
+    bounds = split_at_keyframes(duration, keyframes, count, MIN_CHUNK_SECONDS)
+    logger.debug(f"analyze_video: {video_path}, {duration:.1f}s in {len(bounds)} chunks")
+    results = await asyncio.gather(*[
+        _analyze_chunk(video_path, max([x for x in keyframes if x < start] or [start]), start,
+                       bounds[i + 1] if i + 1 < len(bounds) else None,
+                       has_video, info["has_audio"], silence_threshold_db)
+        for i, start in enumerate(bounds)
+    ])
+    events = [event for chunk in results for event in chunk]
+    # The last chunk runs to the end of the file.
+    events = [(kind, start, min(end, duration) if duration else end, value) for kind, start, end, value in events]
+    return [
+        (kind, round(start, 3), round(end, 3), round(value, 3) if value is not None else None)
+        for kind, start, end, value in _join_spans(events)
+    ]
+
+
+# analyze_video:
+async def analyze_video(
+        video_path: str,
+        start_time: float = 0,
+        end_time: Optional[float] = None,
+        kinds: Optional[list[str]] = None,
+        scene_threshold: float = 0.3,
+        silence_threshold_db: float = -35.0,
+        silence_min_duration: float = 1.0,
+        black_min_duration: float = 0.5,
+) -> tuple[bool, dict, str]:
+    """
+    Get the scene cuts, black spans, silences and audio levels of a media file within a time range.
+    The file is analysed once and later calls only read the event table.
+    :param video_path: The path of the media file.
+    :param start_time: The start of the range in seconds.
+    :param end_time: The end of the range in seconds, default is the end of the file.
+    :param kinds: The kinds of events to return, out of "scene", "black", "silence" and "level".
+    :param scene_threshold: The minimum scene score (0 to 1) of a scene cut.
+    :param silence_threshold_db: Audio below this level in dBFS is silence.
+    :param silence_min_duration: The minimum duration of a silence in seconds.
+    :param black_min_duration: The minimum duration of a black span in seconds.
+    :return: Whether it succeeded, a dictionary with the keys "duration", "cached" and "events", and a message.
+                Each event has the keys "kind", "start", "end" and "value": the score of a scene cut, the RMS level
+                in dBFS of a "level" window (None for digital silence), None otherwise.
+    """
+    logger.debug(f"""
+    Parameter check:
+    video_path: {video_path}
+    start_time: {start_time}
+    end_time: {end_time}
+    kinds: {kinds}
+    scene_threshold: {scene_threshold}
+    silence_threshold_db: {silence_threshold_db}
+    """)
+    kinds = list(kinds) if kinds else list(KINDS)
+    unknown = [kind for kind in kinds if kind not in KINDS]
+    if unknown:
+        return False, {}, f"Unknown event kinds {unknown}, use {list(KINDS)}."
+    if end_time is not None and end_time < start_time:
+        return False, {}, "end_time must not be smaller than start_time."
+
+    try:
+        index = get_analysis_index()
+        identity = file_identity(video_path)
+        params = json.dumps({"silence_threshold_db": silence_threshold_db, "version": ANALYSIS_VERSION})
+        found = index.find(identity, params)
+        cached = found is not None
+        if not cached:
+            if not os.path.exists(index.lock_dir):
+                os.makedirs(index.lock_dir, exist_ok=True)
+            # Another call, maybe in another server process, may be analysing the same file.
+            lock_fd = await lock(os.path.join(index.lock_dir, identity[0].replace(os.sep, "_") + ".lock"))
+            try:
+                found = index.find(identity, params)
+                cached = found is not None
+                if not cached:
+                    info = await probe_video(video_path)
+                    if info["video_codec"] is None and not info["has_audio"]:
+                        return False, {}, "The file has neither a video nor an audio stream."
+                    started_at = time.monotonic()
+                    events = await _analyze(video_path, info, silence_threshold_db)
+                    logger.info(f"analyze_video: {video_path} ({info['duration']}s) "
+                                f"analysed in {time.monotonic() - started_at:.1f}s")
+                    index.put(identity, params, info["duration"], events)
+                    found = index.find(identity, params)
+            finally:
+                unlock(lock_fd)
+
+        analysis_id, duration = found
+        events = index.query(analysis_id, start_time, end_time if end_time is not None else math.inf, kinds)
+        events = [
+            event for event in events
+            if (event["kind"] != "scene" or event["value"] >= scene_threshold)
+            and (event["kind"] != "silence" or event["end"] - event["start"] >= silence_min_duration)
+            and (event["kind"] != "black" or event["end"] - event["start"] >= black_min_duration)
+        ]
+        return True, {"duration": duration, "cached": cached, "events": events}, "success"
+    except Exception as e:
+        logger.error(f"Error analysing {video_path}: {e}")
+        return False, {}, f"Error analysing the video: {str(e)}"
@@ -0,0 +1,152 @@
+import os
+import json
+import uuid
+import hashlib
+import asyncio
+from loguru import logger
+from .config import lazy
+from .locks import lock, unlock
+from .metrics import get_metrics
+from .process import run_command
+from .probe import file_identity
+
+
+# AudioAssetCache:
+# The same few background music tracks are mixed into hundreds of clips. Decoding and resampling an mp3 for every
+# clip costs more than the mix itself, so every track is decoded once per (sample rate, channels) into a PCM wav
+# under `$KB_DIR/cache/audio`. A wav can be seeked to any sample without decoding what comes before, so the mix
+# only reads the part of the track it needs. The key contains the identity of the source, a changed file gets a
+# new asset, and the least recently used assets are removed once they take more than `audio_cache_mb`.
+class AudioAssetCache:
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.evictions = 0
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def make_key(audio_path: str, sample_rate: int, channels: int) -> str:
+        payload = json.dumps(
+            {"input": file_identity(audio_path), "sample_rate": sample_rate, "channels": channels},
+            sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def _prepare(self, audio_path: str, sample_rate: int, channels: int, asset_path: str):
+        temp_path = f"{asset_path}.{uuid.uuid4().hex[:8]}.tmp.wav"
+        command = [
+            'ffmpeg',
+            '-y',
+            '-i', audio_path,
+            '-map', '0:a:0',
+            '-ar', str(sample_rate),
+            '-ac', str(channels),
+            '-c:a', 'pcm_s16le',
+            temp_path
+        ]
+        try:
+            await run_command(command)
+            os.replace(temp_path, asset_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _evict(self, keep: str):
+        assets = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".wav") and ".tmp." not in name:
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    # Evicted by another server process in the meantime.
+                    continue
+                assets.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in assets)
+        for _, size, path in sorted(assets):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+
+    async def get(self, audio_path: str, sample_rate: int, channels: int) -> str:
+        """
+        Get the path of `audio_path` decoded to PCM with the given sample rate and channel count.
+        :raise subprocess.CalledProcessError: If the track can not be decoded.
+        """
+        key = self.make_key(audio_path, sample_rate, channels)
+        asset_path = os.path.join(self.cache_dir, key + ".wav")
+        while True:
+            if os.path.isfile(asset_path):
+                # The mtime is the last access, it decides what is evicted first.
+                os.utime(asset_path)
+                self.hits += 1
+                get_metrics().inc("vedit_audio_asset_total", {"result": "hit"})
+                return asset_path
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            try:
+                await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # Only retry if the other preparation was cancelled, not this call.
+                if not inflight.cancelled():
+                    raise
+                continue
+            self.shared += 1
+            get_metrics().inc("vedit_audio_asset_total", {"result": "shared"})
+            return asset_path
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        lock_fd = None
+        try:
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir, exist_ok=True)
+            # Another server process on this `kb_dir` may be decoding the same track.
+            lock_fd = await lock(os.path.join(self.cache_dir, key + ".lock"))
+            if os.path.isfile(asset_path):
+                self.shared += 1
+                get_metrics().inc("vedit_audio_asset_total", {"result": "shared"})
+                future.set_result(None)
+                return asset_path
+
+            self.misses += 1
+            get_metrics().inc("vedit_audio_asset_total", {"result": "miss"})
+            logger.debug(f"preparing audio asset of {audio_path} at {sample_rate} Hz, {channels} channels")
+            await self._prepare(audio_path, sample_rate, channels, asset_path)
+            self._evict(keep=asset_path)
+            future.set_result(None)
+            return asset_path
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Followers re-raise the exception, this keeps asyncio from complaining when there are none.
+            future.exception()
+            raise
+        finally:
+            if lock_fd is not None:
+                unlock(lock_fd)
+            self._inflight.pop(key, None)
+
+
+def get_audio_assets() -> AudioAssetCache:
+    return lazy("audio_assets", lambda config: AudioAssetCache(
+        os.path.join(config.cache_dir, "audio"),
+        config.audio_cache_max_bytes,
+    ))
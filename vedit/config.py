@@ -0,0 +1,276 @@
+import os
+import argparse
+import dataclasses
+from typing import Optional, Callable
+from loguru import logger
+# The description of the argument is as follows.
+# 1. `kb_dir`：（Required）It is used to set the base path where various video files for operation are located. (For details, please check the code.)
+# 2. `using_logger`: (Optional) It is used to set whether to use the logger. If it is set to "True",
+#                   the output will be generated. If it is not set or set to other values, no log will be output.
+# 3. `logger_level`:(Optional) The log level. By default, it is set to the DEBUG level. You can set it
+#                   to any one of "DEBUG", "INFO", "ERROR", and "WARNING" by yourself.
+# 4. `logger_file_dir`: (Required when `using_logger="True"`), The directory for log output. It is required that this directory must already exist.
+# 5. `max_ffmpeg_procs`: (Optional) The maximum number of ffmpeg/ffprobe processes that may run at the same time.
+#                   By default it is the number of CPU cores. Extra calls wait until a slot is free.
+# 6. `job_workers`: (Optional) The number of background workers that execute jobs created by the `submit_*` tools.
+#                   The default is 2.
+# 7. `render_cache_mb`: (Optional) The size limit (in MB) of the render cache under `$KB_DIR/cache/render`, which lets
+#                   repeated clip/merge/add-bgm requests reuse earlier outputs. The default is 10240, 0 disables the cache.
+# 8. `cpu_budget`: (Optional) The number of cores all ffmpeg processes may use together. The default is the number of CPU cores.
+# 9. `threads_per_encode`: (Optional) The number of threads given to each ffmpeg process that decodes or encodes.
+#                   Stream copies and probes always get one. The default is half of `cpu_budget`.
+# 10. `metrics_file`: (Optional) If set, the metrics are also written to this file in the Prometheus text format
+#                   after every tool call, e.g. for the textfile collector of node_exporter.
+# 11. `audio_cache_mb`: (Optional) The size limit (in MB) of the decoded background music under `$KB_DIR/cache/audio`,
+#                   so a track used for many clips is only decoded once. The default is 2048, 0 disables it.
+# 12. `transport`: (Optional) "stdio" (default) serves the agent that spawned the process. "sse" and "streamable-http"
+#                   serve any number of agents over HTTP from one long-lived process, see `vedit.server`.
+# 13. `host` / `port`: (Optional) The address of the HTTP transports, the default is 127.0.0.1:8000.
+# 14. `http_workers`: (Optional) The number of worker processes of the "streamable-http" transport, the default is 1.
+#                   They share the job queue, the caches and the ffmpeg budget through the files under `kb_dir`.
+# 15. `storage_quota_mb`: (Optional) The size limit (in MB) of the intermediates under `clip/`, `merge/`, `add/` and
+#                   `timeline/`. The least recently used ones are removed in the background. The default is 0 (no limit).
+# 16. `storage_ttl_hours`: (Optional) Intermediates that were not used for this long are removed. The default is 0 (keep).
+# 17. `storage_min_free_mb`: (Optional) Intermediates are removed while the disk of `kb_dir` has less free space.
+#                   The default is 0 (no limit). `result/` and the files of running jobs are never removed.
+# 18. `preview_cache_mb`: (Optional) The size limit (in MB) of the proxies, thumbnails and contact sheets under
+#                   `$KB_DIR/cache/preview`. The least recently previewed sources are removed first. The default is 4096,
+#                   0 is no limit.
+# 19. `chunk_encode_min_seconds`: (Optional) Inputs at least this long are re-encoded in chunks by parallel ffmpeg
+#                   processes instead of one, e.g. when `merge_videos` converts an input. The default is 180, 0 disables it.
+#
+# The server reads them from the command line (`config_from_args`). A program using `vedit` as a library builds a
+# `VeditConfig` itself and passes it to `configure` before calling any engine function. Nothing is created at
+# import time: the scheduler, the caches and the job manager are built from the config on first use.
+
+# -----------------------------------------------------------------------------
+# Video Folder Base
+KB_CLIP = "clip"
+KB_MERGE = "merge"
+KB_RESULT = "result"
+KB_ADD = "add"      # add bgm, and add ... what i don't know.....
+KB_TIMELINE = "timeline"    # final outputs of `render_timeline_tool`
+KB_JOBS = "jobs"    # the job queue (`jobs.sqlite`), so finished jobs survive a restart
+KB_CACHE = "cache"  # sqlite indexes and cached artifacts, everything in it can be rebuilt
+
+# LOGGER_FILE_DIR: this folder must：
+# This directory must already exist, and an mcp.log file will be created here to record logs.
+# If you have any other ideas, please modify the code yourself.
+# -----------------------------------------------------------------------------
+
+
+@dataclasses.dataclass(frozen=True)
+class VeditConfig:
+    kb_dir: Optional[str] = None
+    using_logger: bool = False
+    logger_level: str = "DEBUG"
+    logger_file_dir: Optional[str] = None
+    max_ffmpeg_procs: int = dataclasses.field(default_factory=lambda: os.cpu_count() or 1)
+    job_workers: int = 2
+    render_cache_mb: int = 10240
+    cpu_budget: int = dataclasses.field(default_factory=lambda: os.cpu_count() or 1)
+    threads_per_encode: Optional[int] = None
+    metrics_file: Optional[str] = None
+    audio_cache_mb: int = 2048
+    storage_quota_mb: int = 0
+    storage_ttl_hours: float = 0
+    storage_min_free_mb: int = 0
+    preview_cache_mb: int = 4096
+    chunk_encode_min_seconds: float = 180
+
+    @property
+    def encode_threads(self) -> int:
+        return self.threads_per_encode or max(1, self.cpu_budget // 2)
+
+    @property
+    def render_cache_max_bytes(self) -> int:
+        return self.render_cache_mb * 1024 * 1024
+
+    @property
+    def audio_cache_max_bytes(self) -> int:
+        return self.audio_cache_mb * 1024 * 1024
+
+    @property
+    def preview_cache_max_bytes(self) -> int:
+        return self.preview_cache_mb * 1024 * 1024
+
+    @property
+    def ffmpeg_loglevel(self) -> str:
+        # What ffmpeg prints follows the log level: everything for DEBUG, warnings for INFO, otherwise only errors.
+        if not self.using_logger:
+            return "error"
+        return {"DEBUG": "info", "INFO": "warning"}.get(self.logger_level, "error")
+
+    @property
+    def cache_dir(self) -> str:
+        return os.path.join(self.kb_dir, KB_CACHE)
+
+    @property
+    def meta_db_path(self) -> str:
+        return os.path.join(self.kb_dir, KB_CACHE, "meta.sqlite")
+
+    # Check the path
+    def validate(self):
+        if self.kb_dir is None:
+            raise ValueError("`kb_dir` Error: KB_DIR is None, you must configure the argument variable " \
+            "KB_DIR and ensure that this path truly exists. The function of this path is to " \
+            "store the original video files, temporary files, and result files.")
+
+        elif not os.path.exists(os.path.abspath(self.kb_dir)):
+            raise ValueError(
+                f"`kb_dir` Error: The argument `kb_dir`={self.kb_dir} must already exist, we can not find it now.")
+
+        if self.using_logger:
+            if self.logger_level not in {"DEBUG", "INFO", "ERROR", "CRITICAL"}:
+                raise ValueError(f"`logger_level` Error: the logger level is not exists: {self.logger_level}")
+
+            if self.logger_file_dir is None:
+                raise ValueError("`logger_file_dir` Error: If you set `using_logger` to `True`, then you must configure " \
+                "the argument variable `logger_file_dir` and " \
+                "ensure that this directory already exists. ")
+
+            elif not os.path.exists(os.path.abspath(self.logger_file_dir)):
+                raise ValueError(f"`logger_file_dir` Error: The argument `logger_file_dir`={self.logger_file_dir} must already" \
+                                 "exist, we can not find it now.")
+
+        if self.max_ffmpeg_procs < 1:
+            raise ValueError(f"`max_ffmpeg_procs` Error: it must be at least 1, got {self.max_ffmpeg_procs}.")
+
+        if self.cpu_budget < 1 or self.encode_threads < 1:
+            raise ValueError(f"`cpu_budget`/`threads_per_encode` Error: they must be at least 1, "
+                             f"got {self.cpu_budget}/{self.encode_threads}.")
+
+        if self.job_workers < 1:
+            raise ValueError(f"`job_workers` Error: it must be at least 1, got {self.job_workers}.")
+
+        if self.render_cache_mb < 0:
+            raise ValueError(f"`render_cache_mb` Error: it can not be negative, got {self.render_cache_mb}.")
+
+        if self.audio_cache_mb < 0:
+            raise ValueError(f"`audio_cache_mb` Error: it can not be negative, got {self.audio_cache_mb}.")
+
+        if self.preview_cache_mb < 0:
+            raise ValueError(f"`preview_cache_mb` Error: it can not be negative, got {self.preview_cache_mb}.")
+
+        if self.chunk_encode_min_seconds < 0:
+            raise ValueError(f"`chunk_encode_min_seconds` Error: it can not be negative, got {self.chunk_encode_min_seconds}.")
+
+        if self.storage_quota_mb < 0 or self.storage_ttl_hours < 0 or self.storage_min_free_mb < 0:
+            raise ValueError(f"`storage_quota_mb`/`storage_ttl_hours`/`storage_min_free_mb` Error: they can not be "
+                             f"negative, got {self.storage_quota_mb}/{self.storage_ttl_hours}/{self.storage_min_free_mb}.")
+
+
+# -----------------------------------------------------------------------------
+# Setting Arguments Variable
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Configure script parameters via command-line arguments')
+    parser.add_argument('--using_logger', choices=['True', 'False'], default='False',
+                        help='Whether to use the logger. Valid values are True or False, default is False')
+    parser.add_argument('--logger_file_dir', default=None,
+                        help='Directory for the log file. If the logger is used, this directory must be specified')
+    parser.add_argument('--logger_level', default='DEBUG',
+                        help='Logging level for the logger, default is DEBUG')
+    parser.add_argument('--kb_dir', default=None,
+                        help='Base path for the video folder')
+    parser.add_argument('--max_ffmpeg_procs', type=int, default=os.cpu_count() or 1,
+                        help='Maximum number of ffmpeg/ffprobe processes running at the same time, default is the CPU count')
+    parser.add_argument('--job_workers', type=int, default=2,
+                        help='Number of background workers executing submitted jobs, default is 2')
+    parser.add_argument('--render_cache_mb', type=int, default=10240,
+                        help='Size limit of the render cache in MB, 0 disables it, default is 10240')
+    parser.add_argument('--cpu_budget', type=int, default=os.cpu_count() or 1,
+                        help='Number of cores all ffmpeg processes may use together, default is the CPU count')
+    parser.add_argument('--threads_per_encode', type=int, default=None,
+                        help='Threads for each decoding/encoding ffmpeg process, default is half of the cpu budget')
+    parser.add_argument('--metrics_file', default=None,
+                        help='File the metrics are written to in the Prometheus text format, default is None (disabled)')
+    parser.add_argument('--audio_cache_mb', type=int, default=2048,
+                        help='Size limit of the decoded background music in MB, 0 disables it, default is 2048')
+    parser.add_argument('--storage_quota_mb', type=int, default=0,
+                        help='Size limit of the clip/merge/add/timeline intermediates in MB, default is 0 (no limit)')
+    parser.add_argument('--storage_ttl_hours', type=float, default=0,
+                        help='Remove intermediates unused for this many hours, default is 0 (keep)')
+    parser.add_argument('--storage_min_free_mb', type=int, default=0,
+                        help='Remove intermediates while the disk has less free space in MB, default is 0 (no limit)')
+    parser.add_argument('--preview_cache_mb', type=int, default=4096,
+                        help='Size limit of the proxies, thumbnails and contact sheets in MB, 0 is no limit, default is 4096')
+    parser.add_argument('--chunk_encode_min_seconds', type=float, default=180,
+                        help='Re-encode inputs at least this long in parallel chunks, 0 disables it, default is 180')
+    # Transport
+    parser.add_argument('--transport', choices=['stdio', 'sse', 'streamable-http'], default='stdio',
+                        help='How the MCP server is served, default is stdio')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='Host of the HTTP transports, default is 127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000,
+                        help='Port of the HTTP transports, default is 8000')
+    parser.add_argument('--http_workers', type=int, default=1,
+                        help='Worker processes of the streamable-http transport, default is 1')
+    return parser
+
+
+def config_from_args(argv: Optional[list[str]] = None) -> VeditConfig:
+    return config_from_namespace(build_parser().parse_args(argv))
+
+
+def config_from_namespace(args: argparse.Namespace) -> VeditConfig:
+    using_logger = args.using_logger == "True"
+    return VeditConfig(
+        kb_dir=args.kb_dir,
+        using_logger=using_logger,
+        logger_level=args.logger_level,
+        logger_file_dir=args.logger_file_dir if using_logger else None,
+        max_ffmpeg_procs=args.max_ffmpeg_procs,
+        job_workers=args.job_workers,
+        render_cache_mb=args.render_cache_mb,
+        cpu_budget=args.cpu_budget,
+        threads_per_encode=args.threads_per_encode,
+        metrics_file=args.metrics_file,
+        audio_cache_mb=args.audio_cache_mb,
+        storage_quota_mb=args.storage_quota_mb,
+        storage_ttl_hours=args.storage_ttl_hours,
+        storage_min_free_mb=args.storage_min_free_mb,
+        preview_cache_mb=args.preview_cache_mb,
+        chunk_encode_min_seconds=args.chunk_encode_min_seconds,
+    )
+
+
+# configure:
+# The active config and the objects built from it. `lazy` creates an object the first time it is asked for,
+# and `configure` drops all of them, so a new config never runs with a scheduler or cache of the old one.
+_config: Optional[VeditConfig] = None
+_instances: dict[str, object] = {}
+_log_handler: Optional[int] = None
+
+
+def configure(config: VeditConfig) -> VeditConfig:
+    global _config, _log_handler
+    config.validate()
+    # Config Logger
+    # Only the records of this package are affected, the handlers of a host program are left alone.
+    if _log_handler is not None:
+        logger.remove(_log_handler)
+        _log_handler = None
+    if config.using_logger:
+        log_path = os.path.join(config.logger_file_dir, 'logs', 'mcp.log')
+        _log_handler = logger.add(
+            log_path, rotation="500 MB", retention="10 days", level=config.logger_level,
+            filter="vedit",
+            format="{time} | {level} | " + "__VEDIO_EDITOR_SERVER__" + ":{function}:{line} - {message}")
+        logger.enable("vedit")
+    else:
+        logger.disable("vedit")
+    _config = config
+    _instances.clear()
+    return config
+
+
+def get_config() -> VeditConfig:
+    if _config is None:
+        raise RuntimeError("vedit is not configured, call `vedit.configure(VeditConfig(kb_dir=...))` first.")
+    return _config
+
+
+def lazy(name: str, factory: Callable[[VeditConfig], object]):
+    if name not in _instances:
+        _instances[name] = factory(get_config())
+    return _instances[name]
@@ -0,0 +1,895 @@
+import os
+import uuid
+import shutil
+import asyncio
+import tempfile
+import subprocess
+from typing import Optional
+from loguru import logger
+from .process import run_command
+from .probe import probe_video, get_keyframe_index, measure_loudness
+from .render_cache import get_render_cache
+from .assets import get_audio_assets
+from .publish import publish_file
+from .transcode import encode
+from .formats import check_output_format, output_path_for, temp_output_for, output_args, replace_output, discard_output
+
+
+# Underlying Implementation ----------------------------------------------------
+# """
+# ## Plan
+# Actually, at a cursory glance, video editing can still be divided into the following operations: create, read, update, and delete.
+# Create: Add filters, add subtitles, add background music, etc.
+# Delete: Delete specified segments, delete subtitles, delete audio tracks, etc.
+# Update: Merge multiple videos, cut out a small segment from the original video.
+# Read: Query basic information of the original video, such as duration, frame rate, etc. (It seems this isn't very useful).
+
+# ## What has been achieved so far
+# 1. clip_video_tool: cut out a small segment from the original video.
+# 2. move_videos_tool: merge multiple videos.
+# 3. add_bgm_tool: add background music.
+# """
+# -----------------------------------------------------------------------------
+
+
+# Encoders used when a part of a stream has to be re-encoded in the codec of the source.
+VIDEO_ENCODERS = {"h264": "libx264", "hevc": "libx265"}
+AUDIO_ENCODERS = {"aac": "aac", "mp3": "libmp3lame", "ac3": "ac3"}
+
+
+def _encode_args(info: dict) -> list[str]:
+    # Re-encode with the parameters of the source so the result can be concatenated with copied parts.
+    video = next((x for x in info["streams"] if x["codec_type"] == "video"), None)
+    audio = next((x for x in info["streams"] if x["codec_type"] == "audio"), None)
+    args = ['-c:v', VIDEO_ENCODERS.get(info["video_codec"], 'libx264')]
+    if video is not None and video["pix_fmt"]:
+        args += ['-pix_fmt', video["pix_fmt"]]
+    if audio is not None:
+        args += ['-c:a', AUDIO_ENCODERS.get(audio["codec_name"], 'aac')]
+        if audio["sample_rate"]:
+            args += ['-ar', str(audio["sample_rate"])]
+        if audio["channels"]:
+            args += ['-ac', str(audio["channels"])]
+    return args
+
+
+# smart_cut:
+# `-c copy` can only start a clip on a keyframe. Instead of re-encoding the whole range, only the partial GOPs
+# at the head [start_time, first keyframe) and the tail [last keyframe, stop_time) are re-encoded, the keyframe
+# aligned middle is stream-copied, and the three parts are joined with the concat demuxer. The parts are
+# written as MPEG-TS, which carries the codec parameters in-band, so parts from different encoders can be joined.
+async def smart_cut(original_video_path: str, output_path: str, start_time: float, stop_time: float):
+    """
+    Cut [start_time, stop_time) frame-accurately, re-encoding as little as possible.
+    :raise subprocess.CalledProcessError: If one of the ffmpeg commands fails.
+    :raise ValueError: If the file can not be probed.
+    """
+    info = await probe_video(original_video_path)
+    keyframe_index = await get_keyframe_index(original_video_path)
+    encode_args = _encode_args(info)
+    epsilon = 0.001
+
+    inner = [i for i, k in enumerate(keyframe_index["times"]) if start_time - epsilon <= k <= stop_time + epsilon]
+    if info["video_codec"] not in VIDEO_ENCODERS or len(inner) < 2:
+        # Either the codec can not be re-encoded compatibly or there is no whole GOP to copy,
+        # so the range is re-encoded in one go.
+        logger.debug(f"smart_cut: re-encoding the whole range of {original_video_path}")
+        await run_command([
+            'ffmpeg', '-y',
+            '-ss', str(start_time),
+            '-i', original_video_path,
+            '-t', str(stop_time - start_time),
+            *encode_args,
+            output_path
+        ])
+        return
+
+    head_end, tail_start = keyframe_index["times"][inner[0]], keyframe_index["times"][inner[-1]]
+    # Stream copy stops on decoding timestamps, which run ahead of the presentation timestamps when there are
+    # B-frames, so the copied part is bounded by its packet count instead of its duration.
+    copy_packets = keyframe_index["packets"][inner[-1]] - keyframe_index["packets"][inner[0]]
+    temp_dir = tempfile.mkdtemp(prefix='smart_cut_', dir=os.path.dirname(output_path))
+    try:
+        parts = []
+        if head_end - start_time > epsilon:
+            parts.append(('encode', start_time, head_end))
+        parts.append(('copy', head_end, tail_start))
+        if stop_time - tail_start > epsilon:
+            parts.append(('encode', tail_start, stop_time))
+
+        commands = []
+        part_paths = []
+        for i, (mode, start, stop) in enumerate(parts):
+            part_path = os.path.join(temp_dir, f"part_{i}.ts")
+            part_paths.append(part_path)
+            if mode == 'copy':
+                # Seek a little past the keyframe, the demuxer then lands on the keyframe itself even if
+                # the printed timestamp was rounded down.
+                commands.append([
+                    'ffmpeg', '-y',
+                    '-ss', f"{start + epsilon / 2:.6f}",
+                    '-i', original_video_path,
+                    '-t', f"{stop - start:.6f}",
+                    '-frames:v', str(copy_packets),
+                    '-map', '0:v:0', '-map', '0:a:0?',
+                    '-c', 'copy',
+                    part_path
+                ])
+            else:
+                commands.append([
+                    'ffmpeg', '-y',
+                    '-ss', f"{start:.6f}",
+                    '-i', original_video_path,
+                    '-t', f"{stop - start:.6f}",
+                    '-map', '0:v:0', '-map', '0:a:0?',
+                    *encode_args,
+                    part_path
+                ])
+        await asyncio.gather(*[run_command(command) for command in commands])
+
+        list_path = os.path.join(temp_dir, "parts.txt")
+        with open(list_path, 'w', encoding='utf-8') as f:
+            for part_path in part_paths:
+                f.write(f"file '{part_path}'\n")
+        await run_command([
+            'ffmpeg', '-y',
+            '-f', 'concat',
+            '-safe', '0',
+            '-i', list_path,
+            '-c', 'copy',
+            output_path
+        ])
+        logger.debug(f"smart_cut: {len(parts)} parts, copied [{head_end}, {tail_start}) of {original_video_path}")
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+# clip_video:
+async def clip_video(
+        original_video_path: str,
+        save_folder: str,
+        start_time: int,
+        stop_time: int,
+        title: str,
+        precision: str = "keyframe",
+) -> tuple[bool, str, str]:
+    """
+    Cut a video and save it to a specified folder.
+    :param original_video_path: The path of the original video file.
+    :param save_folder: The path of the folder where the cut video will be saved.
+    :param start_time: The start time for cutting (in seconds; this time unit is sufficient for most operations).
+    :param stop_time: The end time for cutting (in seconds).
+    :param precision: "keyframe" stream-copies the range, so the cut snaps to keyframes.
+                "smart" is frame-accurate and only re-encodes the partial GOPs at both ends.
+    :return: A tuple where the first element is a boolean indicating whether the operation was successful, 
+                the second element is the output location, and the third element is the log information.
+    """
+    logger.debug("-----------------------------------------------------------------------------")
+    logger.debug("Parameter check <clip_video> ------------------------------------------------")
+    logger.debug(f"origin_video_path: {original_video_path}")
+    logger.debug(f"save_folder: {save_folder}")
+    logger.debug(f"start_time: {start_time}")
+    logger.debug(f"stop_time: {stop_time}")
+    logger.debug(f"precision: {precision}")
+    logger.debug("-----------------------------------------------------------------------------")
+
+    if precision not in ("keyframe", "smart"):
+        error_msg = f"Error: Unknown precision `{precision}`, it must be \"keyframe\" or \"smart\"."
+        logger.error(error_msg)
+        return False, "", error_msg
+
+    # Check if the original video file exists
+    if not os.path.isfile(original_video_path):
+        error_msg = f"Error: The original video file does not exist."
+        logger.error(error_msg)
+        return False, "", error_msg
+    
+    _, file_extension = os.path.splitext(original_video_path)
+
+    # Check if the target folder exists. If it doesn't exist, create it. 
+    if not os.path.exists(save_folder):
+        try:
+            os.makedirs(save_folder)
+        except OSError as e:
+            error_msg = f"Error: Failed to create the folder. Error message: {e}"
+            logger.error(error_msg)
+            return False, "", error_msg
+
+    # Generate the output file path
+    output_path = os.path.join(save_folder, f"{title}{file_extension}")
+
+    try:
+        if precision == "smart" and stop_time <= start_time:
+            error_msg = f"Error: The stop time must be greater than the start time."
+            logger.error(error_msg)
+            return False, "", error_msg
+
+        async def render():
+            if precision == "smart":
+                await smart_cut(original_video_path, output_path, start_time, stop_time)
+                return
+            # Build the FFmpeg command
+            command = [
+                'ffmpeg',
+                '-y',
+                '-ss', str(start_time),
+                '-to', str(stop_time),
+                '-i', original_video_path,
+                '-c', 'copy',
+                output_path
+            ]
+            # Execute the FFmpeg command
+            await run_command(command)
+
+        await get_render_cache().run(
+            "clip_video", [original_video_path],
+            {"start_time": start_time, "stop_time": stop_time, "precision": precision, "format": file_extension},
+            output_path, render)
+        success_msg = f"The video has been successfully cut and is being saved. "
+        logger.info(success_msg)
+        return True, output_path, success_msg
+    except subprocess.CalledProcessError as e:
+        error_msg = f"Error: An error occurred while executing the FFmpeg command. Error message: {e}"
+        logger.error(error_msg)
+        return False, "", error_msg
+    except ValueError as e:
+        error_msg = f"Error: Failed to read the information of the original video. Error message: {e}"
+        logger.error(error_msg)
+        return False, "", error_msg
+    
+# clip_segments:
+# Cutting many highlights from one recording with `clip_video` spawns one ffmpeg per segment. Here a batch of
+# segments is cut by a single ffmpeg process: the source is opened once per segment, each demuxer seeks straight
+# to its own range (so only the bytes of the segments are read), and every input is stream-copied to its own output.
+# Batches are run concurrently, bounded by `max_ffmpeg_procs` like every other command.
+CLIP_SEGMENTS_BATCH = 16    # segments per ffmpeg process
+
+async def clip_segments(
+        original_video_path: str,
+        save_folder: str,
+        segments: list[dict],
+) -> list[tuple[bool, str, str]]:
+    """
+    Cut several segments out of one video and save them to a specified folder.
+    :param original_video_path: The path of the original video file.
+    :param save_folder: The path of the folder where the cut videos will be saved.
+    :param segments: A list of dictionaries with the keys "start" and "stop" (in seconds) and "title".
+    :return: One tuple per segment, in the order of `segments`, with the same meaning as the result of `clip_video`.
+    """
+    logger.debug("-----------------------------------------------------------------------------")
+    logger.debug("Parameter check <clip_segments> ---------------------------------------------")
+    logger.debug(f"origin_video_path: {original_video_path}")
+    logger.debug(f"save_folder: {save_folder}")
+    logger.debug(f"segments: {segments}")
+    logger.debug("-----------------------------------------------------------------------------")
+
+    if not os.path.isfile(original_video_path):
+        error_msg = f"Error: The original video file does not exist."
+        logger.error(error_msg)
+        return [(False, "", error_msg)] * len(segments)
+
+    if not os.path.exists(save_folder):
+        try:
+            os.makedirs(save_folder)
+        except OSError as e:
+            error_msg = f"Error: Failed to create the folder. Error message: {e}"
+            logger.error(error_msg)
+            return [(False, "", error_msg)] * len(segments)
+
+    render_cache = get_render_cache()
+    _, file_extension = os.path.splitext(original_video_path)
+    results: list[Optional[tuple[bool, str, str]]] = [None] * len(segments)
+    valid = []
+    titles: dict[str, int] = {}
+    for i, segment in enumerate(segments):
+        try:
+            start, stop, title = segment["start"], segment["stop"], segment["title"]
+        except (KeyError, TypeError):
+            results[i] = (False, "", "Error: Each segment needs the keys `start`, `stop` and `title`.")
+            continue
+        if not _is_number(start) or not _is_number(stop) or not isinstance(title, str):
+            results[i] = (False, "", "Error: A segment needs numbers (in seconds) as `start` and `stop`, "
+                                     "and a string as `title`.")
+            continue
+        if stop <= start:
+            results[i] = (False, "", "Error: The stop time must be greater than the start time.")
+            continue
+        # One ffmpeg command would write both segments to the same file.
+        if title in titles:
+            results[i] = (False, "", f"Error: Segment {titles[title]} has the same title `{title}`, "
+                                     f"each segment needs its own.")
+            continue
+        titles[title] = i
+        output_path = os.path.join(save_folder, f"{title}{file_extension}")
+        # Same key as `clip_video`, so both tools share their cached clips.
+        key = render_cache.make_key(
+            "clip_video", [original_video_path],
+            {"start_time": start, "stop_time": stop, "precision": "keyframe", "format": file_extension})
+        if render_cache.place(key, output_path):
+            results[i] = (True, output_path, "The video has been successfully cut and is being saved. ")
+            continue
+        valid.append((i, start, stop, output_path, key))
+
+    async def run_batch(batch):
+        command = ['ffmpeg', '-y']
+        for _, start, stop, _, _ in batch:
+            command += ['-ss', str(start), '-to', str(stop), '-i', original_video_path]
+        for n, (_, _, _, output_path, _) in enumerate(batch):
+            if os.path.lexists(output_path):
+                os.remove(output_path)
+            command += ['-map', str(n), '-c', 'copy', output_path]
+        try:
+            await run_command(command)
+            success_msg = f"The video has been successfully cut and is being saved. "
+            for i, _, _, output_path, key in batch:
+                render_cache.store(key, output_path)
+                results[i] = (True, output_path, success_msg)
+        except subprocess.CalledProcessError as e:
+            error_msg = f"Error: An error occurred while executing the FFmpeg command. Error message: {e}"
+            logger.error(error_msg)
+            for i, _, _, _, _ in batch:
+                results[i] = (False, "", error_msg)
+
+    batches = [valid[i:i + CLIP_SEGMENTS_BATCH] for i in range(0, len(valid), CLIP_SEGMENTS_BATCH)]
+    await asyncio.gather(*[run_batch(batch) for batch in batches])
+    logger.info(f"{len(valid)} segments cut in {len(batches)} ffmpeg processes, {len(segments) - len(valid)} skipped.")
+    return results
+
+
+# merge profile:
+# The parameters that must be identical for the concat demuxer to join files with `-c copy`.
+def _merge_profile(info: dict) -> dict:
+    video = next((x for x in info["streams"] if x["codec_type"] == "video"), None) or {}
+    audio = next((x for x in info["streams"] if x["codec_type"] == "audio"), None) or {}
+    return {
+        "video_codec": video.get("codec_name"),
+        "width": video.get("width"),
+        "height": video.get("height"),
+        "pix_fmt": video.get("pix_fmt"),
+        "fps": round(video["fps"], 3) if video.get("fps") else None,
+        "time_base": video.get("time_base"),
+        "audio_codec": audio.get("codec_name"),
+        "sample_rate": audio.get("sample_rate"),
+        "channels": audio.get("channels"),
+    }
+
+
+async def _render_output(op: str, inputs: list[str], params: dict, output_path: str, output_format: str, render):
+    # An HLS output is a folder, the render cache only holds single files. Outputs in the default format keep
+    # the cache keys they had before there was a choice of format.
+    if output_format == "hls":
+        await render()
+        return
+    if output_format != "mp4":
+        params = dict(params, output_format=output_format)
+    await get_render_cache().run(op, inputs, params, output_path, render)
+
+
+def _merge_target(infos: list[dict]) -> dict:
+    # The most common profile wins, so as few inputs as possible are re-encoded. Ties go to the earliest input.
+    profiles = [_merge_profile(info) for info in infos]
+    target = max(profiles, key=lambda profile: (profiles.count(profile), -profiles.index(profile)))
+    if target["video_codec"] not in VIDEO_ENCODERS or (target["audio_codec"] and target["audio_codec"] not in AUDIO_ENCODERS):
+        # The common profile can not be encoded, everything is converted to H.264/AAC instead.
+        target = dict(target, video_codec="h264", pix_fmt="yuv420p", audio_codec="aac" if target["audio_codec"] else None)
+    return target
+
+
+async def _normalize_for_merge(video_path: str, info: dict, target: dict, output_path: str) -> str:
+    """
+    Re-encode `video_path` to the `target` profile, unless it already matches.
+    :return: The path of the file to concatenate, either `video_path` or `output_path`.
+    """
+    if _merge_profile(info) == target:
+        return video_path
+
+    has_audio = info["has_audio"]
+    audio_inputs = []
+    if target["audio_codec"] and not has_audio:
+        # Silent audio keeps the streams of all parts identical.
+        audio_inputs = ['-f', 'lavfi', '-t', str(info["duration"] or 0),
+                        '-i', f"anullsrc=r={target['sample_rate']}:cl={'mono' if target['channels'] == 1 else 'stereo'}"]
+    width, height = target["width"], target["height"]
+    video_args = [
+        '-vf', f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+               f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1",
+        '-c:v', VIDEO_ENCODERS[target["video_codec"]],
+        '-pix_fmt', target["pix_fmt"],
+    ]
+    if target["fps"]:
+        video_args += ['-r', str(target["fps"])]
+    output_args = []
+    if target["time_base"] and target["time_base"].startswith('1/'):
+        output_args += ['-video_track_timescale', target["time_base"][2:]]
+    audio_args = None
+    if target["audio_codec"]:
+        audio_args = [
+            '-map', '0:a:0' if has_audio else '1:a:0',
+            '-c:a', AUDIO_ENCODERS[target["audio_codec"]],
+            '-ar', str(target["sample_rate"]),
+            '-ac', str(target["channels"]),
+        ]
+        if not has_audio and not info["duration"]:
+            # The length of the silence is unknown, the video ends it. Such an input is never chunked.
+            audio_inputs[3:5] = []
+            audio_args.append('-shortest')
+    # Long inputs are encoded in parallel chunks.
+    await encode(video_path, output_path, video_args, audio_inputs, audio_args, output_args)
+    return output_path
+
+
+# merge_videos
+async def merge_videos(video_paths: list[str], save_folder: str, output_format: str = "mp4") -> tuple[bool, str, str]:
+    """
+    Merge multiple local video files.
+    :param video_paths: A list containing the paths of video files.
+    :param save_folder: The folder where the merged video will be saved.
+    :param output_format: One of `formats.OUTPUT_FORMATS`, for "hls" the output path is the playlist.
+    :return: A tuple where the first element is a boolean indicating whether the operation was successful, 
+                the second element is the output path, and the third element is the log information.
+    """
+    logger.debug("-----------------------------------------------------------------------------")
+    logger.debug("Parameter check <merge_videos> ----------------------------------------------")
+    logger.debug(f"video_path: {str(video_paths)}")
+    logger.debug(f"save_folder: {save_folder}")
+    logger.debug(f"output_format: {output_format}")
+    logger.debug("-----------------------------------------------------------------------------")
+    # Every merge writes its own output file (or folder),
+    # so concurrent merges (even of the same task) can not overwrite each other.
+    output_path = os.path.join(save_folder, f'result_{uuid.uuid4().hex[:8]}.mp4')
+    error_msg = check_output_format(output_format, output_path)
+    if error_msg is not None:
+        logger.error(error_msg)
+        return False, "", error_msg
+    output_path = output_path_for(output_path, output_format)
+
+    # Check if all video files exist
+    for path in video_paths:
+        if not os.path.isfile(path):
+            error_msg = f"Error: The video file does not exist."
+            logger.error(error_msg)
+            return False, "", error_msg
+
+    # Check if the target folder exists. If not, create it.
+    if not os.path.exists(save_folder):
+        try:
+            os.makedirs(save_folder)
+        except OSError as e:
+            error_msg = f"Error: Failed to create the folder. Error message: {e}"
+            logger.error(error_msg)
+            return False, "", error_msg
+
+    # Every merge works in its own temporary folder.
+    temp_dir = tempfile.mkdtemp(prefix='merge_', dir=save_folder)
+    try:
+        async def render():
+            # The concat demuxer only produces valid output if all inputs share their codec parameters,
+            # so the inputs that differ from the common profile are re-encoded (in parallel) first.
+            infos = await asyncio.gather(*[probe_video(path) for path in video_paths])
+            profiles = [_merge_profile(info) for info in infos]
+            if all(profile == profiles[0] for profile in profiles):
+                # Identical inputs are always stream-copied, even if their codec could not be re-encoded.
+                normalized = list(video_paths)
+                target = profiles[0]
+            else:
+                target = _merge_target(infos)
+                normalized = await asyncio.gather(*[
+                    _normalize_for_merge(path, info, target, os.path.join(temp_dir, f"input_{i}.mp4"))
+                    for i, (path, info) in enumerate(zip(video_paths, infos))
+                ])
+            reencoded = sum(1 for path, source in zip(normalized, video_paths) if path != source)
+            logger.debug(f"merge_videos: {reencoded} of {len(video_paths)} inputs re-encoded to {target}")
+
+            temp_file_list = os.path.join(temp_dir, 'file_list.txt')
+            with open(temp_file_list, 'w', encoding='utf-8') as f:
+                for path in normalized:
+                    f.write(f"file '{path}'\n")
+
+            # Build the FFmpeg command
+            temp_output = temp_output_for(output_path, output_format)
+            command = [
+                'ffmpeg',
+                '-y',
+                '-f', 'concat',
+                '-safe', '0',
+                '-i', temp_file_list,
+                '-c', 'copy',
+                *output_args(output_format, temp_output),
+                temp_output
+            ]
+            # Execute the FFmpeg command
+            try:
+                await run_command(command)
+                replace_output(temp_output, output_path, output_format)
+            finally:
+                discard_output(temp_output, output_format)
+
+        await _render_output("merge_videos", video_paths, {}, output_path, output_format, render)
+        success_msg = f"The videos have been successfully merged and saved."
+        logger.info(success_msg)
+        return True, output_path, success_msg
+    except subprocess.CalledProcessError as e:
+        error_msg = f"Error: An error occurred while executing the FFmpeg command. Error message: {e}"
+        logger.error(error_msg)
+        return False, "", error_msg
+    except Exception as e:
+        error_msg = f"An unknown error occurred: {e}"
+        logger.error(error_msg)
+        return False, "", error_msg
+    finally:
+        # Delete the temporary files
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+# render_timeline:
+# A highlight reel built with clip -> merge -> add_bgm writes every byte three times. Here the whole edit list is
+# rendered by one ffmpeg command that writes only the final output:
+# - If all sources share their codec parameters, the ranges are read through the concat demuxer (`inpoint`/`outpoint`)
+#   and the video is stream-copied. Like `clip_video`, the ranges then snap to keyframes. The audio is copied too,
+#   unless background music has to be mixed in.
+# - Otherwise (or with `precision="exact"`) the ranges are trimmed, scaled to a common format and concatenated in one
+#   filtergraph, and the result is encoded once.
+def _bgm_filters(video_audio: Optional[str], bgm_input: int, bgm: dict, output_label: str) -> list[str]:
+    delay_ms = int(float(bgm.get("offset", 0)) * 1000)
+    filters = [f"[{bgm_input}:a:0]volume={float(bgm.get('volume', 1))},adelay={delay_ms}:all=1[bgm]"]
+    if video_audio is None:
+        filters.append(f"[bgm]anull[{output_label}]")
+    else:
+        filters.append(f"{video_audio}volume={float(bgm.get('video_volume', 1))}[vid]")
+        filters.append(f"[vid][bgm]amix=inputs=2:duration=first:dropout_transition=0[{output_label}]")
+    return filters
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def check_timeline(clips: list[dict], bgm: Optional[dict]) -> Optional[str]:
+    """
+    Check the keys and the types of an edit list, before any path in it is used.
+    :return: An error message naming the first bad clip, or None if the edit list is well-formed.
+    """
+    if not isinstance(clips, list):
+        return "Error: The clips must be a list."
+    for i, clip in enumerate(clips):
+        if not isinstance(clip, dict) or any(key not in clip for key in ("source", "start", "stop")):
+            return f"Error: Clip {i} needs the keys `source`, `start` and `stop`."
+        if not isinstance(clip["source"], str) or not _is_number(clip["start"]) or not _is_number(clip["stop"]):
+            return f"Error: Clip {i} needs a path as `source` and numbers (in seconds) as `start` and `stop`."
+        if clip["start"] < 0 or clip["stop"] <= clip["start"]:
+            return f"Error: The stop time of clip {i} must be greater than its start time, which must not be negative."
+    if bgm is not None:
+        if not isinstance(bgm, dict) or not isinstance(bgm.get("audio_path"), str):
+            return "Error: The background music needs the key `audio_path`."
+        for key in ("start_time", "offset", "volume", "video_volume"):
+            if key in bgm and not _is_number(bgm[key]):
+                return f"Error: The `{key}` of the background music must be a number."
+    return None
+
+
+async def render_timeline(
+        clips: list[dict],
+        bgm: Optional[dict],
+        output_path: str,
+        precision: str = "keyframe",
+        output_format: str = "mp4",
+) -> tuple[bool, str, str]:
+    """
+    Render an edit list into a single output file.
+    :param clips: The ranges to put one after another, dictionaries with the keys "source" (the path of the video),
+                "start" and "stop" (in seconds).
+    :param bgm: Optional background music, a dictionary with the keys "audio_path", "start_time" (where to start
+                reading the music), "offset" (when the music starts in the output), "volume" and "video_volume".
+    :param output_path: The path of the output file.
+    :param precision: "keyframe" allows stream copy, "exact" always re-encodes so every cut is frame-accurate.
+    :param output_format: One of `formats.OUTPUT_FORMATS`, for "hls" the output path is the playlist.
+    :return: A tuple where the first element is a boolean indicating whether the operation was successful,
+                the second element is the output path, and the third element is the log information.
+    """
+    logger.debug("-----------------------------------------------------------------------------")
+    logger.debug("Parameter check <render_timeline> -------------------------------------------")
+    logger.debug(f"clips: {clips}")
+    logger.debug(f"bgm: {bgm}")
+    logger.debug(f"output_path: {output_path}")
+    logger.debug(f"precision: {precision}")
+    logger.debug(f"output_format: {output_format}")
+    logger.debug("-----------------------------------------------------------------------------")
+
+    if not clips:
+        return False, "", "Error: The timeline does not contain any clip."
+    if precision not in ("keyframe", "exact"):
+        return False, "", f"Error: Unknown precision `{precision}`, it must be \"keyframe\" or \"exact\"."
+    error_msg = check_timeline(clips, bgm)
+    if error_msg is not None:
+        return False, "", error_msg
+    for i, clip in enumerate(clips):
+        if not os.path.isfile(clip["source"]):
+            return False, "", f"Error: The video file {clip['source']} of clip {i} does not exist."
+    if bgm is not None and not os.path.isfile(bgm["audio_path"]):
+        return False, "", f"Error: The audio file {bgm['audio_path']} does not exist."
+    error_msg = check_output_format(output_format, output_path)
+    if error_msg is not None:
+        return False, "", error_msg
+
+    save_folder = os.path.dirname(output_path)
+    output_path = output_path_for(output_path, output_format)
+    if not os.path.exists(save_folder):
+        try:
+            os.makedirs(save_folder)
+        except OSError as e:
+            error_msg = f"Error: Failed to create the folder. Error message: {e}"
+            logger.error(error_msg)
+            return False, "", error_msg
+
+    temp_dir = tempfile.mkdtemp(prefix='timeline_', dir=save_folder)
+
+    async def render():
+        infos = await asyncio.gather(*[probe_video(clip["source"]) for clip in clips])
+        profiles = [_merge_profile(info) for info in infos]
+        stream_copy = precision == "keyframe" and all(profile == profiles[0] for profile in profiles)
+        bgm_args = []
+        if bgm is not None:
+            bgm_args = ['-ss', str(bgm.get("start_time", 0)), '-i', bgm["audio_path"]]
+
+        if stream_copy:
+            list_path = os.path.join(temp_dir, "timeline.txt")
+            with open(list_path, 'w', encoding='utf-8') as f:
+                for clip in clips:
+                    f.write(f"file '{clip['source']}'\ninpoint {clip['start']}\noutpoint {clip['stop']}\n")
+            command = ['ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', list_path, *bgm_args]
+            if bgm is None:
+                command += ['-c', 'copy']
+            else:
+                video_audio = "[0:a:0]" if profiles[0]["audio_codec"] else None
+                command += [
+                    '-filter_complex', ";".join(_bgm_filters(video_audio, 1, bgm, "aout")),
+                    '-map', '0:v:0', '-map', '[aout]',
+                    '-c:v', 'copy', '-c:a', 'aac',
+                ]
+                if video_audio is None:
+                    # Without original sound the music alone would decide the length of the output.
+                    command.append('-shortest')
+        else:
+            target = _merge_target(infos)
+            width, height = target["width"], target["height"]
+            sample_rate = target["sample_rate"] or 48000
+            layout = 'mono' if target["channels"] == 1 else 'stereo'
+            command = ['ffmpeg', '-y']
+            filters = []
+            for i, (clip, info) in enumerate(zip(clips, infos)):
+                duration = clip["stop"] - clip["start"]
+                command += ['-ss', str(clip["start"]), '-t', str(duration), '-i', clip["source"]]
+                video_filter = (f"[{i}:v:0]scale={width}:{height}:force_original_aspect_ratio=decrease,"
+                                f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,format={target['pix_fmt']}")
+                if target["fps"]:
+                    video_filter += f",fps={target['fps']}"
+                filters.append(video_filter + f"[v{i}]")
+                if info["has_audio"]:
+                    filters.append(f"[{i}:a:0]aresample={sample_rate},aformat=channel_layouts={layout}[a{i}]")
+                else:
+                    filters.append(f"anullsrc=r={sample_rate}:cl={layout},atrim=duration={duration}[a{i}]")
+            command += bgm_args
+            filters.append("".join(f"[v{i}][a{i}]" for i in range(len(clips)))
+                           + f"concat=n={len(clips)}:v=1:a=1[vout][acat]")
+            if bgm is None:
+                filters.append("[acat]anull[aout]")
+            else:
+                filters += _bgm_filters("[acat]", len(clips), bgm, "aout")
+            command += [
+                '-filter_complex', ";".join(filters),
+                '-map', '[vout]', '-map', '[aout]',
+                '-c:v', VIDEO_ENCODERS[target["video_codec"]],
+                '-c:a', AUDIO_ENCODERS.get(target["audio_codec"], 'aac'),
+            ]
+
+        logger.debug(f"render_timeline: {len(clips)} clips, stream copy: {stream_copy}")
+        temp_output = temp_output_for(output_path, output_format)
+        try:
+            await run_command([*command, *output_args(output_format, temp_output), temp_output])
+            replace_output(temp_output, output_path, output_format)
+        finally:
+            discard_output(temp_output, output_format)
+
+    try:
+        inputs = [clip["source"] for clip in clips]
+        params = {"clips": [[clip["start"], clip["stop"]] for clip in clips], "precision": precision, "bgm": None}
+        if bgm is not None:
+            inputs.append(bgm["audio_path"])
+            params["bgm"] = {key: value for key, value in bgm.items() if key != "audio_path"}
+        await _render_output("render_timeline", inputs, params, output_path, output_format, render)
+        success_msg = "The timeline has been successfully rendered and saved."
+        logger.info(success_msg)
+        return True, output_path, success_msg
+    except subprocess.CalledProcessError as e:
+        error_msg = f"Error: An error occurred while executing the FFmpeg command. Error message: {e}"
+        logger.error(error_msg)
+        return False, "", error_msg
+    except Exception as e:
+        error_msg = f"An unknown error occurred: {e}"
+        logger.error(error_msg)
+        return False, "", error_msg
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+# _loudnorm_filter:
+# The second pass of `loudnorm` with the measurements of the first pass. With them it can apply one linear gain
+# instead of its dynamic mode, so the music keeps its dynamics.
+def _loudnorm_filter(loudness: dict, target_lufs: float) -> str:
+    if loudness["input_i"] == float("-inf"):
+        # Silence can not be normalized.
+        return "volume=1"
+    return (f"loudnorm=I={target_lufs}:TP=-1.5:LRA=11"
+            f":measured_I={loudness['input_i']}:measured_TP={loudness['input_tp']}"
+            f":measured_LRA={loudness['input_lra']}:measured_thresh={loudness['input_thresh']}:linear=true")
+
+
+# add_audio_to_video
+async def add_audio_to_video(
+        video_path: str,
+        audio_path: str,
+        output_path: str,
+        start_time: int = 0,
+        audio_duration: Optional[int] = None,
+        normalize: bool = False,
+        target_lufs: float = -16.0,
+        bgm_lufs: Optional[float] = None,
+        ducking: bool = False,
+        output_format: str = "mp4",
+) -> tuple[bool, str]:
+    """
+    Mix an audio file into the sound of a video.
+    :param normalize: Normalize the original sound to `target_lufs` and the music to `bgm_lufs` (EBU R128, two passes).
+    :param target_lufs: The integrated loudness of the original sound after normalization.
+    :param bgm_lufs: The integrated loudness of the music after normalization, by default 12 LU below `target_lufs`.
+    :param ducking: Lower the music while the original sound is loud, e.g. during speech.
+    :param output_format: One of `formats.OUTPUT_FORMATS`, for "hls" the output is written to
+                `formats.output_path_for(output_path, "hls")`.
+    :return: (success, message)
+    """
+    logger.debug("-----------------------------------------------------------------------------")
+    logger.debug("Parameter check <add_audio_to_video> ----------------------------------------")
+    logger.debug(f"video_path: {video_path}")
+    logger.debug(f"audio_path: {audio_path}")
+    logger.debug(f"output_path: {output_path}")
+    logger.debug(f"start_time: {start_time}")
+    logger.debug(f"audio_duration: {audio_duration}")
+    logger.debug(f"normalize: {normalize}, target_lufs: {target_lufs}, bgm_lufs: {bgm_lufs}, ducking: {ducking}")
+    logger.debug(f"output_format: {output_format}")
+    logger.debug("-----------------------------------------------------------------------------")
+
+    if bgm_lufs is None:
+        bgm_lufs = target_lufs - 12
+    error_msg = check_output_format(output_format, output_path)
+    if error_msg is not None:
+        logger.error(error_msg)
+        return False, error_msg
+
+    for path in (video_path, audio_path):
+        if not os.path.isfile(path):
+            error_msg = f"Error: The file {path} does not exist."
+            logger.error(error_msg)
+            return False, error_msg
+
+    # Check if the target folder exists. If not, create it.
+    save_folder = os.path.dirname(output_path)
+    if not os.path.exists(save_folder):
+        try:
+            os.makedirs(save_folder)
+        except OSError as e:
+            error_msg = f"Error: Failed to create the folder. Error message: {e}"
+            logger.error(error_msg)
+            return False, error_msg
+
+    # Get the duration of the video
+    try:
+        info = await probe_video(video_path)
+        video_duration = info["duration"]
+        if video_duration is None:
+            raise ValueError(f"The duration of {video_path} is unknown.")
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Error getting video duration: {e}")
+        return False, str(e)
+    except ValueError as e:
+        logger.error("Error parsing video duration.")
+        return False, str(e)
+
+    # If the audio duration is not specified, use the video duration
+    if audio_duration is None:
+        audio_duration = video_duration
+
+    output_path = output_path_for(output_path, output_format)
+
+    async def render():
+        # The music is read from the decoded asset in the format of the original sound, so neither the
+        # decoder of the track nor the resampler of `amix` has to run, and `-ss` only skips samples.
+        music_path = audio_path
+        audio = next((x for x in info["streams"] if x["codec_type"] == "audio"), None)
+        audio_assets = get_audio_assets()
+        if audio_assets.enabled and audio is not None:
+            music_path = await audio_assets.get(audio_path, audio["sample_rate"] or 48000, audio["channels"] or 2)
+
+        video_filter, music_filter = "volume=1", "volume=1"
+        if normalize:
+            # The measurements come from the metadata cache after the first mix of a file.
+            video_loudness, music_loudness = await asyncio.gather(
+                measure_loudness(video_path), measure_loudness(audio_path))
+            video_filter = _loudnorm_filter(video_loudness, target_lufs)
+            music_filter = _loudnorm_filter(music_loudness, bgm_lufs)
+        if normalize or ducking:
+            # loudnorm works at 192 kHz, and the sidechain must have the sample rate of the music.
+            resample = f",aresample={(audio or {}).get('sample_rate') or 48000}"
+            video_filter += resample
+            music_filter += resample
+        if ducking:
+            # The original sound is split before it is filtered: with a resampler in front of `asplit`,
+            # ffmpeg stalls waiting for the sidechain.
+            filters = [
+                "[0:a]asplit=2[v1][v2]",
+                f"[v1]{video_filter}[a1]",
+                f"[v2]{video_filter}[sc]",
+                f"[1:a]{music_filter}[music]",
+                "[music][sc]sidechaincompress=threshold=0.03:ratio=8:attack=20:release=400[a2]",
+            ]
+        else:
+            filters = [f"[0:a]{video_filter}[a1]", f"[1:a]{music_filter}[a2]"]
+        # Normalized levels are meant as they are, `amix` must not scale them down by the number of inputs.
+        filters.append("[a1][a2]amix=inputs=2:duration=first:dropout_transition=0"
+                       + (":normalize=0" if normalize else "") + "[aout]")
+
+        # Build the FFmpeg command
+        ffmpeg_cmd = [
+            'ffmpeg',
+            '-y',
+            '-i', video_path,
+            '-ss', str(start_time),
+            '-t', str(min(audio_duration, video_duration)),
+            '-i', music_path,
+            '-filter_complex', ";".join(filters),
+            '-map', '0:v',
+            '-map', '[aout]',
+            '-c:v', 'copy',
+            '-c:a', 'aac',
+        ]
+        temp_output = temp_output_for(output_path, output_format)
+        try:
+            await run_command([*ffmpeg_cmd, *output_args(output_format, temp_output), temp_output])
+            replace_output(temp_output, output_path, output_format)
+        finally:
+            discard_output(temp_output, output_format)
+
+    try:
+        # Execute the FFmpeg command
+        await _render_output(
+            "add_bgm", [video_path, audio_path],
+            {
+                "start_time": start_time, "audio_duration": audio_duration, "seek": "audio",
+                "normalize": normalize, "target_lufs": target_lufs, "bgm_lufs": bgm_lufs, "ducking": ducking,
+            },
+            output_path, output_format, render)
+        logger.info(f"Successfully added audio to video. Output saved to {output_path}")
+        return True, "success"
+    except (subprocess.CalledProcessError, ValueError) as e:
+        logger.error(f"Error adding audio to video: {e}")
+        return False, str(e)
+
+
+# copy file and rename
+def copy_file(source_file: str, target_folder: str, rename: str) -> tuple[bool, str]:
+    if not os.path.isfile(source_file):
+        return False, f"it is not a file, path {source_file}"
+
+    if not os.path.exists(target_folder):
+        os.makedirs(target_folder)
+
+    # 提取源文件的后缀
+    _, file_extension = os.path.splitext(source_file)
+    # 构建包含后缀的目标文件名
+    target_file = os.path.join(target_folder, rename + file_extension)
+
+    try:
+        # Reflink or hardlink when possible, the bytes are only copied as a last resort.
+        publish_file(source_file, target_file)
+        return True, "success"
+    except Exception as e:
+        return False, f"Error occurred while copying: {str(e)}"
@@ -0,0 +1,114 @@
+import os
+import re
+import uuid
+import shutil
+from typing import Optional
+
+
+# Output formats:
+# The final render of `merge_videos`, `render_timeline` and `add_audio_to_video` writes one of these directly,
+# there is no remux pass afterwards:
+# - "mp4": as ffmpeg writes it, the index (moov) is at the end, a player needs the whole file before it can start,
+# - "faststart": the index is moved to the front when the file is finished, it plays while it is downloaded,
+# - "fmp4": fragmented MP4 with an index per fragment, it plays even while it is being written,
+# - "hls": an HLS playlist with CMAF (fragmented MP4) segments of about `HLS_SEGMENT_SECONDS`, in a folder named like
+#   the file would be. One rendition, cut from the rendered streams: a ladder would need one encode per rung.
+OUTPUT_FORMATS = ("mp4", "faststart", "fmp4", "hls")
+MP4_EXTENSIONS = (".mp4", ".m4v", ".mov")
+HLS_PLAYLIST = "index.m3u8"
+HLS_INIT = "init.mp4"
+HLS_SEGMENT_SECONDS = 6
+# The names `_temp_sibling` and `temp_output_for` give, e.g. `.result.1234abcd.tmp`, `.result.1234abcd.old.tmp`
+# and `result.1234abcd.tmp.mp4`. A title that merely contains ".tmp" is not one of them.
+TEMPORARY_NAME = re.compile(r"^\..+\.[0-9a-f]{8}(\.old)?\.tmp$|\.[0-9a-f]{8}\.tmp(\.\w+)?$")
+
+
+def check_output_format(output_format: str, output_path: str) -> Optional[str]:
+    """
+    :return: An error message if `output_format` can not be written to `output_path`, otherwise None.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        return f"Error: Unknown output format `{output_format}`, it must be one of {', '.join(OUTPUT_FORMATS)}."
+    if output_format in ("faststart", "fmp4") and os.path.splitext(output_path)[1].lower() not in MP4_EXTENSIONS:
+        return f"Error: The output format `{output_format}` needs an MP4 or MOV output, not {output_path}."
+    return None
+
+
+def is_temporary(name: str) -> bool:
+    """
+    Whether a file or folder name is one of a render or a publish still being written, see `temp_output_for`.
+    The storage manager removes the ones a dead process left behind, the indexer never looks at them.
+    """
+    return TEMPORARY_NAME.search(name) is not None
+
+
+def _temp_sibling(path: str, suffix: str = "") -> str:
+    # A hidden name next to `path`, in the same folder, so the final rename stays on one file system.
+    folder, name = os.path.split(path)
+    return os.path.join(folder, f".{name}.{uuid.uuid4().hex[:8]}{suffix}.tmp")
+
+
+def output_path_for(path: str, output_format: str) -> str:
+    """
+    The path a tool returns: the file itself, or the playlist in the folder of an HLS output.
+    """
+    if output_format == "hls":
+        return os.path.join(os.path.splitext(path)[0], HLS_PLAYLIST)
+    return path
+
+
+def temp_output_for(output_path: str, output_format: str) -> str:
+    """
+    A path next to `output_path` to render to, `replace_output` then moves it into place.
+    Identical requests write the same output path, so each one renders to its own temporary path.
+    """
+    if output_format == "hls":
+        # The folder of the playlist gets a temporary sibling, e.g. `merge/<task>/.result_1234abcd.5678ef90.tmp/`.
+        folder = _temp_sibling(os.path.dirname(output_path))
+        os.makedirs(folder)
+        return os.path.join(folder, HLS_PLAYLIST)
+    stem, extension = os.path.splitext(output_path)
+    return f"{stem}.{uuid.uuid4().hex[:8]}.tmp{extension}"
+
+
+def output_args(output_format: str, output_path: str) -> list[str]:
+    """
+    The ffmpeg options of the output, they go right before `output_path`.
+    """
+    if output_format == "faststart":
+        return ['-movflags', '+faststart']
+    if output_format == "fmp4":
+        return ['-movflags', '+frag_keyframe+empty_moov+default_base_moof']
+    if output_format == "hls":
+        return [
+            '-f', 'hls',
+            '-hls_time', str(HLS_SEGMENT_SECONDS),
+            '-hls_playlist_type', 'vod',
+            '-hls_segment_type', 'fmp4',
+            '-hls_fmp4_init_filename', HLS_INIT,
+            '-hls_segment_filename', os.path.join(os.path.dirname(output_path), "segment_%05d.m4s"),
+        ]
+    return []
+
+
+def replace_output(temp_path: str, output_path: str, output_format: str):
+    if output_format != "hls":
+        os.replace(temp_path, output_path)
+        return
+    # A folder can not replace a folder in one step, the old one is moved aside first.
+    temp_folder, folder = os.path.dirname(temp_path), os.path.dirname(output_path)
+    old_folder = None
+    if os.path.exists(folder):
+        old_folder = _temp_sibling(folder, ".old")
+        os.rename(folder, old_folder)
+    os.rename(temp_folder, folder)
+    if old_folder is not None:
+        shutil.rmtree(old_folder, ignore_errors=True)
+
+
+def discard_output(temp_path: str, output_format: str):
+    # What is left of a failed or cancelled render.
+    if output_format == "hls":
+        shutil.rmtree(os.path.dirname(temp_path), ignore_errors=True)
+    elif os.path.exists(temp_path):
+        os.remove(temp_path)
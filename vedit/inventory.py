@@ -0,0 +1,217 @@
+import os
+import glob
+import time
+import asyncio
+import subprocess
+from typing import Optional
+from loguru import logger
+from .config import lazy, KB_CACHE, KB_JOBS
+from .formats import is_temporary
+from .locks import try_lock, unlock
+from .metrics import get_metrics
+from .probe import file_identity, probe_video, get_metadata_cache
+from .progress import current_progress
+from .scheduler import current_task_id, current_priority
+
+
+# MediaIndexer:
+# Before planning an edit, the agent wants the duration and the format of many files of `kb_dir`. One probe per tool
+# call, or all of them on every call, is slow, so the metadata cache is kept warm instead:
+# - an inventory reads every known file from the metadata cache in one query, and only new or changed files are
+#   probed, at most `concurrency` at a time. A probe reads only the headers: an inventory never computes the keyframe
+#   index, which would read every byte of every recording,
+# - after the first inventory, `kb_dir` is walked every `INTERVAL` seconds in the background and new or changed files
+#   are probed at a lower priority than the tool calls, so the next inventory finds all of them in the cache.
+# `cache/` and `jobs/` are never indexed, nor hidden and temporary files such as the outputs of running renders.
+# Only one server process on the same `kb_dir` walks it at a time, they share the metadata cache anyway.
+MEDIA_EXTENSIONS = {
+    ".mp4", ".mov", ".mkv", ".avi", ".webm", ".flv", ".m4v", ".ts", ".mts", ".mpg", ".mpeg", ".wmv", ".3gp",
+    ".mp3", ".wav", ".aac", ".m4a", ".flac", ".ogg", ".opus",
+}
+COMPACT_KEYS = ("duration", "fps", "width", "height", "video_codec", "audio_codec", "bit_rate", "has_audio", "size")
+
+
+def compact_info(info: dict) -> dict:
+    """
+    The part of `probe_video` an inventory needs, without the per-stream details.
+    """
+    return {key: info[key] for key in COMPACT_KEYS}
+
+
+class MediaIndexer:
+    INTERVAL = 60
+    PRIORITY = -10      # background probes give way to the tool calls
+    BATCH = 200         # files probed before the next batch is looked up
+    SKIP = (KB_CACHE, KB_JOBS)
+
+    def __init__(self, kb_dir: str, concurrency: int):
+        """
+        :param kb_dir: The folder to index.
+        :param concurrency: The number of files probed at the same time by one inventory or background pass.
+        """
+        self.kb_dir = os.path.abspath(kb_dir)
+        self.concurrency = concurrency
+        self.indexed = 0
+        self.failed = 0
+        self.last_scan: Optional[float] = None
+        self._lock_path = os.path.join(self.kb_dir, KB_CACHE, "index.lock")
+        if not os.path.exists(os.path.dirname(self._lock_path)):
+            os.makedirs(os.path.dirname(self._lock_path), exist_ok=True)
+        self._failures: dict[str, tuple[tuple, str]] = {}     # path -> (identity, error), until the file changes
+        self._pending: set[str] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _indexable(self, path: str) -> bool:
+        # Also not the files in a hidden or temporary folder, e.g. the segments of an HLS output being rendered.
+        parts = os.path.relpath(path, self.kb_dir).split(os.sep)
+        return not (parts[0] == os.pardir or parts[0] in self.SKIP
+                    or any(part.startswith('.') or is_temporary(part) for part in parts))
+
+    def list_files(self, pattern: Optional[str] = None) -> list[str]:
+        """
+        :param pattern: A glob pattern relative to `kb_dir`, `**` matches any number of folders.
+                    None for all media files.
+        :return: The absolute paths of the matching files, sorted.
+        """
+        if pattern is not None:
+            paths = glob.glob(os.path.join(self.kb_dir, pattern), recursive=True)
+        else:
+            paths = []
+            for folder, folders, names in os.walk(self.kb_dir):
+                folders[:] = [name for name in folders if not (name.startswith('.') or is_temporary(name)
+                                                               or folder == self.kb_dir and name in self.SKIP)]
+                paths += [os.path.join(folder, name) for name in names
+                          if os.path.splitext(name)[1].lower() in MEDIA_EXTENSIONS]
+        return sorted(path for path in map(os.path.abspath, paths) if self._indexable(path) and os.path.isfile(path))
+
+    def _lookup(self, paths: list[str]) -> tuple[dict[str, dict], list[str]]:
+        # The cached entries, and the files that need a probe.
+        entries = {}
+        identities = {}
+        for path in paths:
+            try:
+                identities[path] = file_identity(path)
+            except OSError:
+                entries[path] = {"error": "This file does not exist."}
+        cached = get_metadata_cache().get_many(list(identities.values()))
+        missing = []
+        for path, identity in identities.items():
+            failure = self._failures.get(path)
+            if identity[0] in cached:
+                entries[path] = compact_info(cached[identity[0]])
+            elif failure is not None and failure[0] == identity:
+                entries[path] = {"error": failure[1]}
+            else:
+                missing.append(path)
+        return entries, missing
+
+    async def _probe(self, paths: list[str]) -> dict[str, dict]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def probe(path: str) -> tuple[str, dict]:
+            async with semaphore:
+                try:
+                    identity = file_identity(path)
+                except OSError:
+                    return path, {"error": "This file does not exist."}
+                try:
+                    info = await probe_video(path)
+                except (subprocess.CalledProcessError, ValueError, OSError) as e:
+                    # A file that is not a media file is not probed again until it changes.
+                    self._failures[path] = (identity, str(e))
+                    self.failed += 1
+                    get_metrics().inc("vedit_index_probes_total", {"result": "error"})
+                    return path, {"error": str(e)}
+                self._failures.pop(path, None)
+                self.indexed += 1
+                get_metrics().inc("vedit_index_probes_total", {"result": "ok"})
+                return path, compact_info(info)
+
+        return dict(await asyncio.gather(*[probe(path) for path in paths]))
+
+    async def inventory(self, paths: list[str], wait: bool = True) -> tuple[dict[str, dict], list[str]]:
+        """
+        Get the compact information of many files.
+        :param paths: The absolute paths of the files.
+        :param wait: Probe the new or changed files before returning. Otherwise they are left to the background
+                    indexer, which takes them next.
+        :return: The entries by path, with the keys of `COMPACT_KEYS` or an "error", and the files still pending.
+        """
+        entries, missing = self._lookup(paths)
+        if missing and wait:
+            entries.update(await self._probe(missing))
+            missing = []
+        elif missing:
+            self._pending.update(missing)
+        self._ensure_running()
+        return entries, missing
+
+    async def index(self):
+        """
+        One background pass: probe the pending files, then the new or changed media files of `kb_dir`.
+        """
+        # The files an inventory asked for first, they may have any extension.
+        pending = sorted(self._pending)
+        self._pending.clear()
+        for i in range(0, len(pending), self.BATCH):
+            _, missing = self._lookup(pending[i:i + self.BATCH])
+            await self._probe(missing)
+
+        lock_fd = try_lock(self._lock_path)
+        if lock_fd is None:
+            return
+        try:
+            paths = self.list_files()
+            for i in range(0, len(paths), self.BATCH):
+                _, missing = self._lookup(paths[i:i + self.BATCH])
+                if missing:
+                    await self._probe(missing)
+                else:
+                    await asyncio.sleep(0)
+            self.last_scan = time.time()
+        finally:
+            unlock(lock_fd)
+
+    def status(self) -> dict:
+        return {
+            "running": self._task is not None,
+            "indexed": self.indexed,
+            "failed": self.failed,
+            "pending": len(self._pending),
+            "last_scan": self.last_scan,
+        }
+
+    def _ensure_running(self):
+        # The loop needs a running event loop, so it is created on first use.
+        if self._task is not None:
+            if self._pending:
+                self._wakeup.set()
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._loop())
+
+    async def _loop(self):
+        # The task has its own copy of the context: its probes queue behind the tool calls, under a task_id of
+        # their own, and are not reported as progress of the call that started the loop.
+        current_priority.set(self.PRIORITY)
+        current_task_id.set("index")
+        current_progress.set(None)
+        while True:
+            try:
+                await self.index()
+            except Exception as e:
+                logger.error(f"Indexing {self.kb_dir} failed: {e}")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+
+def get_media_indexer() -> MediaIndexer:
+    return lazy("media_indexer", lambda config: MediaIndexer(config.kb_dir, max(2, config.max_ffmpeg_procs)))
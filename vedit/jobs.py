@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import threading
+from typing import Optional
+from loguru import logger
+from .locks import alive
+from .scheduler import current_priority
+from .progress import Progress, current_progress
+
+
+# JobManager
+# Long renders can outlive the client's request timeout, so the `submit_*` tools only enqueue the work
+# and return a job id. Workers run the jobs in the background. The jobs live in `$KB_DIR/jobs/jobs.sqlite`,
+# which is the queue of every server process on the same `kb_dir`: a worker claims the next job in one write
+# transaction, so each job runs exactly once, whichever process it was submitted to. A restarted
+# server still reports the jobs that finished before, and the queued ones are simply picked up again.
+class JobManager:
+    # queued -> running -> succeeded | failed | cancelled
+    COLUMNS = ("job_id", "kind", "params", "priority", "status", "result", "error",
+               "created_at", "started_at", "finished_at", "owner", "progress")
+    # How often idle workers look for jobs submitted to other processes, and running jobs for cancellations.
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, jobs_dir: str, workers: int, handlers: dict):
+        """
+        :param jobs_dir: The folder where the job records are persisted.
+        :param workers: The number of jobs that are executed at the same time by this process.
+        :param handlers: Maps a job kind to the coroutine function executing it.
+        """
+        self.jobs_dir = jobs_dir
+        self.workers = workers
+        self.handlers = handlers
+        self.owner = os.getpid()
+        self._running: dict[str, asyncio.Task] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker_tasks: list[asyncio.Task] = []
+        if not os.path.exists(jobs_dir):
+            os.makedirs(jobs_dir, exist_ok=True)
+        self._conn = self._connect()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_id TEXT PRIMARY KEY, kind TEXT NOT NULL, params TEXT NOT NULL, priority INTEGER NOT NULL, "
+            "status TEXT NOT NULL, result TEXT, error TEXT, created_at REAL NOT NULL, started_at REAL, "
+            "finished_at REAL, owner INTEGER, progress REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority, created_at)")
+        # The workers write on their own connection, from a thread: waiting for the write lock of another process
+        # must not block the event loop. `_worker_lock` keeps their transactions apart.
+        self._worker_conn = self._connect()
+        self._worker_lock = threading.Lock()
+        self._recover()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Autocommit, the transactions are explicit.
+        conn = sqlite3.connect(
+            os.path.join(self.jobs_dir, "jobs.sqlite"), check_same_thread=False, isolation_level=None, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _write(self, sql: str, parameters: tuple):
+        # One statement of a worker, it runs in a thread.
+        with self._worker_lock:
+            self._worker_conn.execute(sql, parameters)
+
+    def _recover(self):
+        # A running job whose process is gone will never finish. The workers run it in a thread.
+        with self._worker_lock:
+            rows = self._worker_conn.execute("SELECT job_id, owner FROM jobs WHERE status = 'running'").fetchall()
+            for job_id, owner in rows:
+                if owner != self.owner and not alive(owner):
+                    self._worker_conn.execute(
+                        "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? "
+                        "WHERE job_id = ? AND status = 'running'",
+                        ("The server restarted before this job finished.", time.time(), job_id))
+
+    def _row(self, row: tuple) -> dict:
+        job = dict(zip(self.COLUMNS, row))
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def _ensure_workers(self):
+        # The workers need a running event loop, so they are created on first use.
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+            self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, kind: str, params: dict, priority: int = 0) -> dict:
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        self._ensure_workers()
+        job_id = uuid.uuid4().hex
+        self._conn.execute(
+            "INSERT INTO jobs (job_id, kind, params, priority, status, created_at) VALUES (?, ?, ?, ?, 'queued', ?)",
+            (job_id, kind, json.dumps(params, ensure_ascii=False), priority, time.time()))
+        if self._wakeup is not None:
+            self._wakeup.set()
+        logger.info(f"Job {job_id} ({kind}) submitted.")
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        self._ensure_workers()
+        row = self._conn.execute(
+            f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._row(row) if row is not None else None
+
+    def active(self) -> list[dict]:
+        """
+        :return: The queued and running jobs of all server processes.
+        """
+        rows = self._conn.execute(
+            f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+        return [self._row(row) for row in rows]
+
+    def cancel(self, job_id: str) -> Optional[dict]:
+        self._conn.execute(
+            "UPDATE jobs SET status = 'cancelled', finished_at = ? "
+            "WHERE job_id = ? AND status IN ('queued', 'running')", (time.time(), job_id))
+        # A queued job is never claimed, a running one is interrupted by the process running it.
+        task = self._running.get(job_id)
+        if task is not None:
+            task.cancel()
+        logger.info(f"Job {job_id} cancelled.")
+        return self.get(job_id)
+
+    def _claim(self) -> Optional[dict]:
+        # It runs in a thread, see `_worker_conn`.
+        with self._worker_lock:
+            conn = self._worker_conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT job_id FROM jobs WHERE status = 'queued' "
+                    "ORDER BY priority DESC, created_at LIMIT 1").fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'running', started_at = ?, owner = ? WHERE job_id = ?",
+                        (time.time(), self.owner, row[0]))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            if row is None:
+                return None
+            return self._row(conn.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE job_id = ?", (row[0],)).fetchone())
+
+    async def _finish(self, job_id: str, status: str, result=None, error: Optional[str] = None):
+        # A job cancelled in the meantime stays cancelled.
+        await asyncio.to_thread(
+            self._write,
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? "
+            "WHERE job_id = ? AND status = 'running'",
+            (status, json.dumps(result, ensure_ascii=False), error, time.time(), job_id))
+
+    async def _report_progress(self, job_id: str, done: float, total: Optional[float], message: str):
+        if total:
+            await asyncio.to_thread(
+                self._write, "UPDATE jobs SET progress = ? WHERE job_id = ? AND status = 'running'",
+                (round(min(done / total, 1.0) * 100, 1), job_id))
+
+    async def _run(self, job: dict):
+        # The task has its own copy of the context, so the priority only applies to the ffmpeg processes of this job,
+        # and their progress goes to the job record instead of the request that submitted it.
+        current_priority.set(job.get("priority", 0))
+        current_progress.set(Progress(
+            lambda done, total, message: self._report_progress(job["job_id"], done, total, message)))
+        return await self.handlers[job["kind"]](**job["params"])
+
+    async def _worker(self):
+        while True:
+            job = await asyncio.to_thread(self._claim)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    await asyncio.to_thread(self._recover)
+                continue
+
+            job_id = job["job_id"]
+            task = asyncio.create_task(self._run(job))
+            self._running[job_id] = task
+            try:
+                # Cancellations may come from another process, they only show up in the database.
+                while not task.done():
+                    await asyncio.wait({task}, timeout=self.POLL_INTERVAL)
+                    if not task.done() and self.get(job_id)["status"] == "cancelled":
+                        task.cancel()
+                result = await task
+                # The tools report failures in their result instead of raising.
+                if isinstance(result, dict) and result.get("success") is False:
+                    await self._finish(job_id, "failed", result, result.get("message"))
+                else:
+                    await self._finish(job_id, "succeeded", result)
+            except asyncio.CancelledError:
+                if self.get(job_id)["status"] != "cancelled":
+                    raise
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {e}")
+                await self._finish(job_id, "failed", None, str(e))
+            finally:
+                self._running.pop(job_id, None)
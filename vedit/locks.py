@@ -0,0 +1,53 @@
+import os
+import fcntl
+import asyncio
+from typing import Optional
+
+
+# File locks:
+# Several server processes may work on the same `kb_dir` (the workers of the HTTP transport, or stdio servers
+# spawned by different agents). They coordinate with `flock` on files under `$KB_DIR/cache`. A lock belongs to
+# the open file, so it is released when the descriptor is closed, also when the process dies.
+POLL_INTERVAL = 0.05
+
+
+def try_lock(path: str) -> Optional[int]:
+    """
+    Take the exclusive lock of `path` without waiting.
+    :return: The descriptor holding the lock, or None if another descriptor holds it.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+async def lock(path: str) -> int:
+    # flock can not be awaited, so the lock is polled instead of blocking the event loop.
+    while True:
+        fd = try_lock(path)
+        if fd is not None:
+            return fd
+        await asyncio.sleep(POLL_INTERVAL)
+
+
+def unlock(fd: int):
+    os.close(fd)
+
+
+def alive(pid: Optional[int]) -> bool:
+    """
+    Whether the process `pid` still runs, e.g. the owner of a job or of a storage hold.
+    """
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
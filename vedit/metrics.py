@@ -0,0 +1,171 @@
+import os
+import time
+import asyncio
+import resource
+import functools
+from loguru import logger
+from .config import get_config, lazy
+from .scheduler import get_scheduler
+
+
+# Metrics:
+# Counters and latency histograms of the tools and of every ffmpeg/ffprobe process, so hosts can be sized from
+# real workloads. The child CPU time comes from `getrusage(RUSAGE_CHILDREN)`, which is only updated when a child is
+# reaped: the totals are exact, but when several processes finish at the same time the split between them is not.
+class Metrics:
+    BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, float("inf"))
+
+    def __init__(self):
+        self.counters: dict[tuple, float] = {}
+        self.histograms: dict[tuple, dict] = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return (name, tuple(sorted(labels.items())))
+
+    def inc(self, name: str, labels: dict, value: float = 1):
+        key = self._key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, labels: dict, value: float):
+        key = self._key(name, labels)
+        histogram = self.histograms.setdefault(key, {"buckets": [0] * len(self.BUCKETS), "count": 0, "sum": 0.0})
+        for i, bound in enumerate(self.BUCKETS):
+            if value <= bound:
+                histogram["buckets"][i] += 1
+                break
+        histogram["count"] += 1
+        histogram["sum"] += value
+
+    def _quantile(self, histogram: dict, q: float) -> float:
+        # The upper bound of the bucket holding the quantile, precise enough for capacity planning.
+        rank = q * histogram["count"]
+        seen = 0
+        for bound, count in zip(self.BUCKETS, histogram["buckets"]):
+            seen += count
+            if seen >= rank:
+                return bound if bound != float("inf") else self.BUCKETS[-2]
+        return self.BUCKETS[-2]
+
+    @staticmethod
+    def _gauges() -> dict:
+        # Imported here, the caches depend on this module.
+        from .probe import get_metadata_cache
+        from .render_cache import get_render_cache
+
+        metadata_cache = get_metadata_cache()
+        render_cache = get_render_cache()
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        status = get_scheduler().status()
+        return {
+            "vedit_children_cpu_user_seconds": children.ru_utime,
+            "vedit_children_cpu_system_seconds": children.ru_stime,
+            "vedit_scheduler_running": status["running"],
+            "vedit_scheduler_queued": status["queued"],
+            "vedit_scheduler_used_threads": status["used_threads"],
+            "vedit_metadata_cache_hits": metadata_cache.hits,
+            "vedit_metadata_cache_misses": metadata_cache.misses,
+            "vedit_render_cache_hits": render_cache.hits,
+            "vedit_render_cache_misses": render_cache.misses,
+            "vedit_render_cache_shared": render_cache.shared,
+        }
+
+    def snapshot(self) -> dict:
+        return {
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self.counters.items())
+            ],
+            "histograms": [
+                {
+                    "name": name, "labels": dict(labels),
+                    "count": histogram["count"], "sum": histogram["sum"],
+                    "p50": self._quantile(histogram, 0.5),
+                    "p95": self._quantile(histogram, 0.95),
+                    "p99": self._quantile(histogram, 0.99),
+                }
+                for (name, labels), histogram in sorted(self.histograms.items())
+            ],
+            "gauges": self._gauges(),
+        }
+
+    def prometheus(self) -> str:
+        def fmt(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+        lines = []
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f"{name}{fmt(labels)} {value}")
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(self.BUCKETS, histogram["buckets"]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else str(bound)
+                lines.append(f"{name}_bucket{fmt(labels, [('le', le)])} {cumulative}")
+            lines.append(f"{name}_sum{fmt(labels)} {histogram['sum']}")
+            lines.append(f"{name}_count{fmt(labels)} {histogram['count']}")
+        for name, value in self._gauges().items():
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str):
+        temp_path = path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus())
+        os.replace(temp_path, path)
+
+
+def get_metrics() -> Metrics:
+    return lazy("metrics", lambda config: Metrics())
+
+
+# instrument_tool:
+# Records the latency and the outcome of a tool call. It goes below `@mcp.tool()`, the wrapper keeps the signature
+# of the tool so FastMCP still sees the original parameters.
+def _tool_status(result) -> str:
+    if isinstance(result, dict) and result.get("success") is False:
+        return "error"
+    if isinstance(result, list) and any(isinstance(x, dict) and x.get("success") is False for x in result):
+        return "error"
+    return "ok"
+
+
+def _record_tool(name: str, started_at: float, status: str):
+    metrics = get_metrics()
+    metrics_file = get_config().metrics_file
+    metrics.observe("vedit_tool_seconds", {"tool": name}, time.monotonic() - started_at)
+    metrics.inc("vedit_tool_calls_total", {"tool": name, "status": status})
+    if metrics_file:
+        try:
+            metrics.dump(metrics_file)
+        except OSError as e:
+            logger.error(f"Error writing the metrics file: {e}")
+
+
+def instrument_tool(fn):
+    if asyncio.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started_at = time.monotonic()
+            status = "exception"
+            try:
+                result = await fn(*args, **kwargs)
+                status = _tool_status(result)
+                return result
+            finally:
+                _record_tool(fn.__name__, started_at, status)
+    else:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started_at = time.monotonic()
+            status = "exception"
+            try:
+                result = fn(*args, **kwargs)
+                status = _tool_status(result)
+                return result
+            finally:
+                _record_tool(fn.__name__, started_at, status)
+    return wrapper
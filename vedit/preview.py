@@ -0,0 +1,268 @@
+import os
+import json
+import math
+import uuid
+import shutil
+import hashlib
+import asyncio
+from typing import Optional
+from loguru import logger
+from .config import lazy, get_config
+from .locks import lock, unlock
+from .metrics import get_metrics
+from .process import run_command
+from .probe import file_identity, probe_video, get_keyframes, split_at_keyframes
+from .transcode import concat_segments, verify_output
+
+
+# PreviewCache:
+# Before cutting, the agent (or a reviewer) wants to see what is in a range. Decoding the full-resolution original
+# for that is slow, so every source gets, once:
+# - a proxy: a small H.264 copy with a keyframe every second, any range of it is cut by stream copy,
+# - a thumbnail every `THUMB_INTERVAL` seconds, named by its index, so the thumbnail of a time is found by division,
+# - contact sheets: the thumbnails tiled `SHEET_COLUMNS` x `SHEET_ROWS` per image.
+# The proxy and the thumbnails are made in one decode per chunk, the chunks start on keyframes and run in parallel.
+# Everything lives in `$KB_DIR/cache/preview/<key>/`, the key contains the identity of the source, so a changed file
+# gets new previews. The least recently used previews are removed once they take more than `preview_cache_mb`.
+PREVIEW_VERSION = 2
+PROXY_HEIGHT = 360
+PROXY_CRF = 30
+THUMB_INTERVAL = 10
+THUMB_WIDTH = 320
+SHEET_COLUMNS = 5
+SHEET_ROWS = 4
+MIN_CHUNK_SECONDS = 60
+
+
+class PreviewCache:
+    def __init__(self, cache_dir: str, max_bytes: int):
+        """
+        :param cache_dir: The folder holding one preview folder per source.
+        :param max_bytes: The size limit of all previews, 0 for no limit.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(video_path: str) -> str:
+        payload = json.dumps({"input": file_identity(video_path), "version": PREVIEW_VERSION}, ensure_ascii=False)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def _build_chunk(self, video_path: str, folder: str, index: int, start: float, end: Optional[float],
+                           threads: int) -> str:
+        segment = os.path.join(folder, f"segment_{index:04d}.mp4")
+        command = ['ffmpeg', '-y']
+        if start > 0:
+            command += ['-ss', str(start)]
+        if end is not None:
+            command += ['-t', str(end - start)]
+        command += [
+            '-i', video_path,
+            # The thumbnails get the time of the whole file, so their index is the same in every chunk.
+            '-filter_complex', f"[0:v:0]split=2[p][t];[p]scale=-2:{PROXY_HEIGHT}[proxy];"
+                               f"[t]setpts=PTS+{start}/TB,fps=1/{THUMB_INTERVAL},scale={THUMB_WIDTH}:-2[thumbs]",
+            '-map', '[thumbs]',
+            '-vsync', 'passthrough',
+            '-frame_pts', '1',
+            '-q:v', '5',
+            os.path.join(folder, "thumbs", "%08d.jpg"),
+            '-map', '[proxy]',
+            '-an',
+            '-c:v', 'libx264',
+            '-preset', 'veryfast',
+            '-crf', str(PROXY_CRF),
+            '-pix_fmt', 'yuv420p',
+            '-force_key_frames', 'expr:gte(t,n_forced*1)',
+            segment
+        ]
+        await run_command(command, threads=threads)
+        return segment
+
+    async def _build(self, video_path: str, folder: str) -> dict:
+        info = await probe_video(video_path)
+        if info["video_codec"] is None:
+            raise ValueError("The file has no video stream.")
+        duration = info["duration"] or 0.0
+        keyframes = await get_keyframes(video_path)
+        budget = get_config().cpu_budget
+        bounds = split_at_keyframes(duration, keyframes, max(1, min(int(duration // MIN_CHUNK_SECONDS), budget)),
+                                    MIN_CHUNK_SECONDS)
+        threads = max(1, budget // len(bounds))
+        logger.debug(f"preview: {video_path}, {duration:.1f}s in {len(bounds)} chunks")
+        os.makedirs(os.path.join(folder, "thumbs"))
+        os.makedirs(os.path.join(folder, "sheets"))
+        # Like `transcode.encode`, the audio is encoded once, so it has no gap at the chunk boundaries.
+        audio_path = os.path.join(folder, "audio.m4a") if info["has_audio"] else None
+        audio = [run_command([
+            'ffmpeg', '-y', '-i', video_path, '-map', '0:a:0', '-c:a', 'aac', '-b:a', '64k', '-ac', '2', audio_path
+        ])] if audio_path else []
+        results = await asyncio.gather(*[
+            self._build_chunk(video_path, folder, i, start, bounds[i + 1] if i + 1 < len(bounds) else None, threads)
+            for i, start in enumerate(bounds)
+        ], *audio)
+        segments = results[:len(bounds)]
+        proxy_path = os.path.join(folder, "proxy.mp4")
+        await concat_segments(segments, proxy_path, audio_path, ['-movflags', '+faststart'])
+        problem = await verify_output(proxy_path, duration, 1 + info["has_audio"], info["fps"])
+        if problem is not None:
+            # Only a preview, it is still good enough to look at.
+            logger.warning(f"preview: the proxy of {video_path} has {problem}")
+        for path in segments + ([audio_path] if audio_path else []):
+            os.remove(path)
+
+        # Both chunks around a boundary may produce the thumbnail closest to it, a gap is filled with the one before.
+        thumbs = sorted(int(name[:-4]) for name in os.listdir(os.path.join(folder, "thumbs")))
+        count = thumbs[-1] + 1 if thumbs else 0
+        for i in range(1, count):
+            path = os.path.join(folder, "thumbs", f"{i:08d}.jpg")
+            if not os.path.exists(path):
+                os.link(os.path.join(folder, "thumbs", f"{i - 1:08d}.jpg"), path)
+        sheets = []
+        if count:
+            await run_command([
+                'ffmpeg', '-y', '-framerate', '1', '-start_number', '0',
+                '-i', os.path.join(folder, "thumbs", "%08d.jpg"),
+                '-vf', f"tile={SHEET_COLUMNS}x{SHEET_ROWS}:padding=4:margin=4",
+                '-q:v', '5',
+                os.path.join(folder, "sheets", "%04d.jpg")
+            ])
+            per_sheet = SHEET_COLUMNS * SHEET_ROWS
+            for i in range(math.ceil(count / per_sheet)):
+                sheets.append({
+                    "file": os.path.join("sheets", f"{i + 1:04d}.jpg"),
+                    "start": i * per_sheet * THUMB_INTERVAL,
+                    "end": min((i + 1) * per_sheet * THUMB_INTERVAL, duration),
+                })
+
+        manifest = {
+            "source": video_path,
+            "duration": duration,
+            "proxy": "proxy.mp4",
+            "thumb_interval": THUMB_INTERVAL,
+            "thumbs": count,
+            "sheet_columns": SHEET_COLUMNS,
+            "sheet_rows": SHEET_ROWS,
+            "sheets": sheets,
+        }
+        with open(os.path.join(folder, "manifest.json"), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        return manifest
+
+    @staticmethod
+    def _size(folder: str) -> int:
+        size = 0
+        for root, _, names in os.walk(folder):
+            for name in names:
+                try:
+                    size += os.path.getsize(os.path.join(root, name))
+                except FileNotFoundError:
+                    pass
+        return size
+
+    def _evict(self, keep: str):
+        if not self.max_bytes:
+            return
+        previews = []
+        for name in os.listdir(self.cache_dir):
+            manifest_path = os.path.join(self.cache_dir, name, "manifest.json")
+            try:
+                previews.append((os.stat(manifest_path).st_mtime, self._size(os.path.join(self.cache_dir, name)),
+                                 os.path.join(self.cache_dir, name)))
+            except (FileNotFoundError, NotADirectoryError):
+                # A lock file, a preview being built, or one evicted by another server process.
+                continue
+        total = sum(size for _, size, _ in previews)
+        for _, size, folder in sorted(previews):
+            if total <= self.max_bytes:
+                break
+            if folder == keep:
+                continue
+            shutil.rmtree(folder, ignore_errors=True)
+            total -= size
+            self.evictions += 1
+
+    async def get(self, video_path: str) -> tuple[str, dict]:
+        """
+        Get the previews of a video, they are made on the first call.
+        :return: The folder of the previews and its manifest, with the keys "duration", "proxy", "thumb_interval",
+                    "thumbs" (the number of thumbnails), "sheet_columns", "sheet_rows" and "sheets" (each with the keys
+                    "file", "start" and "end"). The file names are relative to the folder.
+        :raise subprocess.CalledProcessError: If ffmpeg fails.
+        :raise ValueError: If the file has no video stream.
+        """
+        key = self.make_key(video_path)
+        folder = os.path.join(self.cache_dir, key)
+        manifest_path = os.path.join(folder, "manifest.json")
+        if not os.path.isfile(manifest_path):
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir, exist_ok=True)
+            # Also another server process on this `kb_dir` may be building the same previews.
+            lock_fd = await lock(os.path.join(self.cache_dir, key + ".lock"))
+            try:
+                if not os.path.isfile(manifest_path):
+                    self.misses += 1
+                    get_metrics().inc("vedit_preview_total", {"result": "miss"})
+                    temp_folder = f"{folder}.{uuid.uuid4().hex[:8]}.tmp"
+                    try:
+                        await self._build(video_path, temp_folder)
+                        # A reader never sees a half-built preview.
+                        os.rename(temp_folder, folder)
+                    finally:
+                        shutil.rmtree(temp_folder, ignore_errors=True)
+                    self._evict(keep=folder)
+                    with open(manifest_path, 'r', encoding='utf-8') as f:
+                        return folder, json.load(f)
+            finally:
+                unlock(lock_fd)
+
+        # The mtime of the manifest is the last use, it decides what is evicted first.
+        os.utime(manifest_path)
+        self.hits += 1
+        get_metrics().inc("vedit_preview_total", {"result": "hit"})
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return folder, json.load(f)
+
+    @staticmethod
+    def thumbnail(folder: str, manifest: dict, timestamp: float) -> Optional[tuple[float, str]]:
+        """
+        :return: The time and the path of the thumbnail closest to `timestamp`, None if there is none.
+        """
+        if not manifest["thumbs"]:
+            return None
+        index = min(max(round(timestamp / manifest["thumb_interval"]), 0), manifest["thumbs"] - 1)
+        return index * manifest["thumb_interval"], os.path.join(folder, "thumbs", f"{index:08d}.jpg")
+
+    @staticmethod
+    async def proxy_clip(folder: str, manifest: dict, start_time: float, end_time: float) -> str:
+        """
+        Cut a range out of the proxy by stream copy. The proxy has a keyframe every second,
+        so the range starts at most one second early.
+        :return: The path of the clip.
+        :raise subprocess.CalledProcessError: If ffmpeg fails.
+        """
+        clips_dir = os.path.join(folder, "clips")
+        if not os.path.exists(clips_dir):
+            os.makedirs(clips_dir, exist_ok=True)
+        clip_path = os.path.join(clips_dir, f"{start_time:.3f}_{end_time:.3f}.mp4")
+        if not os.path.isfile(clip_path):
+            temp_path = f"{clip_path}.{uuid.uuid4().hex[:8]}.tmp.mp4"
+            try:
+                await run_command([
+                    'ffmpeg', '-y', '-ss', str(start_time), '-i', os.path.join(folder, manifest["proxy"]),
+                    '-t', str(end_time - start_time), '-c', 'copy', '-movflags', '+faststart', temp_path
+                ])
+                os.replace(temp_path, clip_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+        return clip_path
+
+
+def get_preview_cache() -> PreviewCache:
+    return lazy("preview_cache", lambda config: PreviewCache(
+        os.path.join(config.cache_dir, "preview"),
+        config.preview_cache_max_bytes,
+    ))
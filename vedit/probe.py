@@ -0,0 +1,288 @@
+import os
+import json
+import sqlite3
+from collections import deque
+from typing import Optional
+from .config import lazy
+from .process import run_command
+
+
+# file_identity:
+# A file is considered unchanged as long as its resolved path, size and mtime are the same.
+def file_identity(path: str) -> tuple[str, int, int]:
+    stat = os.stat(path)
+    return os.path.realpath(path), stat.st_size, stat.st_mtime_ns
+
+
+# MetadataCache:
+# ffprobe results keyed by file identity. The agents work on the same source recordings again and again,
+# so after the first probe the information is read from `$KB_DIR/cache/meta.sqlite` instead of
+# spawning ffprobe. A row is ignored (and later overwritten) as soon as the size or mtime changes.
+class MetadataCache:
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.hits = 0
+        self.misses = 0
+        folder = os.path.dirname(db_path)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS video_info ("
+            "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, info TEXT NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS keyframes ("
+            "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, keyframe_index TEXT NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS loudness ("
+            "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, loudness TEXT NOT NULL)")
+        self._conn.commit()
+
+    def _get(self, table: str, column: str, identity: tuple[str, int, int]):
+        path, size, mtime_ns = identity
+        row = self._conn.execute(
+            f"SELECT {column} FROM {table} WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (path, size, mtime_ns)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def _put(self, table: str, column: str, identity: tuple[str, int, int], value):
+        self._conn.execute(
+            f"INSERT OR REPLACE INTO {table} (path, size, mtime_ns, {column}) VALUES (?, ?, ?, ?)",
+            (*identity, json.dumps(value)))
+        self._conn.commit()
+
+    def get(self, identity: tuple[str, int, int]) -> Optional[dict]:
+        return self._get("video_info", "info", identity)
+
+    def put(self, identity: tuple[str, int, int], info: dict):
+        self._put("video_info", "info", identity, info)
+
+    def get_many(self, identities: list[tuple[str, int, int]]) -> dict[str, dict]:
+        """
+        Look up many files at once, e.g. for an inventory of the whole `kb_dir`.
+        :return: The cached information by path, files without a current row are missing.
+        """
+        wanted = {identity[0]: identity for identity in identities}
+        found = {}
+        paths = list(wanted)
+        # SQLite limits the number of parameters of a statement.
+        for i in range(0, len(paths), 500):
+            batch = paths[i:i + 500]
+            rows = self._conn.execute(
+                f"SELECT path, size, mtime_ns, info FROM video_info WHERE path IN ({', '.join('?' * len(batch))})",
+                batch).fetchall()
+            for path, size, mtime_ns, info in rows:
+                if wanted[path] == (path, size, mtime_ns):
+                    found[path] = json.loads(info)
+        self.hits += len(found)
+        self.misses += len(wanted) - len(found)
+        return found
+
+    def get_keyframe_index(self, identity: tuple[str, int, int]) -> Optional[dict]:
+        return self._get("keyframes", "keyframe_index", identity)
+
+    def put_keyframe_index(self, identity: tuple[str, int, int], keyframe_index: dict):
+        self._put("keyframes", "keyframe_index", identity, keyframe_index)
+
+    def get_loudness(self, identity: tuple[str, int, int]) -> Optional[dict]:
+        return self._get("loudness", "loudness", identity)
+
+    def put_loudness(self, identity: tuple[str, int, int], loudness: dict):
+        self._put("loudness", "loudness", identity, loudness)
+
+
+def get_metadata_cache() -> MetadataCache:
+    return lazy("metadata_cache", lambda config: MetadataCache(config.meta_db_path))
+
+
+def _parse_rate(rate: Optional[str]) -> Optional[float]:
+    # ffprobe reports frame rates as fractions such as "30000/1001", and "0/0" when unknown.
+    if not rate:
+        return None
+    num, _, den = rate.partition('/')
+    try:
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+async def _read_keyframe_index(video_path: str) -> dict:
+    # Only the packet flags are read, no frame is decoded. The packets are listed in decoding order,
+    # so the position of a keyframe in that list is the number of video packets before it.
+    command = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags',
+        '-of', 'csv=p=0',
+        video_path
+    ]
+    keyframes = []
+    for packet, line in enumerate((await run_command(command)).decode().splitlines()):
+        pts_time, _, flags = line.partition(',')
+        if 'K' in flags and pts_time not in ('', 'N/A'):
+            keyframes.append((float(pts_time), packet))
+    keyframes.sort()
+    return {"times": [x[0] for x in keyframes], "packets": [x[1] for x in keyframes]}
+
+
+# get_keyframe_index:
+# Unlike `probe_video`, which only reads the headers, the index needs every packet of the file. So it is only
+# computed for the callers that cut or split at keyframes, and cached separately from the other information.
+async def get_keyframe_index(video_path: str, compute: bool = True) -> Optional[dict]:
+    """
+    Get the keyframe index of the first video stream. The index is computed once per file and then served
+    from the metadata cache.
+    :param video_path: The path of the video file.
+    :param compute: False to get None instead of reading the whole file when the index is not cached yet.
+    :return: A dictionary where "times" holds the sorted keyframe timestamps (in seconds) and "packets" holds,
+                for each keyframe, the number of video packets that precede it in decoding order.
+                Both lists are empty if the file has no video stream.
+    :raise subprocess.CalledProcessError: If ffprobe fails.
+    """
+    identity = file_identity(video_path)
+    keyframe_index = get_metadata_cache().get_keyframe_index(identity)
+    if keyframe_index is None and compute:
+        keyframe_index = await _read_keyframe_index(video_path)
+        get_metadata_cache().put_keyframe_index(identity, keyframe_index)
+    return keyframe_index
+
+
+async def get_keyframes(video_path: str) -> list[float]:
+    """
+    Get the sorted keyframe timestamps (in seconds) of the first video stream, see `get_keyframe_index`.
+    """
+    return (await get_keyframe_index(video_path))["times"]
+
+
+# split_at_keyframes:
+# Long work is split into chunks that separate ffmpeg processes run in parallel. Every chunk starts on a keyframe,
+# seeking to it is exact and decodes nothing that is thrown away.
+def split_at_keyframes(duration: float, keyframes: list[float], count: int, min_seconds: float) -> list[float]:
+    """
+    :param duration: The duration of the file in seconds.
+    :param keyframes: The sorted keyframe timestamps, empty if any position may start a chunk (e.g. audio).
+    :param count: The number of chunks wanted.
+    :param min_seconds: Chunks are not made much shorter than this.
+    :return: The start of every chunk, the first one is 0.
+    """
+    bounds = [0.0]
+    for i in range(1, count):
+        target = duration * i / count
+        if keyframes:
+            # The keyframe closest to an even split.
+            target = min(keyframes, key=lambda x: abs(x - target))
+        if target - bounds[-1] >= min_seconds / 2 and duration - target >= min_seconds / 2:
+            bounds.append(target)
+    return bounds
+
+
+# probe_video:
+async def probe_video(video_path: str) -> dict:
+    """
+    Get the basic information of a media file, using the metadata cache when possible.
+    Only the container and stream headers are read, see `get_keyframe_index` for the keyframes.
+    :param video_path: The path of the media file.
+    :return: A dictionary with the keys "duration", "size", "bit_rate", "format_name", "width", "height", "fps",
+                "video_codec", "audio_codec", "has_audio" and "streams".
+    :raise subprocess.CalledProcessError: If ffprobe fails.
+    :raise ValueError: If the output of ffprobe can not be parsed.
+    """
+    identity = file_identity(video_path)
+    info = get_metadata_cache().get(identity)
+    if info is not None:
+        return info
+
+    ffprobe_cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-show_entries', 'format=duration,bit_rate,format_name:stream',
+        '-of', 'json',
+        video_path
+    ]
+    probe = json.loads((await run_command(ffprobe_cmd)).decode())
+    fmt = probe.get("format", {})
+
+    streams = []
+    for stream in probe.get("streams", []):
+        streams.append({
+            "index": stream.get("index"),
+            "codec_type": stream.get("codec_type"),
+            "codec_name": stream.get("codec_name"),
+            "profile": stream.get("profile"),
+            "width": stream.get("width"),
+            "height": stream.get("height"),
+            "pix_fmt": stream.get("pix_fmt"),
+            "fps": _parse_rate(stream.get("avg_frame_rate")) or _parse_rate(stream.get("r_frame_rate")),
+            "time_base": stream.get("time_base"),
+            "sample_rate": int(stream["sample_rate"]) if stream.get("sample_rate") else None,
+            "channels": stream.get("channels"),
+        })
+    video = next((x for x in streams if x["codec_type"] == "video"), None)
+    audio = next((x for x in streams if x["codec_type"] == "audio"), None)
+
+    info = {
+        "duration": float(fmt["duration"]) if fmt.get("duration") not in (None, "N/A") else None,
+        "size": identity[1],
+        "bit_rate": int(fmt["bit_rate"]) if fmt.get("bit_rate") not in (None, "N/A") else None,
+        "format_name": fmt.get("format_name"),
+        "width": video["width"] if video else None,
+        "height": video["height"] if video else None,
+        "fps": video["fps"] if video else None,
+        "video_codec": video["codec_name"] if video else None,
+        "audio_codec": audio["codec_name"] if audio else None,
+        "has_audio": audio is not None,
+        "streams": streams,
+    }
+    get_metadata_cache().put(identity, info)
+    return info
+
+
+LOUDNORM_LINES = 50      # the end of the standard error that is kept, the report of `loudnorm` is in it
+
+
+# measure_loudness:
+# The first pass of EBU R128 `loudnorm`: the whole first audio stream is decoded once and its integrated loudness,
+# loudness range, true peak and gating threshold are reported. They do not depend on the target, so they are
+# cached by file identity and every later normalization of the same file only runs the second pass.
+async def measure_loudness(media_path: str) -> dict:
+    """
+    Get the loudness of the first audio stream of a media file, using the metadata cache when possible.
+    :param media_path: The path of the media file.
+    :return: A dictionary with the keys "input_i" (LUFS), "input_tp" (dBTP), "input_lra" (LU) and "input_thresh" (LUFS).
+                "input_i" is -inf for silence.
+    :raise subprocess.CalledProcessError: If ffmpeg fails, e.g. because the file has no audio.
+    :raise ValueError: If the report of `loudnorm` can not be parsed.
+    """
+    identity = file_identity(media_path)
+    loudness = get_metadata_cache().get_loudness(identity)
+    if loudness is not None:
+        return {key: float(value) for key, value in loudness.items()}
+
+    command = [
+        'ffmpeg',
+        '-hide_banner',
+        '-nostats',
+        '-i', media_path,
+        '-map', '0:a:0',
+        '-af', 'loudnorm=print_format=json',
+        '-f', 'null',
+        '-'
+    ]
+    # The report is the last JSON object that ffmpeg prints, a few lines at the very end.
+    lines = deque(maxlen=LOUDNORM_LINES)
+    await run_command(command, stderr_lines=lines.append)
+    report = "\n".join(lines)
+    start, stop = report.rfind('{'), report.rfind('}')
+    if start < 0 or stop < start:
+        raise ValueError(f"No loudness report for {media_path}.")
+    measured = json.loads(report[start:stop + 1])
+    # JSON has no infinity, the values are stored as the strings ffmpeg printed.
+    loudness = {key: measured[key] for key in ("input_i", "input_tp", "input_lra", "input_thresh")}
+    get_metadata_cache().put_loudness(identity, loudness)
+    return {key: float(value) for key, value in loudness.items()}
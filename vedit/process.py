@@ -0,0 +1,356 @@
+import os
+import re
+import time
+import signal
+import asyncio
+import resource
+import subprocess
+from collections import deque
+from typing import Callable, Optional
+from loguru import logger
+from .config import get_config
+from .metrics import get_metrics
+from .progress import Progress, current_progress
+from .scheduler import get_scheduler, get_host_budget, current_task_id, current_priority, is_reencode
+
+
+def _input_bytes(command: list[str]) -> int:
+    size = 0
+    for i, arg in enumerate(command[:-1]):
+        if arg == '-i' and os.path.isfile(command[i + 1]):
+            size += os.path.getsize(command[i + 1])
+    # ffprobe takes its input as the last argument.
+    if os.path.basename(command[0]) == 'ffprobe' and os.path.isfile(command[-1]):
+        size += os.path.getsize(command[-1])
+    return size
+
+
+def _output_bytes(outputs: list[tuple[str, dict]]) -> int:
+    # An HLS playlist is tiny, its segments are written next to it, in a folder of their own (see `formats`).
+    # Image sequences (`%08d.jpg`) are left out: parallel processes may write into the same folder.
+    size = 0
+    for path, options in outputs:
+        folder = os.path.dirname(path) or '.'
+        if options.get('-f') == 'hls' and os.path.isdir(folder):
+            size += sum(entry.stat().st_size for entry in os.scandir(folder) if entry.is_file())
+        elif os.path.isfile(path):
+            size += os.path.getsize(path)
+    return size
+
+
+# The standard error of ffmpeg/ffprobe is never inherited: under the stdio transport it would interleave with the
+# log of the server, and a long re-encode prints without end. It is read while the process runs and only its last
+# `STDERR_LINES` lines are kept, which is where ffmpeg says what went wrong. How much it prints follows the log level.
+# The reports of analysis filters are printed there too, one line per frame, so a caller that reads them gets every
+# line as it arrives and keeps what it needs; nothing else of the stream is kept.
+STDERR_LINES = 100
+STDERR_LINE_LENGTH = 1000
+READ_SIZE = 64 * 1024
+SUMMARY_LINES = 5
+SUMMARY_LENGTH = 600
+ERROR_PATTERN = re.compile(
+    r"error|invalid|no such|not found|unknown|unrecognized|failed|cannot|could not|unable|does not|not supported|"
+    r"permission denied", re.IGNORECASE)
+
+
+def summarize_stderr(lines) -> str:
+    """
+    Pick the lines that tell why ffmpeg failed.
+    :param lines: The last lines of the standard error.
+    :return: The last few error lines without the `[component @ 0x...]` prefixes, or the last lines if none
+                looks like an error, trimmed to `SUMMARY_LENGTH` characters.
+    """
+    cleaned = []
+    for line in lines:
+        line = re.sub(r"^\[[^]]+ @ 0x[0-9a-f]+\]\s*", "", line.strip())
+        if line and line not in cleaned[-1:]:
+            cleaned.append(line)
+    relevant = [line for line in cleaned if ERROR_PATTERN.search(line)] or cleaned
+    summary = "; ".join(relevant[-SUMMARY_LINES:])
+    return summary if len(summary) <= SUMMARY_LENGTH else "..." + summary[-SUMMARY_LENGTH:]
+
+
+class FFmpegError(subprocess.CalledProcessError):
+    """
+    An ffmpeg/ffprobe process exited with a non-zero code. `stderr` holds the end of its standard error,
+    `summary` the lines of it that tell why.
+    """
+    def __init__(self, returncode: int, cmd: list[str], output: bytes = None, stderr: bytes = None,
+                 summary: str = ""):
+        super().__init__(returncode, cmd, output=output, stderr=stderr)
+        self.summary = summary
+
+    def __str__(self) -> str:
+        status = f"signal {-self.returncode}" if self.returncode < 0 else f"exit status {self.returncode}"
+        program = os.path.basename(self.cmd[0])
+        return f"{program} failed ({status}): {self.summary}" if self.summary else f"{program} failed ({status})"
+
+
+async def _read_stderr(stream: asyncio.StreamReader, tail: deque, label: Optional[str],
+                       stderr_lines: Optional[Callable[[str], None]]):
+    # Read in blocks instead of lines: the statistics of ffmpeg end with \r only, a line could grow without end.
+    pending = b''
+    while True:
+        chunk = await stream.read(READ_SIZE)
+        if not chunk:
+            break
+        *lines, pending = re.split(rb'[\r\n]', pending + chunk)
+        if len(pending) > STDERR_LINE_LENGTH:
+            lines.append(pending)
+            pending = b''
+        for line in lines:
+            text = line.decode(errors='replace').strip()[:STDERR_LINE_LENGTH]
+            if text:
+                tail.append(text)
+                if stderr_lines is not None:
+                    stderr_lines(text)
+                if label is not None:
+                    logger.debug(f"{label}: {text}")
+    text = pending.decode(errors='replace').strip()[:STDERR_LINE_LENGTH]
+    if text:
+        tail.append(text)
+        if stderr_lines is not None:
+            stderr_lines(text)
+
+
+# ffmpeg options that take no value, every other option takes exactly one.
+FLAGS = {
+    '-y', '-n', '-nostdin', '-stdin', '-nostats', '-stats', '-hide_banner', '-an', '-vn', '-sn', '-dn',
+    '-shortest', '-copyts', '-start_at_zero', '-re', '-accurate_seek', '-noaccurate_seek', '-benchmark', '-xerror',
+}
+
+
+def _parse_arguments(command: list[str]) -> tuple[list[tuple[int, dict]], list[tuple[int, dict]]]:
+    # The positions of the `-i` of every input and of every output path, each with the options given before it.
+    inputs, outputs, options = [], [], {}
+    i = 1
+    while i < len(command):
+        arg = command[i]
+        if arg == '-i' and i + 1 < len(command):
+            inputs.append((i, options))
+            options, i = {}, i + 2
+        elif arg.startswith('-') and arg != '-':
+            if arg in FLAGS or i + 1 == len(command):
+                options[arg], i = None, i + 1
+            else:
+                options[arg], i = command[i + 1], i + 2
+        else:
+            outputs.append((i, options))
+            options, i = {}, i + 1
+    return inputs, outputs
+
+
+def _split_arguments(command: list[str]) -> tuple[list[tuple[str, dict]], list[tuple[str, dict]]]:
+    """
+    Split an ffmpeg command into its inputs and outputs.
+    :return: The inputs and the outputs, each as (path, the options given before it).
+    """
+    inputs, outputs = _parse_arguments(command)
+    return [(command[i + 1], options) for i, options in inputs], [(command[i], options) for i, options in outputs]
+
+
+def _with_threads(command: list[str], threads: int) -> list[str]:
+    # -threads applies per input (decoder) and per output (encoder), the filter thread options are global.
+    # A command may write several outputs, e.g. a batch of clips, or a proxy and its thumbnails.
+    inputs, outputs = _parse_arguments(command)
+    positions = {i for i, _ in inputs} | {i for i, _ in outputs}
+    result = [command[0], '-filter_threads', str(threads), '-filter_complex_threads', str(threads)]
+    for i, arg in enumerate(command[1:], 1):
+        if i in positions:
+            result += ['-threads', str(threads)]
+        result.append(arg)
+    return result
+
+
+def _seconds(value: Optional[str]) -> Optional[float]:
+    # Durations are given in seconds or as [HH:]MM:SS.
+    try:
+        return sum(float(part) * 60 ** i for i, part in enumerate(reversed(value.split(':'))))
+    except (AttributeError, ValueError):
+        return None
+
+
+async def _concat_seconds(list_path: str) -> Optional[float]:
+    # The files of a concat list are played one after the other, each from its `inpoint` to its `outpoint`.
+    from .probe import probe_video
+
+    entries = []
+    with open(list_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            name, _, value = line.strip().partition(' ')
+            if name == 'file':
+                entries.append({"file": value.strip("'")})
+            elif name in ('inpoint', 'outpoint') and entries:
+                entries[-1][name] = _seconds(value)
+    total = 0.0
+    for entry in entries:
+        stop = entry.get('outpoint')
+        if stop is None:
+            try:
+                stop = (await probe_video(entry["file"]))["duration"]
+            except (subprocess.CalledProcessError, ValueError):
+                return None
+            if stop is None:
+                return None
+        total += max(stop - (entry.get('inpoint') or 0.0), 0.0)
+    return total
+
+
+async def _expected_seconds(inputs: list[tuple[str, dict]], outputs: list[tuple[str, dict]]) -> Optional[float]:
+    # The duration of the output, from its `-t` or else from the longest input, None if it can not be told.
+    from .probe import probe_video
+
+    for _, options in outputs:
+        if '-t' in options:
+            return _seconds(options['-t'])
+    durations = []
+    for path, options in inputs:
+        start = _seconds(options.get('-ss')) or 0.0
+        if '-t' in options:
+            duration = _seconds(options['-t'])
+        elif '-to' in options:
+            duration = (_seconds(options['-to']) or 0.0) - start
+        elif options.get('-f') == 'concat' and os.path.isfile(path):
+            duration = await _concat_seconds(path)
+        elif '-f' in options or '-stream_loop' in options or not os.path.isfile(path):
+            # A lavfi source or an image sequence.
+            continue
+        else:
+            try:
+                duration = (await probe_video(path))["duration"]
+            except (subprocess.CalledProcessError, ValueError):
+                continue
+            duration = duration - start if duration is not None else None
+        if duration is not None:
+            durations.append(max(duration, 0.0))
+    return max(durations) if durations else None
+
+
+async def _follow_progress(stream: asyncio.StreamReader, progress: Progress, key: int) -> bytes:
+    # `-progress` prints blocks of key=value lines, each closed by a `progress=continue|end` line.
+    block = {}
+    async for line in stream:
+        name, _, value = line.decode(errors='replace').strip().partition('=')
+        block[name] = value.strip()
+        if name == 'progress':
+            try:
+                # "N/A" until the first frame is written.
+                seconds = int(block.get('out_time_us', '')) / 1_000_000
+            except ValueError:
+                seconds = None
+            if seconds is not None:
+                # A stream copy reports 0 fps.
+                speed, fps = block.get('speed'), block.get('fps')
+                await progress.update(key, seconds, speed if speed != 'N/A' else None,
+                                      fps if fps and fps.strip('0.') not in ('', 'N/A') else None, last=value == 'end')
+            block = {}
+    return b''
+
+
+def _remove_partial_outputs(outputs: list[tuple[str, dict]]):
+    # The tools never write into an existing file, whatever is there now was written by the killed process.
+    for path, _ in outputs:
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+# run_command:
+# Every ffmpeg/ffprobe call goes through here. The child process is awaited instead of blocking the
+# event loop, so the server keeps answering other tool calls while a render is running, and the
+# scheduler decides when it may start and how many threads it gets. The host budget then makes sure the
+# other servers on the same `kb_dir` are not using those threads at the moment.
+# While a tool call or a job follows the progress, ffmpeg reports its position on stdout. A cancelled call kills
+# the process group of the child and removes the partial outputs, so no half-written file is left in `clip/`,
+# `merge/` or `add/`.
+async def run_command(command: list[str], stderr_lines: Optional[Callable[[str], None]] = None,
+                      threads: Optional[int] = None) -> bytes:
+    """
+    Execute a command as an asyncio subprocess.
+    :param command: The command and its arguments.
+    :param stderr_lines: Called with every line of the standard error as it is read, where ffmpeg prints the reports
+                    of analysis filters. The lines are not kept, the caller keeps what it needs.
+    :param threads: The threads to ask the scheduler for a re-encode, default is `threads_per_encode`.
+                    Work split into many small processes asks for fewer threads per process.
+    :return: The captured standard output of the command.
+    :raise FFmpegError: If the command exits with a non-zero code.
+    """
+    reencode = is_reencode(command)
+    program = os.path.basename(command[0])
+    labels = {"program": program, "mode": "probe" if program == 'ffprobe' else "reencode" if reencode else "copy"}
+    queued_at = time.monotonic()
+    config = get_config()
+    scheduler = get_scheduler()
+    metrics = get_metrics()
+    inputs, outputs = _split_arguments(command) if program == 'ffmpeg' else ([], [])
+    progress = current_progress.get() if program == 'ffmpeg' else None
+    # Before the grant, the probe of the inputs needs one of its own.
+    expected = await _expected_seconds(inputs, outputs) if progress is not None else None
+    threads = await scheduler.acquire(
+        min(threads or config.encode_threads, config.cpu_budget) if reencode else 1,
+        current_task_id.get(), current_priority.get())
+    try:
+        tokens = await get_host_budget().acquire(threads)
+    except BaseException:
+        scheduler.release(threads)
+        raise
+    metrics.observe("vedit_scheduler_wait_seconds", {"mode": labels["mode"]}, time.monotonic() - queued_at)
+    bytes_read = _input_bytes(command)
+    rusage_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    started_at = time.monotonic()
+    try:
+        if reencode:
+            command = _with_threads(command, threads)
+        if progress is not None:
+            command = [command[0], '-progress', 'pipe:1', *command[1:]]
+        if stderr_lines is None and '-v' not in command and '-loglevel' not in command:
+            # A report read by the caller is printed at the info level, it needs the log level the caller chose.
+            command = [command[0], '-hide_banner', '-loglevel', config.ffmpeg_loglevel, *command[1:]]
+            if program == 'ffmpeg':
+                command.insert(1, '-nostats')
+        # stdin must not be inherited: under the stdio transport it is the MCP protocol stream,
+        # and ffmpeg reads its interactive commands from stdin. In a session of its own, a Ctrl-C in the
+        # terminal of the server does not reach the child, and the whole group can be killed at once.
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True,
+        )
+        tail = deque(maxlen=STDERR_LINES)
+        try:
+            key = progress.start(expected) if progress is not None else None
+            # A report read by the caller may be long, it is not repeated in the log.
+            label = f"{program}[{process.pid}]" if stderr_lines is None else None
+            stdout, _ = await asyncio.gather(
+                _follow_progress(process.stdout, progress, key) if progress is not None else process.stdout.read(),
+                _read_stderr(process.stderr, tail, label, stderr_lines),
+            )
+            await process.wait()
+            if progress is not None and process.returncode == 0:
+                progress.finish(key)
+        except asyncio.CancelledError:
+            # Do not leave an orphan ffmpeg behind when the caller goes away.
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            await process.wait()
+            _remove_partial_outputs(outputs)
+            raise
+    finally:
+        get_host_budget().release(tokens)
+        scheduler.release(threads)
+        rusage_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        metrics.observe("vedit_process_seconds", labels, time.monotonic() - started_at)
+        metrics.inc("vedit_process_cpu_user_seconds_total", labels, rusage_after.ru_utime - rusage_before.ru_utime)
+        metrics.inc("vedit_process_cpu_system_seconds_total", labels, rusage_after.ru_stime - rusage_before.ru_stime)
+        metrics.inc("vedit_process_bytes_read_total", labels, bytes_read)
+        if outputs:
+            metrics.inc("vedit_process_bytes_written_total", labels, _output_bytes(outputs))
+
+    metrics.inc("vedit_process_total", dict(labels, status="ok" if process.returncode == 0 else "error"))
+    if process.returncode != 0:
+        raise FFmpegError(process.returncode, command, output=stdout, stderr="\n".join(tail).encode(),
+                          summary=summarize_stderr(tail))
+    return stdout
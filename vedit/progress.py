@@ -0,0 +1,75 @@
+import time
+import contextvars
+from typing import Awaitable, Callable, Optional
+from loguru import logger
+
+
+# Progress:
+# ffmpeg prints where it is with `-progress pipe:1`, and `run_command` passes every report on to the `Progress` of
+# the current tool call or job. A call may run several ffmpeg processes, one after the other or at the same time,
+# so its progress is the sum over its processes: the seconds of output done so far, out of the expected seconds of
+# the processes started so far. The done seconds never go down, as MCP progress notifications require, while the
+# total grows when another process starts. A report is sent at most every `INTERVAL` seconds.
+current_progress = contextvars.ContextVar("current_progress", default=None)
+
+
+class Progress:
+    INTERVAL = 0.5
+
+    def __init__(self, report: Callable[[float, Optional[float], str], Awaitable[None]]):
+        """
+        :param report: Called with the done seconds, the expected seconds (None while a process has no known
+                    duration) and a message with the speed and the frame rate of the latest process.
+        """
+        self.report = report
+        self._done: dict[int, float] = {}
+        self._totals: dict[int, Optional[float]] = {}
+        self._next_key = 0
+        self._reported = 0.0
+        self._reported_at = 0.0
+
+    def start(self, total: Optional[float]) -> int:
+        """
+        Register a process.
+        :param total: The expected seconds of its output, None if unknown.
+        :return: The key of the process for `update` and `finish`.
+        """
+        key = self._next_key
+        self._next_key += 1
+        self._done[key] = 0.0
+        self._totals[key] = total
+        return key
+
+    @property
+    def done(self) -> float:
+        return sum(self._done.values())
+
+    @property
+    def total(self) -> Optional[float]:
+        if any(total is None for total in self._totals.values()):
+            return None
+        return sum(self._totals.values())
+
+    async def update(self, key: int, seconds: float, speed: Optional[str] = None, fps: Optional[str] = None,
+                     last: bool = False):
+        """
+        :param last: The last report of the process, it is never held back.
+        """
+        total = self._totals[key]
+        self._done[key] = max(self._done[key], min(seconds, total) if total is not None else seconds)
+        now = time.monotonic()
+        if self.done <= self._reported or (now - self._reported_at < self.INTERVAL and not last):
+            return
+        self._reported = self.done
+        self._reported_at = now
+        message = ", ".join(part for part in (f"speed {speed}" if speed else "", f"{fps} fps" if fps else "") if part)
+        try:
+            await self.report(self._reported, self.total, message)
+        except Exception as e:
+            # A client that went away must not fail the render.
+            logger.debug(f"progress: report failed: {e}")
+
+    def finish(self, key: int):
+        # A finished process counts as fully done, its last report may be short of the expected seconds.
+        if self._totals[key] is not None:
+            self._done[key] = max(self._done[key], self._totals[key])
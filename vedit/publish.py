@@ -0,0 +1,123 @@
+import os
+import uuid
+import fcntl
+import shutil
+from loguru import logger
+from .metrics import get_metrics
+
+
+# Publishing:
+# `task_endding` puts the final output of a task into `result/`. Copying a multi-GB render doubles its disk usage
+# and blocks the call, while the bytes never change afterwards: the tools write every output to a new file or
+# remove the old one first, and never write into an existing file. So the cheapest way that works on the file system
+# is used, in this order:
+# - reflink: the target shares the blocks of the source until one of them is written (btrfs, xfs, APFS via copy),
+# - hardlink: the target is the same inode, evicting the intermediate later leaves the result in place,
+# - copy_file_range / sendfile: the kernel copies the bytes without passing them through this process,
+# - a plain copy.
+# Every strategy writes a temporary file next to the target and renames it, so a reader of `result/` sees either
+# no file or the complete one, and a failed strategy leaves nothing behind.
+FICLONE = 0x40049409    # _IOW(0x94, 9, int) from linux/fs.h
+CHUNK_BYTES = 64 * 1024 * 1024
+
+
+def _reflink(source_file: str, temp_file: str):
+    with open(source_file, 'rb') as src, open(temp_file, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    shutil.copystat(source_file, temp_file)
+
+
+def _hardlink(source_file: str, temp_file: str):
+    os.link(source_file, temp_file)
+
+
+def _kernel_copy(source_file: str, temp_file: str):
+    with open(source_file, 'rb') as src, open(temp_file, 'wb') as dst:
+        remaining = os.fstat(src.fileno()).st_size
+        offset = 0
+        # copy_file_range fails across file systems on older kernels, sendfile does not.
+        copy = os.copy_file_range if hasattr(os, "copy_file_range") else None
+        while remaining > 0:
+            count = min(remaining, CHUNK_BYTES)
+            if copy is not None:
+                try:
+                    copied = copy(src.fileno(), dst.fileno(), count, offset, offset)
+                except OSError:
+                    copy = None
+                    continue
+            else:
+                copied = os.sendfile(dst.fileno(), src.fileno(), offset, count)
+            if copied == 0:
+                raise OSError(f"unexpected end of file at {offset} in {source_file}")
+            offset += copied
+            remaining -= copied
+    shutil.copystat(source_file, temp_file)
+
+
+def _copy(source_file: str, temp_file: str):
+    shutil.copy2(source_file, temp_file)
+
+
+STRATEGIES = (
+    ("reflink", _reflink),
+    ("hardlink", _hardlink),
+    ("kernel_copy", _kernel_copy),
+    ("copy", _copy),
+)
+
+
+def publish_file(source_file: str, target_file: str) -> str:
+    """
+    Put the content of `source_file` at `target_file`, replacing it atomically.
+    :param source_file: The file to publish, it is left unchanged.
+    :param target_file: The path of the published file, its folder must exist.
+    :return: The name of the strategy that was used.
+    :raise OSError: If not even a plain copy is possible.
+    """
+    folder = os.path.dirname(os.path.abspath(target_file))
+    error = None
+    for method, strategy in STRATEGIES:
+        temp_file = os.path.join(folder, f".{os.path.basename(target_file)}.{uuid.uuid4().hex[:8]}.tmp")
+        try:
+            strategy(source_file, temp_file)
+            os.replace(temp_file, target_file)
+        except OSError as e:
+            logger.debug(f"publish: {method} of {source_file} failed: {e}")
+            error = e
+            continue
+        finally:
+            if os.path.lexists(temp_file):
+                os.remove(temp_file)
+        get_metrics().inc("vedit_publish_total", {"method": method})
+        logger.debug(f"publish: {source_file} -> {target_file} ({method})")
+        return method
+    raise error
+
+
+def publish_folder(source_folder: str, target_folder: str) -> list[str]:
+    """
+    Publish every file of `source_folder` (e.g. an HLS playlist and its segments) to `target_folder`,
+    replacing the folder as a whole: a reader sees either the old or the new one, never a mix.
+    :param source_folder: The folder to publish, it is left unchanged. Subfolders are not published.
+    :param target_folder: The path of the published folder, its parent must exist.
+    :return: The names of the strategies that were used, one per file.
+    :raise OSError: If a file can not even be copied.
+    """
+    target_folder = os.path.abspath(target_folder)
+    temp_folder = os.path.join(os.path.dirname(target_folder),
+                               f".{os.path.basename(target_folder)}.{uuid.uuid4().hex[:8]}.tmp")
+    os.makedirs(temp_folder)
+    old_folder = None
+    try:
+        methods = [publish_file(os.path.join(source_folder, name), os.path.join(temp_folder, name))
+                   for name in sorted(os.listdir(source_folder)) if os.path.isfile(os.path.join(source_folder, name))]
+        # A folder can not replace a folder in one step, the old one is moved aside first.
+        if os.path.exists(target_folder):
+            old_folder = f"{temp_folder}.old"
+            os.rename(target_folder, old_folder)
+        os.rename(temp_folder, target_folder)
+    finally:
+        shutil.rmtree(temp_folder, ignore_errors=True)
+        if old_folder is not None:
+            shutil.rmtree(old_folder, ignore_errors=True)
+    return methods
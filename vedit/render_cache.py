@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import sqlite3
+import asyncio
+from loguru import logger
+from .config import lazy
+from .locks import lock, unlock
+from .metrics import get_metrics
+from .probe import file_identity
+
+
+# RenderCache:
+# Content-addressed store of rendered outputs. The key is a hash of the operation, the identities of its input
+# files and its parameters, so an agent retrying or repeating a request gets the earlier output back without
+# running ffmpeg. Identical requests that arrive while the first one is still rendering wait for it instead of
+# starting their own ffmpeg (single flight). Artifacts are hard links of the outputs when possible, and the least
+# recently used ones are evicted once the cache grows beyond `render_cache_mb`.
+class RenderCache:
+    def __init__(self, cache_dir: str, db_path: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.evictions = 0
+        self._inflight: dict[str, asyncio.Future] = {}
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS render_cache ("
+            "key TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)")
+        self._conn.commit()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def make_key(op: str, inputs: list[str], params: dict) -> str:
+        payload = json.dumps(
+            {"op": op, "inputs": [file_identity(path) for path in inputs], "params": params},
+            sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    @staticmethod
+    def _link(source: str, target: str):
+        # Never write into an existing target: it may be a hard link shared with the cache.
+        if os.path.lexists(target):
+            os.remove(target)
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copy2(source, target)
+
+    def place(self, key: str, output_path: str) -> bool:
+        """
+        Put the cached artifact of `key` at `output_path`.
+        :return: False if there is no usable artifact for this key.
+        """
+        if not self.enabled:
+            return False
+        row = self._conn.execute("SELECT path FROM render_cache WHERE key = ?", (key,)).fetchone()
+        if row is None or not os.path.isfile(row[0]):
+            return False
+        if os.path.abspath(row[0]) != os.path.abspath(output_path):
+            self._link(row[0], output_path)
+        self._conn.execute("UPDATE render_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+        self._conn.commit()
+        self.hits += 1
+        return True
+
+    def store(self, key: str, output_path: str):
+        if not self.enabled or not os.path.isfile(output_path):
+            return
+        _, file_extension = os.path.splitext(output_path)
+        cache_path = os.path.join(self.cache_dir, key + file_extension)
+        self._link(output_path, cache_path)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO render_cache (key, path, size, last_access) VALUES (?, ?, ?, ?)",
+            (key, cache_path, os.path.getsize(cache_path), time.time()))
+        self._conn.commit()
+        self._evict()
+
+    def artifacts(self) -> dict[tuple[int, int], str]:
+        """
+        :return: The path of every artifact by its (device, inode), to find the outputs that are hard links of it.
+        """
+        artifacts = {}
+        for (path,) in self._conn.execute("SELECT path FROM render_cache").fetchall():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            artifacts[(stat.st_dev, stat.st_ino)] = path
+        return artifacts
+
+    def forget(self, path: str):
+        """
+        Remove the artifact at `path`, e.g. because its output was evicted and the disk space is needed.
+        """
+        for (key,) in self._conn.execute("SELECT key FROM render_cache WHERE path = ?", (path,)).fetchall():
+            self._conn.execute("DELETE FROM render_cache WHERE key = ?", (key,))
+            self.evictions += 1
+        self._conn.commit()
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM render_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, path, size in self._conn.execute(
+                "SELECT key, path, size FROM render_cache ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            for stale in (path, os.path.join(self.cache_dir, key + ".lock")):
+                if os.path.exists(stale):
+                    os.remove(stale)
+            self._conn.execute("DELETE FROM render_cache WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+        self._conn.commit()
+
+    async def run(self, op: str, inputs: list[str], params: dict, output_path: str, render) -> bool:
+        """
+        Produce `output_path` from the cache, from an identical render in flight, or by awaiting `render()`.
+        :param op: The name of the operation.
+        :param inputs: The input files of the operation, their identities are part of the key.
+        :param params: Everything else that influences the output. It must be JSON serializable.
+        :param output_path: Where the output is expected.
+        :param render: An async callable writing `output_path`, it raises if the render fails.
+        :return: True if the output was served from the cache or shared with a concurrent render.
+        """
+        if not self.enabled:
+            # The output may still be a hard link left by an earlier run with the cache enabled.
+            if os.path.lexists(output_path):
+                os.remove(output_path)
+            await render()
+            return False
+
+        key = self.make_key(op, inputs, params)
+        while True:
+            if self.place(key, output_path):
+                logger.debug(f"render cache hit: {op} {key}")
+                get_metrics().inc("vedit_render_cache_total", {"op": op, "result": "hit"})
+                return True
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            try:
+                await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # Only retry if the other render was cancelled, not this call.
+                if not inflight.cancelled():
+                    raise
+                continue
+            self.shared += 1
+            if self.place(key, output_path):
+                self.hits -= 1
+                get_metrics().inc("vedit_render_cache_total", {"op": op, "result": "shared"})
+                return True
+            # The artifact did not make it into the cache (e.g. it is larger than the cache), render it here.
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        lock_fd = None
+        try:
+            # The same key may be rendering in another server process on this `kb_dir`, wait for its artifact.
+            lock_fd = await lock(os.path.join(self.cache_dir, key + ".lock"))
+            if self.place(key, output_path):
+                self.hits -= 1
+                self.shared += 1
+                get_metrics().inc("vedit_render_cache_total", {"op": op, "result": "shared"})
+                future.set_result(None)
+                return True
+
+            self.misses += 1
+            get_metrics().inc("vedit_render_cache_total", {"op": op, "result": "miss"})
+            if os.path.lexists(output_path):
+                os.remove(output_path)
+            await render()
+            self.store(key, output_path)
+            future.set_result(None)
+            return False
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Followers re-raise the exception, this keeps asyncio from complaining when there are none.
+            future.exception()
+            raise
+        finally:
+            if lock_fd is not None:
+                unlock(lock_fd)
+            self._inflight.pop(key, None)
+
+
+def get_render_cache() -> RenderCache:
+    return lazy("render_cache", lambda config: RenderCache(
+        os.path.join(config.cache_dir, "render"),
+        config.meta_db_path,
+        config.render_cache_max_bytes,
+    ))
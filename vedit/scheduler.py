@@ -0,0 +1,169 @@
+import os
+import time
+import asyncio
+import contextvars
+from collections import deque
+from .config import lazy
+from .locks import POLL_INTERVAL, try_lock, unlock
+
+
+# FFmpegScheduler:
+# Every ffmpeg/ffprobe process needs a grant from the scheduler before it is started. A grant is a number of threads
+# out of the global `cpu_budget`, and at most `max_ffmpeg_procs` processes hold one at the same time, so concurrent
+# re-encodes no longer oversubscribe the cores. Work that does not fit waits in one queue per `task_id`. Higher
+# priorities go first, and within a priority the tasks take turns (round robin), so one big task can not starve the
+# others. The head of the queue is never overtaken, which keeps large encodes from waiting forever behind small jobs.
+current_task_id = contextvars.ContextVar("current_task_id", default="")
+current_priority = contextvars.ContextVar("current_priority", default=0)
+
+
+class FFmpegScheduler:
+    def __init__(self, cpu_budget: int, max_procs: int):
+        self.cpu_budget = cpu_budget
+        self.max_procs = max_procs
+        self.used_threads = 0
+        self.running = 0
+        self.granted = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._queues: dict[str, deque] = {}    # task_id -> waiters, each [priority, threads, future, enqueued_at]
+        self._turns: deque = deque()           # task_ids in round-robin order
+
+    def _fits(self, threads: int) -> bool:
+        if self.running >= self.max_procs:
+            return False
+        # A job larger than the whole budget may still run alone.
+        return self.running == 0 or self.used_threads + threads <= self.cpu_budget
+
+    def _grant(self, threads: int, waited: float):
+        self.used_threads += threads
+        self.running += 1
+        self.granted += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    def _dispatch(self):
+        while self._turns:
+            # The first task in turn order among those whose head waiter has the highest priority.
+            task_id = max(self._turns, key=lambda x: self._queues[x][0][0])
+            priority, threads, future, enqueued_at = self._queues[task_id][0]
+            if not self._fits(threads):
+                return
+            self._queues[task_id].popleft()
+            self._turns.remove(task_id)
+            if self._queues[task_id]:
+                self._turns.append(task_id)
+            else:
+                del self._queues[task_id]
+            self._grant(threads, time.monotonic() - enqueued_at)
+            future.set_result(threads)
+
+    async def acquire(self, threads: int, task_id: str = "", priority: int = 0) -> int:
+        """
+        Wait until `threads` threads of the budget are available.
+        :return: The number of granted threads, which must be given back with `release`.
+        """
+        if not self._turns and self._fits(threads):
+            self._grant(threads, 0.0)
+            return threads
+
+        waiter = [priority, threads, asyncio.get_running_loop().create_future(), time.monotonic()]
+        if task_id not in self._queues:
+            self._queues[task_id] = deque()
+            self._turns.append(task_id)
+        self._queues[task_id].append(waiter)
+        try:
+            return await waiter[2]
+        except asyncio.CancelledError:
+            if waiter[2].done() and not waiter[2].cancelled():
+                # The grant arrived together with the cancellation.
+                self.release(threads)
+            elif task_id in self._queues:
+                self._queues[task_id].remove(waiter)
+                if not self._queues[task_id]:
+                    del self._queues[task_id]
+                    self._turns.remove(task_id)
+                self._dispatch()
+            raise
+
+    def release(self, threads: int):
+        self.used_threads -= threads
+        self.running -= 1
+        self._dispatch()
+
+    def status(self) -> dict:
+        now = time.monotonic()
+        oldest = min((w[3] for queue in self._queues.values() for w in queue), default=now)
+        return {
+            "cpu_budget": self.cpu_budget,
+            "max_procs": self.max_procs,
+            "used_threads": self.used_threads,
+            "running": self.running,
+            "queued": sum(len(queue) for queue in self._queues.values()),
+            "queued_by_task": {task_id: len(queue) for task_id, queue in self._queues.items()},
+            "oldest_wait": now - oldest,
+            "granted": self.granted,
+            "avg_wait": self.total_wait / self.granted if self.granted else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+
+def get_scheduler() -> FFmpegScheduler:
+    return lazy("scheduler", lambda config: FFmpegScheduler(config.cpu_budget, config.max_ffmpeg_procs))
+
+
+# HostBudget:
+# The scheduler only sees the processes of its own server. All servers on the same `kb_dir` share the budget
+# through token files: a process holds one of `max_ffmpeg_procs` process tokens and one cpu token per thread
+# while it runs. Tokens are taken all at once or not at all, so two servers never wait for each other's halves.
+class HostBudget:
+    def __init__(self, slots_dir: str, cpu_budget: int, max_procs: int):
+        self.slots_dir = slots_dir
+        self.cpu_budget = cpu_budget
+        self.max_procs = max_procs
+        if not os.path.exists(slots_dir):
+            os.makedirs(slots_dir, exist_ok=True)
+
+    def _take(self, prefix: str, count: int, total: int) -> list[int]:
+        fds = []
+        for i in range(total):
+            if len(fds) == count:
+                break
+            fd = try_lock(os.path.join(self.slots_dir, f"{prefix}_{i}.lock"))
+            if fd is not None:
+                fds.append(fd)
+        return fds
+
+    async def acquire(self, threads: int) -> list[int]:
+        """
+        Wait until one process token and `threads` cpu tokens are free.
+        :return: The tokens, which must be given back with `release`.
+        """
+        threads = min(threads, self.cpu_budget)
+        while True:
+            tokens = self._take("proc", 1, self.max_procs)
+            if tokens:
+                tokens += self._take("cpu", threads, self.cpu_budget)
+                if len(tokens) == threads + 1:
+                    return tokens
+            self.release(tokens)
+            await asyncio.sleep(POLL_INTERVAL)
+
+    @staticmethod
+    def release(tokens: list[int]):
+        for fd in tokens:
+            unlock(fd)
+
+
+def get_host_budget() -> HostBudget:
+    return lazy("host_budget", lambda config: HostBudget(
+        os.path.join(config.cache_dir, "slots"), config.cpu_budget, config.max_ffmpeg_procs))
+
+
+def is_reencode(command: list[str]) -> bool:
+    # An ffmpeg command is cheap only if every stream is copied. Anything that decodes counts as a re-encode.
+    if os.path.basename(command[0]) != 'ffmpeg':
+        return False
+    codecs = [command[i + 1] for i, arg in enumerate(command[:-1]) if arg == '-c' or arg.startswith('-c:')]
+    filters = {'-vf', '-af', '-filter_complex', '-filter:v', '-filter:a'}
+    return not codecs or any(codec != 'copy' for codec in codecs) or any(arg in filters for arg in command)
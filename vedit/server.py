@@ -0,0 +1,931 @@
+import os
+import json
+import math
+import asyncio
+import inspect
+import dataclasses
+import subprocess
+from contextlib import contextmanager
+from typing import Optional
+from mcp.server.fastmcp import FastMCP
+from mcp.server.session import ServerSession
+from loguru import logger
+from .config import (
+    KB_CLIP, KB_MERGE, KB_RESULT, KB_ADD, KB_TIMELINE, KB_JOBS,
+    VeditConfig, build_parser, config_from_namespace, configure, get_config, lazy,
+)
+from .scheduler import current_task_id, get_scheduler
+from .progress import Progress, current_progress
+from .metrics import get_metrics, instrument_tool
+from .probe import probe_video, get_keyframe_index, get_metadata_cache
+from .render_cache import get_render_cache
+from .assets import get_audio_assets
+from .editing import (
+    clip_video, clip_segments, merge_videos, render_timeline, check_timeline, add_audio_to_video, copy_file,
+)
+from .jobs import JobManager
+from .storage import StorageManager
+from .analysis import analyze_video
+from .preview import get_preview_cache
+from .formats import HLS_PLAYLIST, output_path_for
+from .publish import publish_folder
+from .inventory import get_media_indexer
+
+
+# MCP Service  --------------------
+# Older `mcp` versions send progress notifications without a message.
+_PROGRESS_PARAMETERS = inspect.signature(ServerSession.send_progress_notification).parameters
+
+
+class VeditMCP(FastMCP):
+    async def call_tool(self, name: str, arguments: dict):
+        # A client that sends a progress token with the call gets the progress of its ffmpeg processes.
+        try:
+            request = self._mcp_server.request_context
+        except LookupError:
+            request = None
+        token = request.meta.progressToken if request is not None and request.meta is not None else None
+        if token is None:
+            return await super().call_tool(name, arguments)
+
+        async def report(done: float, total: Optional[float], message: str):
+            extra = {}
+            if "message" in _PROGRESS_PARAMETERS:
+                extra["message"] = message or None
+            if "related_request_id" in _PROGRESS_PARAMETERS:
+                extra["related_request_id"] = str(request.request_id)
+            await request.session.send_progress_notification(token, round(done, 3), total and round(total, 3), **extra)
+
+        reset = current_progress.set(Progress(report))
+        try:
+            return await super().call_tool(name, arguments)
+        finally:
+            current_progress.reset(reset)
+
+
+mcp = VeditMCP(
+    name="VideoEditorMCP",
+    description="A video editing MCP tool service that has implemented " \
+    "the basic functions among the fundamental functions.",
+    version="0.1.4",
+
+)
+
+# --------------------------------
+# Storage ------------------------
+def get_storage_manager() -> StorageManager:
+    return lazy("storage", lambda config: StorageManager(
+        config.kb_dir,
+        config.meta_db_path,
+        config.storage_quota_mb * 1024 * 1024,
+        config.storage_ttl_hours * 3600,
+        config.storage_min_free_mb * 1024 * 1024,
+        active_jobs=lambda: get_job_manager().active(),
+        render_cache=get_render_cache(),
+    ))
+
+
+@contextmanager
+def _using(*paths: str):
+    # The inputs of a tool count as used for the LRU order of the storage manager. They, and the task folder
+    # of the outputs, are not evicted before the tool is done.
+    storage = get_storage_manager()
+    storage.touch(paths)
+    with storage.hold(paths):
+        yield
+
+
+# --------------------------------
+# MCP Tools ----------------------
+
+# --------------------------------------------------------------------------
+# mcp-tools注册
+@mcp.tool()
+@instrument_tool
+async def clip_video_tool(
+        original_video_path: str,
+        task_id: str,
+        start_time: int,
+        stop_time: int,
+        title: str,
+        precision: str = "keyframe",
+) -> dict:
+    """
+    Clip a video based on the given start and stop times.
+    
+    Parameters:
+    original_video_path (str): The path of the original video file.
+    task_id (str): The unique identifier for the clipping task.
+    start_time (int): The start time (in some appropriate unit) for the clipping.
+    stop_time (int): The stop time (in some appropriate unit) for the clipping.
+    title (str): title: the title of the clipping.(This item does not include suffix names)
+    precision (str, optional): "keyframe" (default) is the fastest, but the cut snaps to the nearest keyframes,
+                so it may be off by up to a few seconds. "smart" cuts exactly at the given times and is still
+                much faster than re-encoding the whole clip.
+    Returns:
+    dict: A dictionary containing the result of the clipping operation.
+          The dictionary has the following keys:
+          - "success": A boolean indicating whether the operation was successful.
+          - "message": A string providing additional information about the operation.
+          - "output_path": The path of the clipped video file.
+    """
+    kb_dir = get_config().kb_dir
+    # In fact, both the `original_video_path` and `output_path` are based on the `KB_DIR`, 
+    # that is, in the form of `$KB_DIR/xxxxx`. 
+    # 
+    # It is necessary to ensure that each input is based on the `KB_DIR`, 
+    # and each output is also based on the KB. 
+    # The reason for this design is mainly due to the concern that errors may occur 
+    # when generating paths and other operations. 
+    # Therefore, every effort is made to avoid such instability.  
+    current_task_id.set(task_id)
+    _original_video_path = os.path.join(kb_dir, original_video_path)
+    _save_folder = os.path.join(kb_dir, KB_CLIP, task_id)
+    with _using(_original_video_path, _save_folder):
+        success, output_path, message = await clip_video(
+            _original_video_path, _save_folder, start_time, stop_time, title, precision)
+    return {"success": success, "message": message, "output_path": output_path[len(kb_dir)+1:]}
+
+
+@mcp.tool()
+@instrument_tool
+async def clip_segments_tool(original_video_path: str, task_id: str, segments: list[dict]) -> list[dict]:
+    """
+    Clip several segments out of the same video at once. This is much faster than calling `clip_video_tool`
+    once per segment, use it whenever more than one segment of a video is needed.
+
+    Parameters:
+    original_video_path (str): The path of the original video file.
+    task_id (str): The unique identifier for the clipping task.
+    segments (list[dict]): The segments to clip. Each one is a dictionary with the keys:
+                - "start": The start time (in seconds) of the segment.
+                - "stop": The stop time (in seconds) of the segment.
+                - "title": The title of the segment, different for each segment.(This item does not include suffix names)
+    Returns:
+    list[dict]: One dictionary per segment, in the same order as `segments`, with the same keys as the result
+                of `clip_video_tool`: "success", "message" and "output_path".
+    """
+    kb_dir = get_config().kb_dir
+    current_task_id.set(task_id)
+    _original_video_path = os.path.join(kb_dir, original_video_path)
+    _save_folder = os.path.join(kb_dir, KB_CLIP, task_id)
+    with _using(_original_video_path, _save_folder):
+        results = await clip_segments(_original_video_path, _save_folder, segments)
+    return [
+        {"success": success, "message": message, "output_path": output_path[len(kb_dir)+1:]}
+        for success, output_path, message in results
+    ]
+
+
+@mcp.tool()
+@instrument_tool
+async def merge_videos_tool(video_paths: list[str], task_id: str, output_format: str = "mp4") -> dict:
+    """
+    Merge multiple videos into one.
+
+    Parameters:
+    video_paths (list[str]): A list of paths of the video files to be merged.
+    task_id (str): The unique identifier for the merging task.
+    output_format (str, optional): "mp4" (the default), "faststart" (an MP4 that plays while it is downloaded),
+                "fmp4" (a fragmented MP4, it plays even while it is being written) or "hls" (an HLS playlist with
+                CMAF segments, "output_path" is then the `index.m3u8` in a folder that also holds the segments).
+
+    Returns:
+    dict: A dictionary containing the result of the merging operation.
+          The dictionary has the following keys:
+          - "success": A boolean indicating whether the operation was successful.
+          - "message": A string providing additional information about the operation.
+          - "output_path": The path of the merged video file.
+    """
+    kb_dir = get_config().kb_dir
+    current_task_id.set(task_id)
+    # the `video_paths` and `output_path` relative to the `KB_DIR``
+    _video_paths = []
+    for path in video_paths:
+        _video_paths.append(os.path.join(kb_dir, path))
+        pass
+    _save_folder = os.path.join(kb_dir, KB_MERGE, task_id)
+    with _using(*_video_paths, _save_folder):
+        success, output_path, message = await merge_videos(_video_paths, _save_folder, output_format)
+
+    return {"success": success, "message": message, "output_path": output_path[len(kb_dir)+1:]}
+
+
+@mcp.tool()
+@instrument_tool
+async def render_timeline_tool(
+        task_id: str,
+        clips: list[dict],
+        bgm: Optional[dict] = None,
+        title: str = "timeline",
+        precision: str = "keyframe",
+        output_format: str = "mp4",
+) -> dict:
+    """
+    Render a whole edit (several clips, in order, with optional background music) into one video in a single step.
+    Prefer this over calling `clip_video_tool`, `merge_videos_tool` and `add_bgm_tool` one after another:
+    it is much faster and does not create intermediate files.
+
+    Parameters:
+    task_id (str): The unique identifier for the task.
+    clips (list[dict]): The clips of the result, in order. Each one is a dictionary with the keys:
+                - "source": The path of the video file.
+                - "start": The start time (in seconds) of the clip in the source.
+                - "stop": The stop time (in seconds) of the clip in the source.
+    bgm (Optional[dict], optional): Background music, a dictionary with the keys:
+                - "audio_path": The path of the audio file.
+                - "start_time" (optional): From which second of the audio file the music is played. Default 0.
+                - "offset" (optional): At which second of the result the music starts. Default 0.
+                - "volume" (optional): The volume of the music, 1 keeps it unchanged. Default 1.
+                - "video_volume" (optional): The volume of the original sound, 1 keeps it unchanged. Default 1.
+    title (str, optional): The title of the result.(This item does not include suffix names)
+    precision (str, optional): "keyframe" (default) is the fastest, but each clip snaps to the nearest keyframes.
+                "exact" cuts every clip exactly at the given times, which takes longer.
+    output_format (str, optional): "mp4" (the default), "faststart" (an MP4 that plays while it is downloaded),
+                "fmp4" (a fragmented MP4, it plays even while it is being written) or "hls" (an HLS playlist with
+                CMAF segments, "output_path" is then the `index.m3u8` in a folder that also holds the segments).
+    Returns:
+    dict: A dictionary containing the result of the operation.
+          The dictionary has the following keys:
+          - "success": A boolean indicating whether the operation was successful.
+          - "message": A string providing additional information about the operation.
+          - "output_path": The path of the rendered video file.
+    """
+    kb_dir = get_config().kb_dir
+    current_task_id.set(task_id)
+    error_msg = check_timeline(clips, bgm)
+    if error_msg is not None:
+        return {"success": False, "message": error_msg, "output_path": ""}
+    _clips = [
+        {"source": os.path.join(kb_dir, clip["source"]), "start": clip["start"], "stop": clip["stop"]}
+        for clip in clips
+    ]
+    _bgm = None
+    if bgm is not None:
+        _bgm = dict(bgm, audio_path=os.path.join(kb_dir, bgm["audio_path"]))
+    _, _extension = os.path.splitext(_clips[0]["source"]) if _clips else ("", ".mp4")
+    _output_path = os.path.join(kb_dir, KB_TIMELINE, task_id, f"{title}{_extension}")
+
+    with _using(*[clip["source"] for clip in _clips], *([_bgm["audio_path"]] if _bgm else []),
+                os.path.dirname(_output_path)):
+        success, output_path, message = await render_timeline(_clips, _bgm, _output_path, precision, output_format)
+    return {"success": success, "message": message, "output_path": output_path[len(kb_dir)+1:]}
+
+
+@mcp.tool()
+@instrument_tool
+async def add_bgm_tool(
+    video_path: str, audio_path: str, start_time: int=0, audio_duration: Optional[int]=None,
+    normalize: bool=False, target_lufs: float=-16.0, bgm_lufs: Optional[float]=None, ducking: bool=False,
+    output_format: str = "mp4",
+    ) -> dict:
+    """
+    This function is used to add background music to a video.
+
+    Parameters:
+    video_path (str): The path to the video file, which should be a string.
+    audio_path (str): The path to the audio file, which should be a string.
+    start_time (int, optional): The position (in seconds) in the audio file from which the music is played. The default value is 0.
+    audio_duration (Optional[int], optional): The duration (in seconds) for which the audio will be added to the video. 
+                    If it is None, the full duration of the audio will be used.
+    normalize (bool, optional): Normalize the loudness (EBU R128) of the original sound and of the music,
+                    so the music is neither too loud nor too quiet whatever the track. The default is False.
+    target_lufs (float, optional): The loudness of the original sound when `normalize` is set, the default is -16 LUFS.
+    bgm_lufs (Optional[float], optional): The loudness of the music when `normalize` is set,
+                    the default is 12 LU below `target_lufs`.
+    ducking (bool, optional): Lower the music automatically while the original sound is loud, e.g. during speech.
+                    The default is False.
+    output_format (str, optional): "mp4" (the default), "faststart" (an MP4 that plays while it is downloaded),
+                "fmp4" (a fragmented MP4, it plays even while it is being written) or "hls" (an HLS playlist with
+                CMAF segments, "output_path" is then the `index.m3u8` in a folder that also holds the segments).
+
+    Returns:
+    dict: A dictionary containing the result of the operation.
+          The dictionary has the following keys:
+          - "success": A boolean indicating whether the operation was successful.
+          - "message": Returns "success" if successful, or an error message if failed. 
+                       If an error occurs, notify the user of the reason for the error and apologize sincerely.
+          - "output_path": The path of the video file with the background music.
+    """
+    kb_dir = get_config().kb_dir
+    _video_path = os.path.join(kb_dir, video_path)
+    _audio_path = os.path.join(kb_dir, audio_path)
+    # The output name is derived from the relative input path, e.g. `merge/001/result.mp4` -> `add/merge_001_result_bgm.mp4`,
+    # so outputs of different tasks do not overwrite each other.
+    _stem, _extension = os.path.splitext(os.path.normpath(video_path))
+    _output_path = os.path.join(kb_dir, KB_ADD, _stem.replace(os.sep, "_") + "_bgm" + _extension)
+
+    # `add/` is shared by all tasks, only the output is held, or its folder for HLS.
+    with _using(_video_path, _audio_path, _output_path, os.path.splitext(_output_path)[0]):
+        success, msg = await add_audio_to_video(
+            _video_path, _audio_path, _output_path, start_time, audio_duration, normalize, target_lufs, bgm_lufs,
+            ducking, output_format)
+    _output_path = output_path_for(_output_path, output_format)
+    return {"success": success, "message": msg, "output_path": _output_path[len(kb_dir)+1:] if success else ""}
+
+
+@mcp.tool()
+@instrument_tool
+def scheduler_status_tool() -> dict:
+    """
+    Get the state of the ffmpeg scheduler: the cpu budget, the threads in use, the running processes,
+    the queue depth (in total and per task_id) and the wait times (in seconds).
+
+    Returns:
+    dict: A dictionary with the keys "cpu_budget", "max_procs", "used_threads", "running", "queued",
+          "queued_by_task", "oldest_wait", "granted", "avg_wait" and "max_wait".
+    """
+    return get_scheduler().status()
+
+
+@mcp.tool()
+@instrument_tool
+def cache_stats_tool() -> dict:
+    """
+    Get the hit and miss counters of the metadata cache, the render cache, the decoded background music and the previews.
+
+    Returns:
+    dict: A dictionary with the keys "metadata", "render", "audio" and "preview", each holding the counters of one cache.
+    """
+    metadata_cache = get_metadata_cache()
+    render_cache = get_render_cache()
+    audio_assets = get_audio_assets()
+    preview_cache = get_preview_cache()
+    return {
+        "metadata": {"hits": metadata_cache.hits, "misses": metadata_cache.misses},
+        "render": {
+            "enabled": render_cache.enabled,
+            "hits": render_cache.hits,
+            "misses": render_cache.misses,
+            "shared": render_cache.shared,
+            "evictions": render_cache.evictions,
+        },
+        "audio": {
+            "enabled": audio_assets.enabled,
+            "hits": audio_assets.hits,
+            "misses": audio_assets.misses,
+            "shared": audio_assets.shared,
+            "evictions": audio_assets.evictions,
+        },
+        "preview": {
+            "hits": preview_cache.hits,
+            "misses": preview_cache.misses,
+            "evictions": preview_cache.evictions,
+        },
+    }
+
+
+@mcp.tool()
+@instrument_tool
+async def storage_usage() -> dict:
+    """
+    Get the disk usage of the server: bytes and files per folder (clip, merge, add, timeline, result, cache, jobs),
+    the free disk space, the storage limits and how much the background cleanup has removed so far.
+
+    Returns:
+    dict: A dictionary with the keys "areas", "intermediate_bytes", "quota_bytes", "ttl_seconds", "min_free_bytes",
+          "disk_free_bytes", "disk_total_bytes", "pins", "evicted_files", "evicted_bytes", "last_cleanup" and "enabled".
+    """
+    storage = get_storage_manager()
+    storage.touch([])
+    return await storage.usage()
+
+
+@mcp.tool()
+@instrument_tool
+async def get_video_info_tool(video_path: str, count_keyframes: bool = False) -> dict:
+    """
+    Get the basic information of a video (or audio) file: duration, streams, codecs, fps, resolution and keyframe count.
+    The result is cached, so calling this repeatedly for the same file is cheap.
+
+    Parameters:
+    video_path (str): The path of the video file.
+    count_keyframes (bool, optional): Count the keyframes even if they are not known yet. This reads the whole file
+                once, otherwise "keyframe_count" is only given when an earlier cut or split has already indexed them.
+                The default is False.
+
+    Returns:
+    dict: A dictionary containing the following keys:
+          - "success": A boolean indicating whether the operation was successful.
+          - "message": A string providing additional information about the operation.
+          - "info": The information of the file, such as "duration" (in seconds), "width", "height", "fps",
+                    "video_codec", "audio_codec", "keyframe_count" (None if not counted) and "streams".
+    """
+    kb_dir = get_config().kb_dir
+    _video_path = os.path.join(kb_dir, video_path)
+    if not os.path.isfile(_video_path):
+        return {"success": False, "message": "This file does not exist. Please check if the path is correct.", "info": None}
+    try:
+        info = await probe_video(_video_path)
+        keyframe_index = await get_keyframe_index(_video_path, compute=count_keyframes)
+    except (subprocess.CalledProcessError, ValueError) as e:
+        logger.error(f"Error probing {_video_path}: {e}")
+        return {"success": False, "message": f"Error: {e}", "info": None}
+    info = dict(info, keyframe_count=len(keyframe_index["times"]) if keyframe_index is not None else None)
+    return {"success": True, "message": "success", "info": info}
+
+
+@mcp.tool()
+@instrument_tool
+async def probe_videos_tool(
+        paths: Optional[list[str]] = None,
+        pattern: Optional[str] = None,
+        wait: bool = True,
+        max_files: int = 1000,
+) -> dict:
+    """
+    Get the duration and format of many files at once, e.g. to take stock of the files before planning an edit.
+    Files are probed in parallel and only once: the results are cached, and after the first call new or changed
+    files are indexed in the background, so later calls come back at once even for thousands of files.
+
+    Parameters:
+    paths (Optional[list[str]], optional): The paths of the files.
+    pattern (Optional[str], optional): A glob pattern, e.g. "raw/*.mp4" or "**/*.mov"; `**` matches any number of
+                folders. Without `paths` and `pattern`, all media files are listed.
+    wait (bool, optional): Wait until the new files are probed (the default). If False, the call returns at once,
+                and the files not probed yet are listed in "pending", call again a little later for them.
+    max_files (int, optional): The maximum number of files returned, the default is 1000.
+
+    Returns:
+    dict: A dictionary containing the following keys:
+          - "success": A boolean indicating whether the operation was successful.
+          - "message": A string providing additional information about the operation.
+          - "files": One dictionary per file, sorted by path, with the keys "path", "duration" (in seconds),
+                     "fps", "width", "height", "video_codec", "audio_codec", "bit_rate", "has_audio" and "size"
+                     (in bytes), or the keys "path" and "error" for a file that can not be read.
+          - "pending": The paths that are not probed yet (only with `wait=False`).
+          - "total": The number of matching files.
+          - "truncated": Whether more files matched than `max_files`.
+    """
+    kb_dir = get_config().kb_dir
+    indexer = get_media_indexer()
+    _paths = set()
+    if paths:
+        _paths.update(os.path.abspath(os.path.join(kb_dir, path)) for path in paths)
+    if pattern is not None or not paths:
+        _paths.update(indexer.list_files(pattern))
+    _paths = sorted(_paths)
+    total = len(_paths)
+    if max_files > 0:
+        _paths = _paths[:max_files]
+    entries, pending = await indexer.inventory(_paths, wait)
+    return {
+        "success": True,
+        "message": "success",
+        "files": [dict(path=os.path.relpath(path, kb_dir), **entries[path]) for path in _paths if path in entries],
+        "pending": [os.path.relpath(path, kb_dir) for path in pending],
+        "total": total,
+        "truncated": total > len(_paths),
+    }
+
+
+@mcp.tool()
+@instrument_tool
+async def analyze_video_tool(
+        video_path: str,
+        start_time: float = 0,
+        end_time: Optional[float] = None,
+        kinds: Optional[list[str]] = None,
+        scene_threshold: float = 0.3,
+        silence_threshold_db: float = -35.0,
+        silence_min_duration: float = 1.0,
+        black_min_duration: float = 0.5,
+        max_events: int = 500,
+) -> dict:
+    """
+    Find where things happen in a (long) video: scene cuts, black frames, silences and the audio level every 5 seconds.
+    Use it to choose the start_time and stop_time of clips, e.g. to cut the highlights out of a livestream recording.
+    The whole file is analysed by the first call, which takes a fraction of the duration of the video. Later calls for
+    the same file only look up the results, so query one time range after another instead of everything at once.
+
+    Parameters:
+    video_path (str): The path of the video file.
+    start_time (float): The start of the time range to return, in seconds, default is 0.
+    end_time (float): The end of the time range to return, in seconds, default is the end of the video.
+    kinds (list[str]): The kinds of events to return, any of "scene", "black", "silence" and "level".
+                       Default is all of them.
+    scene_threshold (float): How different two frames must be (0 to 1) to count as a scene cut, default is 0.3.
+    silence_threshold_db (float): Audio quieter than this (dBFS) is silence, default is -35.
+    silence_min_duration (float): The shortest silence to return, in seconds, default is 1.
+    black_min_duration (float): The shortest black span to return, in seconds, default is 0.5.
+    max_events (int): At most this many events are returned, default is 500.
+
+    Returns:
+    dict: A dictionary containing the following keys:
+          - "success": A boolean indicating whether the operation was successful.
+          - "message": A string providing additional information about the operation.
+          - "duration": The duration of the video in seconds.
+          - "events": The events in the time range, sorted by start. Each has the keys "kind", "start", "end" (seconds)
+                      and "value": the score of a scene cut, the level in dBFS of a "level" window (None if the audio
+                      is digital silence), None for "black" and "silence".
+          - "counts": The number of events of each kind in the time range.
+          - "truncated": True if there were more than max_events events, query a shorter range to see the rest.
+    """
+    kb_dir = get_config().kb_dir
+    _video_path = os.path.join(kb_dir, video_path)
+    if not os.path.isfile(_video_path):
+        return {"success": False, "message": "This file does not exist. Please check if the path is correct.",
+                "duration": None, "events": [], "counts": {}, "truncated": False}
+    with _using(_video_path):
+        success, result, message = await analyze_video(
+            _video_path, start_time, end_time, kinds, scene_threshold, silence_threshold_db,
+            silence_min_duration, black_min_duration)
+    if not success:
+        return {"success": False, "message": message, "duration": None, "events": [], "counts": {}, "truncated": False}
+    events = result["events"]
+    counts = {}
+    for event in events:
+        counts[event["kind"]] = counts.get(event["kind"], 0) + 1
+    return {
+        "success": True,
+        "message": message,
+        "duration": result["duration"],
+        "events": events[:max_events],
+        "counts": counts,
+        "truncated": len(events) > max_events,
+    }
+
+@mcp.tool()
+@instrument_tool
+async def preview_video_tool(
+        video_path: str,
+        timestamps: Optional[list[float]] = None,
+        start_time: Optional[float] = None,
+        end_time: Optional[float] = None,
+        make_clip: bool = False,
+) -> dict:
+    """
+    Look at a video before cutting it: thumbnails at given times, contact sheets (a grid of thumbnails per image)
+    and a small low-resolution copy of a time range. The previews of a file are made by the first call, which takes
+    a fraction of the duration of the video, later calls answer at once.
+
+    Parameters:
+    video_path (str): The path of the video file.
+    timestamps (list[float]): Times in seconds to get the closest thumbnail of.
+    start_time (float): The start of a time range in seconds. Without timestamps, the thumbnails in the range are
+                        returned, and the contact sheets are limited to the ones covering the range.
+    end_time (float): The end of the time range in seconds, default is the end of the video.
+    make_clip (bool): Also cut the time range out of the low-resolution copy, to watch it. Default is False.
+
+    Returns:
+    dict: A dictionary containing the following keys:
+          - "success": A boolean indicating whether the operation was successful.
+          - "message": A string providing additional information about the operation.
+          - "duration": The duration of the video in seconds.
+          - "proxy": The path of the low-resolution copy of the whole video.
+          - "thumbnails": A list of {"time", "path"}. There is a thumbnail every "thumb_interval" seconds,
+                          "time" is the time of the one returned.
+          - "contact_sheets": A list of {"start", "end", "path"}, each image shows the thumbnails of that range,
+                              from left to right and top to bottom.
+          - "clip_path": The path of the cut range if make_clip was set, otherwise None.
+    """
+    kb_dir = get_config().kb_dir
+    _video_path = os.path.join(kb_dir, video_path)
+    result = {"success": False, "duration": None, "proxy": None, "thumb_interval": None,
+              "thumbnails": [], "contact_sheets": [], "clip_path": None}
+    if not os.path.isfile(_video_path):
+        return dict(result, message="This file does not exist. Please check if the path is correct.")
+    preview_cache = get_preview_cache()
+    try:
+        with _using(_video_path):
+            folder, manifest = await preview_cache.get(_video_path)
+        range_start = start_time if start_time is not None else 0.0
+        range_end = end_time if end_time is not None else manifest["duration"]
+        if range_end < range_start:
+            return dict(result, message="end_time must not be smaller than start_time.")
+        interval = manifest["thumb_interval"]
+        if timestamps:
+            times = list(timestamps)
+        elif start_time is not None or end_time is not None:
+            times = [i * interval for i in range(math.ceil(range_start / interval), manifest["thumbs"])
+                     if i * interval <= range_end]
+        else:
+            times = []
+        thumbnails = []
+        for timestamp in times:
+            thumbnail = preview_cache.thumbnail(folder, manifest, timestamp)
+            if thumbnail is not None:
+                thumbnails.append({"time": thumbnail[0], "path": os.path.relpath(thumbnail[1], kb_dir)})
+        sheets = [
+            {"start": sheet["start"], "end": sheet["end"], "path": os.path.relpath(os.path.join(folder, sheet["file"]), kb_dir)}
+            for sheet in manifest["sheets"] if sheet["end"] >= range_start and sheet["start"] <= range_end
+        ]
+        clip_path = None
+        if make_clip:
+            clip_path = os.path.relpath(
+                await preview_cache.proxy_clip(folder, manifest, range_start, range_end), kb_dir)
+    except (subprocess.CalledProcessError, ValueError) as e:
+        logger.error(f"Error previewing {_video_path}: {e}")
+        return dict(result, message=f"Error: {e}")
+    return {
+        "success": True,
+        "message": "success",
+        "duration": manifest["duration"],
+        "proxy": os.path.relpath(os.path.join(folder, manifest["proxy"]), kb_dir),
+        "thumb_interval": interval,
+        "thumbnails": thumbnails,
+        "contact_sheets": sheets,
+        "clip_path": clip_path,
+    }
+
+
+@mcp.tool()
+@instrument_tool
+async def task_endding(task_id: str, source_file: str, title: str = "") -> str:
+    """
+    This function should be called every time a task ends to push the result document after task processing to the result folder.
+    Parameters:
+    task_id (str): uniquely identifying the current task.
+    source_file(str): Indicates the location of the result file to be pushed, 
+    which is the file location provided after the previous process of this task ends.
+    For an HLS result (`index.m3u8`), the whole folder with the playlist and its segments is pushed.
+    title(str): If you need to modify the file name (note: including the file extension), use this parameter.
+                Otherwise, keep the file name the same as that of the source_file or simply don't input this parameter as there is a default parameter here.
+                (This item does not include suffix names)
+    Returns:
+    str: Returns "success" if successful, or an error message if failed. 
+         If an error occurs, notify the user of the reason for the error and apologize sincerely.
+    """
+    kb_dir = get_config().kb_dir
+    _source_file = os.path.join(kb_dir, source_file)
+    _target_dir = os.path.join(kb_dir, KB_RESULT, task_id)
+    if not os.path.exists(_target_dir):
+        os.makedirs(_target_dir)
+
+    if not os.path.exists(_source_file):
+        return "This file does not exist. Please check if the path is correct."
+
+    if os.path.basename(_source_file) == HLS_PLAYLIST:
+        # An HLS result is the folder of the playlist and its segments, it is published as a whole.
+        _source_folder = os.path.dirname(_source_file)
+        _target_folder = os.path.join(_target_dir, title or os.path.basename(_source_folder))
+        try:
+            await asyncio.to_thread(publish_folder, _source_folder, _target_folder)
+        except OSError as e:
+            return f"Error occurred while copying: {str(e)}"
+        for name in os.listdir(_source_folder):
+            get_storage_manager().pin(os.path.join(_source_folder, name), f"task_endding {task_id}")
+        return "success"
+
+    if len(title) == 0:
+        _title, _ = os.path.splitext(os.path.basename(source_file))
+    else:
+        _title = title
+
+    try:
+        # Only a plain copy takes long, it must not block the other tool calls.
+        success, msg = await asyncio.to_thread(copy_file, _source_file, _target_dir, _title)
+        if success:
+            # The published source is kept, the result may be traced back to it.
+            get_storage_manager().pin(_source_file, f"task_endding {task_id}")
+        return msg
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+
+# --------------------------------------------------------------------------
+# Background jobs: the `submit_*` tools take the same parameters as the tools above,
+# but return a job id immediately instead of waiting for ffmpeg.
+def get_job_manager() -> JobManager:
+    # The job records are only read when a job tool is used for the first time.
+    return lazy("job_manager", lambda config: JobManager(
+        os.path.join(config.kb_dir, KB_JOBS),
+        config.job_workers,
+        handlers={
+            "clip_video": clip_video_tool,
+            "merge_videos": merge_videos_tool,
+            "add_bgm": add_bgm_tool,
+            "analyze_video": analyze_video_tool,
+        },
+    ))
+
+
+def _job_summary(job: dict) -> dict:
+    return {
+        "job_id": job["job_id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "progress": job["progress"],
+    }
+
+
+@mcp.tool()
+@instrument_tool
+def submit_clip_video_tool(
+        original_video_path: str,
+        task_id: str,
+        start_time: int,
+        stop_time: int,
+        title: str,
+        precision: str = "keyframe",
+        priority: int = 0,
+) -> dict:
+    """
+    Same as `clip_video_tool`, but runs in the background. Use `job_status` and `job_result` with the returned job_id
+    to follow the job. Jobs with a higher `priority` get the CPU first, the default is 0.
+
+    Returns:
+    dict: A dictionary with the keys "job_id" and "status".
+    """
+    job = get_job_manager().submit("clip_video", {
+        "original_video_path": original_video_path,
+        "task_id": task_id,
+        "start_time": start_time,
+        "stop_time": stop_time,
+        "title": title,
+        "precision": precision,
+    }, priority)
+    return {"job_id": job["job_id"], "status": job["status"]}
+
+
+@mcp.tool()
+@instrument_tool
+def submit_merge_videos_tool(video_paths: list[str], task_id: str, output_format: str = "mp4", priority: int = 0) -> dict:
+    """
+    Same as `merge_videos_tool`, but runs in the background. Use `job_status` and `job_result` with the returned job_id
+    to follow the job. Jobs with a higher `priority` get the CPU first, the default is 0.
+
+    Returns:
+    dict: A dictionary with the keys "job_id" and "status".
+    """
+    job = get_job_manager().submit(
+        "merge_videos", {"video_paths": video_paths, "task_id": task_id, "output_format": output_format}, priority)
+    return {"job_id": job["job_id"], "status": job["status"]}
+
+
+@mcp.tool()
+@instrument_tool
+def submit_add_bgm_tool(
+    video_path: str, audio_path: str, start_time: int=0, audio_duration: Optional[int]=None,
+    normalize: bool=False, target_lufs: float=-16.0, bgm_lufs: Optional[float]=None, ducking: bool=False,
+    output_format: str = "mp4", priority: int = 0,
+    ) -> dict:
+    """
+    Same as `add_bgm_tool`, but runs in the background. Use `job_status` and `job_result` with the returned job_id
+    to follow the job. Jobs with a higher `priority` get the CPU first, the default is 0.
+
+    Returns:
+    dict: A dictionary with the keys "job_id" and "status".
+    """
+    job = get_job_manager().submit("add_bgm", {
+        "video_path": video_path,
+        "audio_path": audio_path,
+        "start_time": start_time,
+        "audio_duration": audio_duration,
+        "normalize": normalize,
+        "target_lufs": target_lufs,
+        "bgm_lufs": bgm_lufs,
+        "ducking": ducking,
+        "output_format": output_format,
+    }, priority)
+    return {"job_id": job["job_id"], "status": job["status"]}
+
+
+@mcp.tool()
+@instrument_tool
+def submit_analyze_video_tool(video_path: str, silence_threshold_db: float = -35.0, priority: int = 0) -> dict:
+    """
+    Analyse a long video in the background, so the later `analyze_video_tool` calls for it answer at once.
+    Use `job_status` with the returned job_id to follow the job. Jobs with a higher `priority` get the CPU first,
+    the default is 0.
+
+    Returns:
+    dict: A dictionary with the keys "job_id" and "status".
+    """
+    job = get_job_manager().submit("analyze_video", {
+        "video_path": video_path,
+        "silence_threshold_db": silence_threshold_db,
+        "max_events": 0,
+    }, priority)
+    return {"job_id": job["job_id"], "status": job["status"]}
+
+
+@mcp.tool()
+@instrument_tool
+def job_status(job_id: str) -> dict:
+    """
+    Query the state of a background job.
+
+    Parameters:
+    job_id (str): The job id returned by one of the `submit_*` tools.
+
+    Returns:
+    dict: A dictionary with the keys "job_id", "kind", "status", "progress" and the timestamps of the job.
+          "status" is one of "queued", "running", "succeeded", "failed" and "cancelled".
+          "progress" is the percent done of a running job, as far as its duration is known.
+    """
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return {"job_id": job_id, "status": "unknown", "message": "This job does not exist."}
+    return _job_summary(job)
+
+
+@mcp.tool()
+@instrument_tool
+def job_result(job_id: str) -> dict:
+    """
+    Get the result of a background job.
+
+    Parameters:
+    job_id (str): The job id returned by one of the `submit_*` tools.
+
+    Returns:
+    dict: A dictionary with the keys "job_id", "status", "result" and "error".
+          "result" is what the corresponding synchronous tool returns, and it is only set once the job has finished.
+    """
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return {"job_id": job_id, "status": "unknown", "result": None, "error": "This job does not exist."}
+    return {"job_id": job_id, "status": job["status"], "result": job["result"], "error": job["error"]}
+
+
+@mcp.tool()
+@instrument_tool
+def cancel_job(job_id: str) -> dict:
+    """
+    Cancel a background job. A queued job will never start, and a running job is interrupted:
+    its ffmpeg processes are killed and their partial outputs removed.
+
+    Parameters:
+    job_id (str): The job id returned by one of the `submit_*` tools.
+
+    Returns:
+    dict: A dictionary with the keys "job_id" and "status".
+    """
+    job = get_job_manager().cancel(job_id)
+    if job is None:
+        return {"job_id": job_id, "status": "unknown", "message": "This job does not exist."}
+    return {"job_id": job_id, "status": job["status"]}
+
+
+
+@mcp.tool()
+def metrics_tool() -> dict:
+    """
+    Get the metrics of this server: call counts and latencies of the tools, and wall time, CPU time and bytes
+    read/written of the ffmpeg/ffprobe processes, split into stream copies, re-encodes and probes.
+
+    Returns:
+    dict: A dictionary with the keys "counters", "histograms" (with count, sum and p50/p95/p99 in seconds) and "gauges".
+    """
+    return get_metrics().snapshot()
+
+
+@mcp.resource("metrics://vedit", mime_type="application/json")
+def metrics_resource() -> str:
+    """The metrics of this server, the same as `metrics_tool`."""
+    return json.dumps(get_metrics().snapshot())
+
+
+# Transports:
+# "stdio" serves the one agent that spawned the process. The HTTP transports serve any number of agents from
+# one long-lived process, so they share the warm caches and one ffmpeg budget. "streamable-http" can also run
+# several worker processes: the server is then stateless, so any worker can answer any request, and the workers
+# share the job queue, the caches and the budget through the files under `kb_dir`. The sessions of "sse" live
+# in the memory of one process, so it always runs a single one.
+CONFIG_ENV = "VEDIT_CONFIG"
+
+
+def create_http_app():
+    # Every worker is a fresh interpreter that imports this module, the config comes from the environment.
+    config = configure(VeditConfig(**json.loads(os.environ[CONFIG_ENV])))
+    if not config.using_logger:
+        logger.remove()
+    mcp.settings.stateless_http = True
+    return mcp.streamable_http_app()
+
+
+def main(argv: Optional[list[str]] = None):
+    args = build_parser().parse_args(argv)
+    config = configure(config_from_namespace(args))
+    if not config.using_logger:
+        logger.remove()
+
+    if args.transport != 'stdio':
+        if args.http_workers < 1:
+            raise ValueError(f"`http_workers` Error: it must be at least 1, got {args.http_workers}.")
+        if args.transport == 'sse' and args.http_workers > 1:
+            raise ValueError("`http_workers` Error: the sessions of the sse transport can not be shared between "
+                             "processes, use `--transport streamable-http` for several workers.")
+        if args.transport == 'streamable-http' and not hasattr(mcp, 'streamable_http_app'):
+            raise ValueError("`transport` Error: the installed `mcp` package has no streamable-http transport, "
+                             "it needs mcp>=1.8.")
+        mcp.settings.host = args.host
+        mcp.settings.port = args.port
+
+    logger.info(f"Video Edit MCP Server Running ({args.transport})......")
+    if args.transport == 'streamable-http' and args.http_workers > 1:
+        import uvicorn
+
+        os.environ[CONFIG_ENV] = json.dumps(dataclasses.asdict(config))
+        uvicorn.run("vedit.server:create_http_app", factory=True,
+                    host=args.host, port=args.port, workers=args.http_workers)
+    else:
+        mcp.run(transport=args.transport)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+import os
+import time
+import uuid
+import shutil
+import sqlite3
+import asyncio
+from contextlib import contextmanager
+from typing import Callable, Optional
+from loguru import logger
+from .config import KB_CLIP, KB_MERGE, KB_ADD, KB_TIMELINE, KB_RESULT, KB_CACHE, KB_JOBS
+from .locks import try_lock, unlock, alive
+from .metrics import get_metrics
+from .render_cache import RenderCache
+from .formats import is_temporary
+
+
+# StorageManager:
+# Every tool call leaves its output under `clip/`, `merge/`, `add/` and `timeline/`, and nothing removed them.
+# These intermediates are evicted in the background, a few files per step so the event loop keeps serving tools:
+# - files not used for `storage_ttl_hours`,
+# - the least recently used ones while the intermediates take more than `storage_quota_mb`,
+# - the least recently used ones while the disk has less than `storage_min_free_mb` free.
+# A file is used when it is written or given to a tool as input; the access time records it, the modification
+# time is left alone because it is part of the file identity of the caches. Never evicted are the files of
+# `result/`, the inputs and task folders of queued or running jobs, sources published by `task_endding`, the
+# inputs and task folders of tool calls that are still running (`hold`), and anything used within the last
+# `GRACE_SECONDS`.
+# An output may be a hard link of a render cache artifact or of a published result, and removing it then frees
+# nothing. So the quota and the free space count an inode only where all its links are intermediates or render cache
+# artifacts, and evicting its last intermediate for them also removes its artifact. A file whose inode is held
+# elsewhere is only evicted by its TTL.
+# Outputs that are still being written have temporary names (`formats.is_temporary`) and are never evicted. Those
+# a dead process left behind are removed once they have not been written for `GRACE_SECONDS`, unless pinned.
+class StorageManager:
+    AREAS = (KB_CLIP, KB_MERGE, KB_ADD, KB_TIMELINE)
+    GRACE_SECONDS = 600
+    INTERVAL = 60           # seconds between two cleanups
+    BATCH = 200             # files stat'ed or removed before yielding to the event loop
+    LOW_WATERMARK = 0.9     # a quota cleanup goes down to this share of the quota
+
+    def __init__(
+            self,
+            kb_dir: str,
+            db_path: str,
+            quota_bytes: int,
+            ttl_seconds: float,
+            min_free_bytes: int,
+            active_jobs: Callable[[], list[dict]],
+            render_cache: Optional[RenderCache] = None,
+    ):
+        """
+        :param kb_dir: The base folder of the managed areas.
+        :param db_path: The sqlite file holding the pins.
+        :param quota_bytes: The size limit of all intermediates, 0 for no limit.
+        :param ttl_seconds: How long an unused intermediate is kept, 0 for ever.
+        :param min_free_bytes: The free disk space to keep, 0 for no limit.
+        :param active_jobs: Returns the queued and running jobs, their files are pinned.
+        :param render_cache: The render cache whose artifacts may be hard links of the intermediates.
+        """
+        self.kb_dir = os.path.abspath(kb_dir)
+        self.quota_bytes = quota_bytes
+        self.ttl_seconds = ttl_seconds
+        self.min_free_bytes = min_free_bytes
+        self.active_jobs = active_jobs
+        self.render_cache = render_cache
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+        self.last_cleanup: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        folder = os.path.dirname(db_path)
+        if not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+        self._lock_path = os.path.join(folder, "storage.lock")
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS storage_pins (path TEXT PRIMARY KEY, reason TEXT NOT NULL, created_at REAL NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS storage_holds (hold_id TEXT NOT NULL, path TEXT NOT NULL, owner INTEGER NOT NULL)")
+        self._conn.commit()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.quota_bytes or self.ttl_seconds or self.min_free_bytes)
+
+    def _managed(self, path: str) -> bool:
+        relative = os.path.relpath(os.path.abspath(path), self.kb_dir)
+        return relative.split(os.sep)[0] in self.AREAS
+
+    def _temporary(self, path: str) -> bool:
+        # The path itself or one of its folders, e.g. the segments in the temporary folder of an HLS output.
+        return any(is_temporary(part) for part in os.path.relpath(path, self.kb_dir).split(os.sep))
+
+    def touch(self, paths):
+        """
+        Mark files as used now and make sure the background cleanup runs.
+        """
+        for path in paths:
+            if self._managed(path) and os.path.isfile(path):
+                stat = os.stat(path)
+                os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+        self._ensure_running()
+
+    def pin(self, path: str, reason: str):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO storage_pins (path, reason, created_at) VALUES (?, ?, ?)",
+            (os.path.abspath(path), reason, time.time()))
+        self._conn.commit()
+
+    @contextmanager
+    def hold(self, paths):
+        """
+        Keep files and folders, with everything below them, from being evicted until the block ends.
+        A tool call holds its inputs and the task folder its outputs and work folders are written to, e.g. the
+        clips a merge reads one after the other. The cleanup of every server process sees the holds, the ones of
+        a process that died are dropped.
+        """
+        hold_id = uuid.uuid4().hex
+        self._conn.executemany(
+            "INSERT INTO storage_holds (hold_id, path, owner) VALUES (?, ?, ?)",
+            [(hold_id, os.path.abspath(path), os.getpid()) for path in paths])
+        self._conn.commit()
+        try:
+            yield
+        finally:
+            self._conn.execute("DELETE FROM storage_holds WHERE hold_id = ?", (hold_id,))
+            self._conn.commit()
+
+    def _held(self) -> list[str]:
+        paths = []
+        dead = set()
+        for path, owner in self._conn.execute("SELECT path, owner FROM storage_holds").fetchall():
+            if owner in dead or owner != os.getpid() and not alive(owner):
+                dead.add(owner)
+            else:
+                paths.append(path)
+        if dead:
+            self._conn.executemany("DELETE FROM storage_holds WHERE owner = ?", [(owner,) for owner in dead])
+            self._conn.commit()
+        return paths
+
+    def _pinned(self) -> tuple[set[str], list[str]]:
+        """
+        :return: The pinned files and the pinned folders, as absolute paths.
+        """
+        files = {row[0] for row in self._conn.execute("SELECT path FROM storage_pins")}
+        held = self._held()
+        files.update(held)
+        folders = list(held)
+        for job in self.active_jobs():
+            params = job["params"]
+            for value in params.values():
+                for item in value if isinstance(value, list) else [value]:
+                    if isinstance(item, str):
+                        files.add(os.path.abspath(os.path.join(self.kb_dir, item)))
+            if params.get("task_id"):
+                folders += [os.path.abspath(os.path.join(self.kb_dir, area, params["task_id"])) for area in self.AREAS]
+        return files, folders
+
+    @staticmethod
+    def _is_pinned(path: str, pinned_files: set[str], pinned_folders: list[str]) -> bool:
+        return path in pinned_files or any(path.startswith(folder + os.sep) for folder in pinned_folders)
+
+    async def _scan(self, root: str) -> list[tuple[float, int, str, tuple[int, int], int]]:
+        # (last use, size, path, (device, inode), number of links) of every file below `root`.
+        entries = []
+        count = 0
+        for folder, _, names in os.walk(root):
+            for name in names:
+                path = os.path.join(folder, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((max(stat.st_atime, stat.st_mtime), stat.st_size, path,
+                                (stat.st_dev, stat.st_ino), stat.st_nlink))
+                count += 1
+                if count % self.BATCH == 0:
+                    await asyncio.sleep(0)
+        return entries
+
+    async def usage(self) -> dict:
+        areas = {}
+        for area in self.AREAS + (KB_RESULT, KB_CACHE, KB_JOBS):
+            entries = await self._scan(os.path.join(self.kb_dir, area))
+            areas[area] = {"files": len(entries), "bytes": sum(entry[1] for entry in entries)}
+        disk = shutil.disk_usage(self.kb_dir)
+        return {
+            "areas": areas,
+            "intermediate_bytes": sum(areas[area]["bytes"] for area in self.AREAS),
+            "quota_bytes": self.quota_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "min_free_bytes": self.min_free_bytes,
+            "disk_free_bytes": disk.free,
+            "disk_total_bytes": disk.total,
+            "pins": self._conn.execute("SELECT COUNT(*) FROM storage_pins").fetchone()[0],
+            "evicted_files": self.evicted_files,
+            "evicted_bytes": self.evicted_bytes,
+            "last_cleanup": self.last_cleanup,
+            "enabled": self.enabled,
+        }
+
+    def _evict(self, path: str, size: int, reason: str) -> bool:
+        """
+        :param size: The bytes the removal frees, 0 if the inode has further links.
+        """
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        self.evicted_files += 1
+        self.evicted_bytes += size
+        get_metrics().inc("vedit_storage_evicted_files_total", {"reason": reason})
+        if size:
+            get_metrics().inc("vedit_storage_evicted_bytes_total", {"reason": reason}, size)
+        logger.debug(f"storage: evicted {path} ({reason})")
+        return True
+
+    async def cleanup(self):
+        """
+        One cleanup pass. Only one server process on the same `kb_dir` runs it at a time.
+        """
+        if not self.enabled:
+            return
+        lock_fd = try_lock(self._lock_path)
+        if lock_fd is None:
+            return
+        try:
+            pinned_files, pinned_folders = self._pinned()
+            now = time.time()
+            self._remove_stale_temporaries(now, pinned_files, pinned_folders)
+            entries = []
+            for area in self.AREAS:
+                entries += await self._scan(os.path.join(self.kb_dir, area))
+            artifacts = self.render_cache.artifacts() if self.render_cache is not None else {}
+            links: dict[tuple[int, int], list[str]] = {}
+            for _, _, path, inode, _ in entries:
+                links.setdefault(inode, []).append(path)
+
+            def freeable(inode: tuple[int, int], nlink: int) -> bool:
+                # All links of the inode are intermediates or a render cache artifact.
+                return len(links[inode]) + (inode in artifacts) >= nlink
+
+            sizes = {inode: size for _, size, _, inode, nlink in entries if freeable(inode, nlink)}
+            total = sum(sizes.values())
+
+            candidates = []
+            for entry in sorted(entries):
+                last_use, _, path, _, _ = entry
+                if now - last_use < self.GRACE_SECONDS or self._temporary(path):
+                    continue
+                if self._is_pinned(path, pinned_files, pinned_folders):
+                    continue
+                candidates.append(entry)
+
+            # TTL first, then the least recently used until the quota and the free space are met.
+            quota_target = self.quota_bytes * self.LOW_WATERMARK
+            disk_pass = bool(self.min_free_bytes)
+            removed = 0
+            for last_use, size, path, inode, nlink in candidates:
+                # Only the last intermediate link of a freeable inode gives its bytes back, with the artifact.
+                last = inode in sizes and len(links[inode]) == 1
+                free = shutil.disk_usage(self.kb_dir).free if disk_pass and last else None
+                if self.ttl_seconds and now - last_use > self.ttl_seconds:
+                    reason = "ttl"
+                elif not last:
+                    continue
+                elif self.quota_bytes and total > quota_target:
+                    reason = "quota"
+                elif free is not None and free < self.min_free_bytes:
+                    reason = "disk"
+                else:
+                    continue
+                # A TTL eviction leaves the artifact to the render cache, it has its own limit.
+                drop_artifact = last and reason != "ttl" and inode in artifacts
+                freed = size if last and (drop_artifact or inode not in artifacts) else 0
+                if not self._evict(path, freed, reason):
+                    continue
+                links[inode].remove(path)
+                if drop_artifact:
+                    self.render_cache.forget(artifacts.pop(inode))
+                if last:
+                    total -= sizes.pop(inode)
+                if reason == "disk" and shutil.disk_usage(self.kb_dir).free <= free:
+                    # The disk did not gain anything, e.g. the file system keeps deleted blocks in a snapshot.
+                    logger.warning("storage: evictions do not free disk space, stopping the free space cleanup")
+                    disk_pass = False
+                removed += 1
+                if removed % self.BATCH == 0:
+                    await asyncio.sleep(0)
+            self._remove_empty_folders()
+            self.last_cleanup = time.time()
+        finally:
+            unlock(lock_fd)
+
+    def _remove_stale_temporaries(self, now: float, pinned_files: set[str], pinned_folders: list[str]):
+        # A render writes its temporary output all the time, a stale one belongs to a process that died.
+        # Pinned paths are kept whatever their name.
+        for area in self.AREAS:
+            for folder, folders, names in os.walk(os.path.join(self.kb_dir, area)):
+                for name in [name for name in folders + names if is_temporary(name)]:
+                    path = os.path.join(folder, name)
+                    if name in folders:
+                        folders.remove(name)
+                    if self._is_pinned(path, pinned_files, pinned_folders):
+                        continue
+                    try:
+                        if now - os.stat(path).st_mtime <= self.GRACE_SECONDS:
+                            continue
+                        if os.path.isdir(path):
+                            shutil.rmtree(path)
+                        else:
+                            os.remove(path)
+                    except OSError:
+                        continue
+                    get_metrics().inc("vedit_storage_evicted_files_total", {"reason": "stale"})
+                    logger.debug(f"storage: removed the stale temporary {path}")
+
+    def _remove_empty_folders(self):
+        # A new task folder may be empty only because its first output is still being rendered.
+        now = time.time()
+        for area in self.AREAS:
+            root = os.path.join(self.kb_dir, area)
+            for folder, _, _ in sorted(os.walk(root), reverse=True):
+                try:
+                    if folder != root and not os.listdir(folder) \
+                            and now - os.stat(folder).st_mtime > self.GRACE_SECONDS:
+                        os.rmdir(folder)
+                except OSError:
+                    pass
+
+    def _ensure_running(self):
+        # The loop needs a running event loop, so it is created on first use.
+        if not self.enabled or self._task is not None:
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._task = asyncio.create_task(self._loop())
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.cleanup()
+            except Exception as e:
+                logger.error(f"Storage cleanup failed: {e}")
+            await asyncio.sleep(self.INTERVAL)
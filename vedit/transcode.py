@@ -0,0 +1,152 @@
+import os
+import math
+import uuid
+import shutil
+import asyncio
+import tempfile
+from typing import Optional
+from loguru import logger
+from .config import get_config
+from .metrics import get_metrics
+from .process import run_command
+from .probe import probe_video, get_keyframes, split_at_keyframes
+
+
+# encode:
+# A re-encode in one ffmpeg process uses the threads of one encoder, which on a long input leaves most cores idle.
+# Inputs longer than `chunk_encode_min_seconds` are encoded in chunks instead:
+# - the video is split at keyframes, every chunk is encoded by its own ffmpeg, in parallel as far as the scheduler
+#   allows. A chunk starts on a keyframe, so seeking to it is exact and no frame is decoded twice;
+# - the audio is encoded once, next to the video chunks. Audio encoders prime every stream they start, so audio cut
+#   into chunks would get a gap at every boundary, and the audio encode is cheap anyway;
+# - the video segments are joined with the concat demuxer and muxed with the audio, both by stream copy.
+# The joined output must have the duration and the number of streams of a single-process encode, otherwise it is
+# thrown away and the input is encoded in one process after all.
+CHUNK_SECONDS = 30          # chunks are not made shorter than this
+
+
+async def verify_output(path: str, duration: Optional[float], streams: int, fps: Optional[float] = None) -> Optional[str]:
+    """
+    Check a joined output against what a single-process encode would have produced.
+    :param path: The output file.
+    :param duration: The expected duration in seconds, None to skip the check.
+    :param streams: The expected number of streams.
+    :param fps: The frame rate of the output, it sets the tolerance of the duration.
+    :return: None if the output is fine, otherwise what is wrong with it.
+    """
+    info = await probe_video(path)
+    if len(info["streams"]) != streams:
+        return f"{len(info['streams'])} streams instead of {streams}"
+    # Every chunk may end up to a frame early or late, and the container may round.
+    tolerance = 0.1 + (2 / fps if fps else 0.1)
+    if duration and (info["duration"] is None or abs(info["duration"] - duration) > tolerance):
+        return f"a duration of {info['duration']}s instead of {duration}s"
+    return None
+
+
+async def concat_segments(segments: list[str], output_path: str, audio_path: Optional[str] = None,
+                          output_args: Optional[list[str]] = None):
+    """
+    Join segments that were encoded with the same parameters, by stream copy.
+    :param segments: The segments, in order.
+    :param output_path: The joined file.
+    :param audio_path: A file whose audio replaces the audio of the segments.
+    :param output_args: Further options of the output, e.g. `-movflags +faststart`.
+    :raise subprocess.CalledProcessError: If ffmpeg fails.
+    """
+    list_path = os.path.join(os.path.dirname(segments[0]), f"segments_{uuid.uuid4().hex[:8]}.txt")
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for segment in segments:
+            f.write(f"file '{segment}'\n")
+    try:
+        command = ['ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', list_path]
+        if audio_path is not None:
+            command += ['-i', audio_path, '-map', '0:v:0', '-map', '1:a:0']
+        command += ['-c', 'copy', *(output_args or []), output_path]
+        await run_command(command)
+    finally:
+        os.remove(list_path)
+
+
+async def encode(
+        input_path: str,
+        output_path: str,
+        video_args: list[str],
+        audio_inputs: Optional[list[str]] = None,
+        audio_args: Optional[list[str]] = None,
+        output_args: Optional[list[str]] = None,
+) -> bool:
+    """
+    Re-encode the first video stream of `input_path` (and some audio) into `output_path`.
+    :param input_path: The input file.
+    :param output_path: The output file.
+    :param video_args: The options of the video, e.g. `-vf`, `-c:v`, `-pix_fmt` and `-r`.
+    :param audio_inputs: Further inputs for the audio (e.g. `-f lavfi -i anullsrc`), they come after `input_path`.
+                They must end by themselves, e.g. with an input `-t`.
+    :param audio_args: The options of the audio, including its `-map`. None for an output without audio.
+    :param output_args: The options of the output file, e.g. `-video_track_timescale`.
+    :return: True if the input was encoded in chunks.
+    :raise subprocess.CalledProcessError: If ffmpeg fails.
+    """
+    config = get_config()
+    audio_inputs = audio_inputs or []
+    output_args = output_args or []
+    info = await probe_video(input_path)
+    duration = info["duration"] or 0.0
+    bounds = [0.0]
+    if config.chunk_encode_min_seconds and duration >= config.chunk_encode_min_seconds:
+        count = max(1, min(config.cpu_budget, math.ceil(duration / CHUNK_SECONDS)))
+        bounds = split_at_keyframes(duration, await get_keyframes(input_path), count, CHUNK_SECONDS)
+
+    if len(bounds) > 1:
+        temp_dir = tempfile.mkdtemp(prefix='encode_', dir=os.path.dirname(os.path.abspath(output_path)))
+        try:
+            if await _encode_chunks(input_path, output_path, video_args, audio_inputs, audio_args, output_args,
+                                    info, bounds, temp_dir):
+                return True
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    command = ['ffmpeg', '-y', '-i', input_path, *audio_inputs, '-map', '0:v:0', *video_args]
+    command += audio_args if audio_args is not None else ['-an']
+    command += [*output_args, output_path]
+    await run_command(command)
+    get_metrics().inc("vedit_encode_total", {"mode": "single"})
+    return False
+
+
+async def _encode_chunks(input_path: str, output_path: str, video_args: list[str], audio_inputs: list[str],
+                         audio_args: Optional[list[str]], output_args: list[str],
+                         info: dict, bounds: list[float], temp_dir: str) -> bool:
+    # Every chunk gets its share of the budget, the scheduler decides how many run at once.
+    threads = max(1, get_config().cpu_budget // len(bounds))
+    segments = [os.path.join(temp_dir, f"segment_{i:04d}.mp4") for i in range(len(bounds))]
+
+    async def encode_chunk(i: int) -> None:
+        command = ['ffmpeg', '-y', '-ss', str(bounds[i])]
+        if i + 1 < len(bounds):
+            command += ['-t', str(bounds[i + 1] - bounds[i])]
+        command += ['-i', input_path, '-map', '0:v:0', *video_args, '-an', segments[i]]
+        await run_command(command, threads=threads)
+
+    async def encode_audio() -> Optional[str]:
+        if audio_args is None:
+            return None
+        # Matroska takes any audio codec.
+        audio_path = os.path.join(temp_dir, "audio.mka")
+        await run_command(['ffmpeg', '-y', '-i', input_path, *audio_inputs, *audio_args, '-vn', audio_path])
+        return audio_path
+
+    *_, audio_path = await asyncio.gather(*[encode_chunk(i) for i in range(len(bounds))], encode_audio())
+    joined = os.path.join(temp_dir, "joined" + os.path.splitext(output_path)[1])
+    await concat_segments(segments, joined, audio_path, output_args)
+
+    problem = await verify_output(joined, info["duration"], 1 + (audio_args is not None), info["fps"])
+    if problem is not None:
+        logger.warning(f"encode: the chunked encode of {input_path} has {problem}, encoding it in one process.")
+        get_metrics().inc("vedit_encode_total", {"mode": "chunked_rejected"})
+        return False
+    os.replace(joined, output_path)
+    logger.debug(f"encode: {input_path} encoded in {len(bounds)} chunks")
+    get_metrics().inc("vedit_encode_total", {"mode": "chunked"})
+    return True